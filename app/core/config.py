@@ -1,22 +1,12 @@
+from functools import lru_cache
 from pydantic_settings import BaseSettings
 from pydantic import Field
+from typing import Literal
 import os
 from base64 import b64decode
 from dotenv import load_dotenv
 from app.key_generation import generate_and_write_encryption_key, generate_and_write_jwt_secret_key
 
-generate_and_write_encryption_key()
-generate_and_write_jwt_secret_key()
-
-# Reload environment variables to ensure the new keys are loaded
-load_dotenv()
-
-
-# Updated Settings Class
-from pydantic_settings import BaseSettings
-from pydantic import Field
-from base64 import b64decode
-
 class Settings(BaseSettings):
     supabase_url: str = Field(..., env="SUPABASE_URL")
     supabase_key: str = Field(..., env="SUPABASE_KEY")
@@ -24,6 +14,59 @@ class Settings(BaseSettings):
     database_url: str = Field(..., env="DATABASE_URL")
     algorithm: str = "HS256"
     encryption_key: bytes
+    # Password hashing: bcrypt cost factor and the bounded pool that runs it off the event loop
+    bcrypt_rounds: int = Field(12, env="BCRYPT_ROUNDS")
+    password_pool_workers: int = Field(4, env="PASSWORD_POOL_WORKERS")
+    password_pool_max_queue: int = Field(64, env="PASSWORD_POOL_MAX_QUEUE")
+    # Cache of verified access tokens -> User principal used by get_current_user
+    token_cache_size: int = Field(10000, env="TOKEN_CACHE_SIZE")
+    token_cache_ttl: float = Field(300, env="TOKEN_CACHE_TTL")
+    # Pub/sub used to fan WebSocket events out across workers: memory:// or redis://host:port
+    broker_url: str = Field("memory://", env="BROKER_URL")
+    # Write-behind persistence of WebSocket messages: max operations per group commit and queue bound
+    ws_write_batch_size: int = Field(500, env="WS_WRITE_BATCH_SIZE")
+    ws_write_queue_size: int = Field(10000, env="WS_WRITE_QUEUE_SIZE")
+    # Username/email -> user id cache shared by REST and WebSocket paths; unknown names use the negative TTL
+    resolver_cache_size: int = Field(50000, env="RESOLVER_CACHE_SIZE")
+    resolver_cache_ttl: float = Field(300, env="RESOLVER_CACHE_TTL")
+    resolver_negative_ttl: float = Field(30, env="RESOLVER_NEGATIVE_TTL")
+    # Per-socket outbound queue bound and what to do when it fills: drop, coalesce or disconnect
+    ws_outbound_queue_size: int = Field(256, env="WS_OUTBOUND_QUEUE_SIZE")
+    ws_slow_consumer_policy: Literal["drop", "coalesce", "disconnect"] = Field("disconnect", env="WS_SLOW_CONSUMER_POLICY")
+    # Session resume: recent events kept in memory per user, and how long after the last socket closes
+    ws_replay_buffer_size: int = Field(256, env="WS_REPLAY_BUFFER_SIZE")
+    ws_resume_grace_seconds: float = Field(120, env="WS_RESUME_GRACE_SECONDS")
+    # Self-destruct scheduler: expiries held in memory (seconds ahead) and rows deleted per purge
+    expiry_horizon_seconds: float = Field(600, env="EXPIRY_HORIZON_SECONDS")
+    expiry_batch_size: int = Field(1000, env="EXPIRY_BATCH_SIZE")
+    # How often each worker also purges rows overdue by this long, e.g. left behind by a worker that died
+    expiry_sweep_interval_seconds: float = Field(60, env="EXPIRY_SWEEP_INTERVAL_SECONDS")
+    # Cache of per-conversation default TTLs consulted on every send
+    conversation_ttl_cache_size: int = Field(50000, env="CONVERSATION_TTL_CACHE_SIZE")
+    conversation_ttl_cache_ttl: float = Field(60, env="CONVERSATION_TTL_CACHE_TTL")
+    # Read receipts arriving within this many seconds are coalesced into one watermark write
+    receipt_flush_interval: float = Field(0.05, env="RECEIPT_FLUSH_INTERVAL")
+    # Per-user event log behind reconnect sync: events per group commit, retention, and replay limits
+    event_log_batch_size: int = Field(500, env="EVENT_LOG_BATCH_SIZE")
+    event_retention_seconds: float = Field(7 * 24 * 3600, env="EVENT_RETENTION_SECONDS")
+    sync_page_size: int = Field(500, env="SYNC_PAGE_SIZE")
+    # Clients further behind than this are told to resync over REST instead of replaying
+    sync_max_events: int = Field(10000, env="SYNC_MAX_EVENTS")
+    # Encrypted attachments: storage directory, plaintext bytes per encrypted chunk, largest upload accepted
+    attachment_dir: str = Field("attachments", env="ATTACHMENT_DIR")
+    attachment_chunk_size: int = Field(1024 * 1024, env="ATTACHMENT_CHUNK_SIZE")
+    attachment_max_size: int = Field(2 * 1024 ** 3, env="ATTACHMENT_MAX_SIZE")
+    # Attachments no message refers to (unfinished or never sent uploads) are deleted once this old
+    attachment_upload_ttl_seconds: float = Field(24 * 3600, env="ATTACHMENT_UPLOAD_TTL_SECONDS")
+    attachment_sweep_interval_seconds: float = Field(3600, env="ATTACHMENT_SWEEP_INTERVAL_SECONDS")
+    # Hot/cold tiering: messages older than this move from `messages` into compressed archive segments.
+    # Only ever lower it; reads assume nothing newer than the current age has been archived
+    archive_after_seconds: float = Field(180 * 24 * 3600, env="ARCHIVE_AFTER_SECONDS")
+    archive_interval_seconds: float = Field(3600, env="ARCHIVE_INTERVAL_SECONDS")
+    archive_batch_size: int = Field(5000, env="ARCHIVE_BATCH_SIZE")
+    archive_segment_size: int = Field(500, env="ARCHIVE_SEGMENT_SIZE")
+    # Level of the `app.*` loggers; DEBUG adds per-request detail
+    log_level: str = Field("INFO", env="LOG_LEVEL")
 
     class Config:
         env_file = ".env"
@@ -44,5 +87,15 @@ class Settings(BaseSettings):
 
         self.encryption_key = b64decode(encryption_key)
 
-# Instantiate settings
-settings = Settings()
\ No newline at end of file
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """
+    Load settings once per process, on first use rather than at import, so importing the app
+    (reloads, forked workers, tooling) does not touch `.env`.
+    """
+    generate_and_write_encryption_key()
+    generate_and_write_jwt_secret_key()
+
+    # Reload environment variables to ensure the new keys are loaded
+    load_dotenv()
+    return Settings()
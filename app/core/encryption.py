@@ -1,20 +1,12 @@
 from fastapi import HTTPException
 from jose import JWTError, jwt
 from Crypto.Cipher import AES
-from typing import Tuple
+from Crypto.Random import get_random_bytes
+from concurrent.futures import Executor
+from typing import Iterable, List, Optional, Sequence, Tuple
+import asyncio
 from datetime import datetime, timedelta
-import bcrypt
-from app.core.config import settings
-
-# Function to hash a password
-def hash_password(password: str) -> str:
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed.decode('utf-8')
-
-# Function to verify a password
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+from app.core.config import get_settings
 
 # Generate JWT Token
 def create_access_token(data: dict, expires_delta: timedelta = timedelta(hours=504)):
@@ -24,25 +16,94 @@ def create_access_token(data: dict, expires_delta: timedelta = timedelta(hours=5
         to_encode["sub"] = str(to_encode["sub"])
     expire = datetime.utcnow() + expires_delta
     to_encode.update({"exp": expire})
+    settings = get_settings()
     encoded_jwt = jwt.encode(to_encode, settings.jwt_secret_key, algorithm=settings.algorithm)
     return encoded_jwt
 
 
-# Encrypt a message using AES
+# AES-GCM: 12-byte nonces and a 16-byte tag appended to the ciphertext, so tampering is detected
+GCM_NONCE_SIZE = 12
+GCM_TAG_SIZE = 16
+
+
+# Encrypt a message using AES-GCM; returns (nonce, ciphertext + tag)
 def encrypt_message(plain_text: str) -> Tuple[bytes, bytes]:
-    cipher = AES.new(settings.encryption_key, AES.MODE_EAX)
-    ciphertext, tag = cipher.encrypt_and_digest(plain_text.encode())
-    return cipher.nonce, ciphertext
+    return encrypt_messages([plain_text])[0]
 
-# Decrypt a message using AES
+# Decrypt and authenticate a message; raises ValueError if it was tampered with
 def decrypt_message(nonce: bytes, ciphertext: bytes) -> str:
-    cipher = AES.new(settings.encryption_key, AES.MODE_EAX, nonce=nonce)
-    plain_text = cipher.decrypt(ciphertext).decode()
-    return plain_text
+    return decrypt_messages([(nonce, ciphertext)])[0]
+
+
+def encrypt_messages(plain_texts: Iterable[str], key: Optional[bytes] = None) -> List[Tuple[bytes, bytes]]:
+    """
+    Encrypt many messages with AES-GCM in one call: one RNG read for all nonces and no
+    per-message function-call overhead beyond the cipher itself.
+    """
+    key = key or get_settings().encryption_key
+    plain_texts = list(plain_texts)
+    randomness = get_random_bytes(GCM_NONCE_SIZE * len(plain_texts))
+    new_cipher, mode = AES.new, AES.MODE_GCM
+    encrypted = []
+    for index, plain_text in enumerate(plain_texts):
+        nonce = randomness[index * GCM_NONCE_SIZE:(index + 1) * GCM_NONCE_SIZE]
+        ciphertext, tag = new_cipher(key, mode, nonce=nonce).encrypt_and_digest(plain_text.encode())
+        encrypted.append((nonce, ciphertext + tag))
+    return encrypted
+
+
+def decrypt_messages(items: Iterable[Tuple[bytes, bytes]], key: Optional[bytes] = None) -> List[str]:
+    """
+    Decrypt and authenticate many (nonce, ciphertext) pairs. Fails fast with ValueError on the
+    first message whose tag does not verify.
+
+    Messages written before GCM used AES-EAX with a 16-byte nonce and no stored tag; those are
+    recognised by nonce length and decrypted without authentication.
+    """
+    key = key or get_settings().encryption_key
+    new_cipher, gcm, eax = AES.new, AES.MODE_GCM, AES.MODE_EAX
+    decrypted = []
+    for nonce, ciphertext in items:
+        if len(nonce) == GCM_NONCE_SIZE:
+            cipher = new_cipher(key, gcm, nonce=nonce)
+            plain = cipher.decrypt_and_verify(ciphertext[:-GCM_TAG_SIZE], ciphertext[-GCM_TAG_SIZE:])
+        else:
+            plain = new_cipher(key, eax, nonce=nonce).decrypt(ciphertext)
+        decrypted.append(plain.decode())
+    return decrypted
+
+
+async def decrypt_messages_parallel(
+        items: Sequence[Tuple[bytes, bytes]], executor: Optional[Executor] = None, chunk_size: int = 2000
+) -> List[str]:
+    """
+    Decrypt a large batch on an executor in chunks, off the event loop. Pass a
+    ProcessPoolExecutor to spread the work across cores; the key is sent explicitly so worker
+    processes do not depend on their own settings.
+    """
+    loop = asyncio.get_running_loop()
+    key = get_settings().encryption_key
+    chunks = [list(items[start:start + chunk_size]) for start in range(0, len(items), chunk_size)]
+    results = await asyncio.gather(*(loop.run_in_executor(executor, decrypt_messages, chunk, key) for chunk in chunks))
+    return [plain for chunk in results for plain in chunk]
+
+
+async def encrypt_messages_parallel(
+        plain_texts: Sequence[str], executor: Optional[Executor] = None, chunk_size: int = 2000
+) -> List[Tuple[bytes, bytes]]:
+    """
+    Encrypt a large batch on an executor in chunks, off the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    key = get_settings().encryption_key
+    chunks = [list(plain_texts[start:start + chunk_size]) for start in range(0, len(plain_texts), chunk_size)]
+    results = await asyncio.gather(*(loop.run_in_executor(executor, encrypt_messages, chunk, key) for chunk in chunks))
+    return [item for chunk in results for item in chunk]
 
 # Authenticate the JWT Token for WebSocket connections
 async def authenticate_websocket(token: str):
     try:
+        settings = get_settings()
         payload = jwt.decode(token, settings.jwt_secret_key, algorithms=[settings.algorithm])
         username: str = payload.get("sub")
         if username is None:
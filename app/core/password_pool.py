@@ -0,0 +1,78 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from fastapi import HTTPException, status
+import bcrypt
+from app.core.config import get_settings
+
+
+class PasswordPool:
+    """
+    Runs bcrypt hashing and verification off the event loop on a size-capped thread pool.
+
+    bcrypt releases the GIL while it works, so threads give real parallelism here. Jobs beyond
+    ``max_workers + max_queue`` are rejected with a 503 instead of piling up behind each other.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int, rounds: int):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.rounds = rounds
+        self.in_flight = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        Number of jobs waiting for a free worker thread.
+        """
+        return max(0, self.in_flight - self.max_workers)
+
+    def _release(self, _future):
+        with self._lock:
+            self.in_flight -= 1
+
+    async def _run(self, func, *args):
+        with self._lock:
+            if self.in_flight >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Server is busy, please retry shortly",
+                    headers={"Retry-After": "1"},
+                )
+            self.in_flight += 1
+        future = self._executor.submit(func, *args)
+        # A cancelled request does not stop a job that has already started, so the slot is freed
+        # when the thread finishes (or when a still-queued job is cancelled), not when we stop waiting
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def _hash(self, password: str) -> str:
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=self.rounds)).decode('utf-8')
+
+    @staticmethod
+    def _verify(plain_password: str, hashed_password: str) -> bool:
+        return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+    async def hash_password(self, password: str) -> str:
+        return await self._run(self._hash, password)
+
+    async def verify_password(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(self._verify, plain_password, hashed_password)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+@lru_cache(maxsize=None)
+def get_password_pool() -> PasswordPool:
+    settings = get_settings()
+    return PasswordPool(
+        max_workers=settings.password_pool_workers,
+        max_queue=settings.password_pool_max_queue,
+        rounds=settings.bcrypt_rounds,
+    )
@@ -0,0 +1,46 @@
+from typing import Any, Optional
+from fastapi.responses import Response
+from pydantic_core import to_json
+
+try:
+    import orjson
+except ImportError:  # optional: pip install ".[fast]"
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Encode plain dicts, lists, strings, numbers and datetimes to compact JSON bytes, with orjson
+    when it is installed and pydantic-core's encoder (no validation) otherwise. Both write UTC
+    datetimes with a "Z" suffix, as Pydantic models do, so bodies match the validated path.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_UTC_Z)
+    return to_json(content)
+
+
+class RawJSONResponse(Response):
+    """
+    JSON response for data that is already in its final shape, e.g. rows straight from the
+    database. Returning one from a route skips the validation and serialization FastAPI would
+    otherwise apply against the route's `response_model`; the model still documents the schema.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Whether an If-None-Match header lists `etag`, using the weak comparison RFC 9110 requires.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(_opaque_tag(candidate.strip()) == _opaque_tag(etag) for candidate in if_none_match.split(","))
+
+
+def _opaque_tag(etag: str) -> str:
+    return etag[2:] if etag.startswith("W/") else etag
@@ -1,22 +1,66 @@
 # app/db/__init__.py
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from app.core.config import settings
+from functools import lru_cache
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base
+from app.core.config import get_settings
+from app.core.metrics import instrument_engine
 
-# Create the SQLAlchemy engine
-engine = create_engine(settings.database_url)
+# Async drivers used for the plain URLs found in .env files
+ASYNC_DRIVERS = {
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def get_async_database_url(database_url: str) -> str:
+    """
+    Rewrite a plain database URL to use an async driver, e.g. postgresql:// -> postgresql+asyncpg://.
+    URLs that already name a driver are returned unchanged.
+    """
+    scheme, separator, rest = database_url.partition("://")
+    if not separator or "+" in scheme:
+        return database_url
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+
+
+@lru_cache(maxsize=None)
+def get_engine() -> AsyncEngine:
+    """
+    The async SQLAlchemy engine and its connection pool, created on first use in each worker.
+    Every statement it runs is timed into the db_query_duration_seconds histogram.
+    """
+    engine = create_async_engine(get_async_database_url(get_settings().database_url))
+    instrument_engine(engine)
+    return engine
+
+
+@lru_cache(maxsize=None)
+def get_sessionmaker() -> async_sessionmaker:
+    return async_sessionmaker(bind=get_engine(), class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+
+def SessionLocal() -> AsyncSession:
+    """
+    Open a session on this worker's engine.
+    """
+    return get_sessionmaker()()
+
+
+async def dispose_engine():
+    """
+    Close the pool on shutdown; the next `get_engine()` call starts a fresh one.
+    """
+    if get_engine.cache_info().currsize:
+        await get_engine().dispose()
+    get_sessionmaker.cache_clear()
+    get_engine.cache_clear()
 
-# Create a configured "Session" class
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Create a base class for the models
 Base = declarative_base()
 
 # Dependency to get the database session
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
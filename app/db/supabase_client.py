@@ -1,7 +1,11 @@
-from supabase import create_client, Client
-from app.core.config import settings
+from functools import lru_cache
+from app.core.config import get_settings
 
-def get_supabase_client() -> Client:
+@lru_cache(maxsize=None)
+def get_supabase_client():
+    """
+    The Supabase client, created on first use; the supabase package is only imported then.
+    """
+    from supabase import create_client
+    settings = get_settings()
     return create_client(settings.supabase_url, settings.supabase_key)
-
-supabase: Client = get_supabase_client()
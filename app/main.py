@@ -1,19 +1,102 @@
+from contextlib import asynccontextmanager
+import logging
 from fastapi import FastAPI
-import uvicorn
-from app.routers import auth, messaging
+from app.routers import attachments, auth, messaging, metrics
 from app.sockets import websocket_routes
+from app.services.archive import get_archiver
+from app.services.attachments import get_attachment_reaper
+from app.services.events import get_event_log
+from app.services.expiry import get_expiry_scheduler
+from app.services.receipts import get_receipt_coalescer
+from app.core.config import get_settings
+from app.core import metrics as app_metrics
+from app.core.password_pool import get_password_pool
+from app.db import dispose_engine, get_engine
 import os
 import sys
 
 # Add the parent directory to sys.path to resolve imports when running as a script
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-app = FastAPI()
 
-# Include routers for authentication, messaging, and WebSocket routes
-app.include_router(auth.router, prefix="/auth", tags=["auth"])
-app.include_router(messaging.router, prefix="/messaging", tags=["messaging"])
-app.include_router(websocket_routes.router, tags=["websockets"])
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Settings, the engine and the WebSocket services are built here, once per worker, not at import
+    settings = get_settings()
+    # uvicorn only configures its own loggers; without a root handler app.* records are dropped
+    logging.basicConfig(level=settings.log_level.upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    logging.getLogger("app").setLevel(settings.log_level.upper())
+    get_engine()
+    event_log = get_event_log()
+    manager = websocket_routes.get_manager()
+    writer = websocket_routes.get_writer()
+    expiry_scheduler = get_expiry_scheduler()
+    receipt_coalescer = get_receipt_coalescer()
+    archiver = get_archiver()
+    attachment_reaper = get_attachment_reaper()
+
+    # Queue depths are read when /metrics is scraped, so the hot paths do not pay for them
+    app_metrics.WS_CONNECTIONS.set_function(lambda: manager.connection_count)
+    app_metrics.WS_OUTBOUND_QUEUE_DEPTH.set_function(lambda: manager.queued_frames)
+    app_metrics.WS_RESUME_SESSIONS.set_function(lambda: len(manager.sessions))
+    app_metrics.WS_WRITE_QUEUE_DEPTH.set_function(lambda: writer.queue_depth)
+    app_metrics.EVENT_LOG_QUEUE_DEPTH.set_function(lambda: event_log.queue_depth)
+    app_metrics.EXPIRY_PENDING.set_function(lambda: expiry_scheduler.pending)
+    app_metrics.RECEIPTS_PENDING.set_function(lambda: receipt_coalescer.pending)
+    app_metrics.PASSWORD_POOL_QUEUE_DEPTH.set_function(lambda: get_password_pool().queue_depth)
+
+    # Every event pushed to sockets is logged per recipient first, for delta sync on reconnect
+    await event_log.start()
+    # Connect the WebSocket pub/sub broker and start the write-behind flusher for this worker
+    await manager.start()
+    await writer.start()
+    # Rebuild pending self-destruct timers from the expires_at index; purges are pushed to sockets
+    await expiry_scheduler.start(notify=manager.send_to_user)
+    await receipt_coalescer.start(notify=manager.send_to_users)
+    # Move old history out of the hot messages table into archive segments
+    await archiver.start()
+    # Delete uploads that were never finished or never sent
+    await attachment_reaper.start()
+    try:
+        yield
+    finally:
+        await attachment_reaper.close()
+        await archiver.close()
+        await receipt_coalescer.close()
+        await expiry_scheduler.close()
+        await writer.close()
+        await manager.close()
+        await event_log.close()
+        get_password_pool().shutdown()
+        await dispose_engine()
+
+
+def create_app() -> FastAPI:
+    """
+    Build the ASGI app. This only wires up routes and middleware; settings, clients and pools
+    are created by the lifespan hook in each worker, so building the app at import is cheap.
+    """
+    app = FastAPI(lifespan=lifespan)
+    # Per-route latency histograms, exposed with the other metrics at /metrics
+    app.add_middleware(app_metrics.MetricsMiddleware)
+
+    # Include routers for authentication, messaging, attachments, and WebSocket routes
+    for router, prefix, tag in (
+            (auth.router, "/auth", "auth"),
+            (messaging.router, "/messaging", "messaging"),
+            (attachments.router, "/attachments", "attachments"),
+            (websocket_routes.router, "", "websockets"),
+            (metrics.router, "", "metrics"),
+    ):
+        app.include_router(router, prefix=prefix, tags=[tag])
+        app_metrics.register_routes(router.routes, prefix)
+    return app
+
+
+# Module-level app for `uvicorn app.main:app`; `uvicorn app.main:create_app --factory` also works
+app = create_app()
+
+
 async def root():
     return {"message": "Welcome to Ranaglyph API"}
 
@@ -21,6 +104,7 @@ def start():
     """
     Entry point for running the server with Uvicorn.
     """
+    import uvicorn
     uvicorn.run("app.main:app", host="127.0.0.1", port=8000, reload=True)
 
 if __name__ == "__main__":
@@ -0,0 +1,30 @@
+from sqlalchemy import Column, BigInteger, Integer, ForeignKey, TIMESTAMP, Index, LargeBinary
+from sqlalchemy.sql import func
+from app.db import Base
+
+class ArchiveSegment(Base):
+    __tablename__ = 'archive_segments'
+    __table_args__ = (
+        # Paging back through one conversation's archive reads its segments newest first as a range scan
+        Index('ix_archive_segments_conversation', 'user_a_id', 'user_b_id', 'last_at', 'last_id'),
+        # Deleting an archived message looks for the segment by either participant
+        Index('ix_archive_segments_user_b', 'user_b_id'),
+    )
+
+    # Up to `archive_segment_size` consecutive messages of one conversation; only rewritten when one is deleted
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    # The conversation, lower user id first
+    user_a_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    user_b_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    # (timestamp, id) keys of the oldest and newest message inside
+    first_at = Column(TIMESTAMP(timezone=True), nullable=False)
+    first_id = Column(BigInteger, nullable=False)
+    last_at = Column(TIMESTAMP(timezone=True), nullable=False)
+    last_id = Column(BigInteger, nullable=False)
+    # Smallest and largest message id inside, which narrow the search for one message by id
+    min_id = Column(BigInteger, nullable=False)
+    max_id = Column(BigInteger, nullable=False)
+    message_count = Column(Integer, nullable=False)
+    # zlib-compressed MessagePack rows, oldest first
+    payload = Column(LargeBinary, nullable=False)
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False)
@@ -0,0 +1,25 @@
+from sqlalchemy import Column, BigInteger, Integer, String, ForeignKey, TIMESTAMP
+from sqlalchemy.sql import func
+from app.db import Base
+
+class Attachment(Base):
+    __tablename__ = 'attachments'
+
+    id = Column(Integer, primary_key=True)
+    owner_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    filename = Column(String, nullable=False)
+    content_type = Column(String, nullable=False)
+    # Plaintext size; the encrypted chunks themselves live on disk, not in the database
+    size = Column(BigInteger, nullable=False)
+    chunk_size = Column(Integer, nullable=False)
+    # Chunks are uploaded in order, so this is also the index of the next chunk to send
+    received_chunks = Column(Integer, nullable=False, default=0, server_default='0')
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False)
+
+    @property
+    def chunk_count(self) -> int:
+        return -(-self.size // self.chunk_size)
+
+    @property
+    def complete(self) -> bool:
+        return self.received_chunks >= self.chunk_count
@@ -0,0 +1,44 @@
+from sqlalchemy import Column, BigInteger, Integer, ForeignKey, TIMESTAMP, Index, LargeBinary
+from app.db import Base
+
+class ConversationSetting(Base):
+    __tablename__ = 'conversation_settings'
+
+    # One row per pair of users, stored with the lower id first so either side finds the same row
+    user_a_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    user_b_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    # Default self-destruct timer for new messages in this conversation; NULL keeps messages forever
+    message_ttl_seconds = Column(Integer, nullable=True)
+
+
+class ReadReceipt(Base):
+    __tablename__ = 'read_receipts'
+
+    # Watermarks of `user_id` (the reader) over the messages `peer_id` has sent them
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    peer_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    # Every message from the peer with an id up to these is delivered / seen; they only move forward
+    delivered_up_to = Column(BigInteger, nullable=False, default=0, server_default='0')
+    seen_up_to = Column(BigInteger, nullable=False, default=0, server_default='0')
+
+
+class ConversationSummary(Base):
+    __tablename__ = 'conversation_summaries'
+    __table_args__ = (
+        # The inbox: one user's conversations by last activity, read as a single range scan
+        Index('ix_conversation_summaries_inbox', 'user_id', 'last_message_at', 'last_message_id'),
+    )
+
+    # One row per side of a conversation: `user_id`'s view of their conversation with `peer_id`
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    peer_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    last_message_id = Column(BigInteger, nullable=False)
+    last_message_at = Column(TIMESTAMP(timezone=True), nullable=False)
+    last_sender_id = Column(Integer, nullable=False)
+    # The start of the last message, encrypted like message bodies
+    preview_nonce = Column(LargeBinary, nullable=False)
+    preview_ciphertext = Column(LargeBinary, nullable=False)
+    # Messages from the peer after the user's seen watermark
+    unread_count = Column(Integer, nullable=False, default=0, server_default='0')
+    # Bumped by every change to the conversation's messages or watermarks; validates cached history pages
+    version = Column(BigInteger, nullable=False, default=1, server_default='1')
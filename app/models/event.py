@@ -0,0 +1,26 @@
+from sqlalchemy import Column, BigInteger, Integer, String, ForeignKey, TIMESTAMP, Index, LargeBinary
+from sqlalchemy.sql import func
+from app.db import Base
+
+class UserEvent(Base):
+    __tablename__ = 'user_events'
+    __table_args__ = (
+        # A reconnecting client reads only its own events after the last id it saw, as one range scan
+        Index('ix_user_events_user_id_id', 'user_id', 'id'),
+    )
+
+    # Increases with every event, so it doubles as each user's sync position
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    type = Column(String, nullable=False)
+    # The event as pushed to sockets, MessagePack-encoded so nonces and ciphertext stay raw bytes
+    payload = Column(LargeBinary, nullable=False)
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False)
+
+
+class EventLogHorizon(Base):
+    __tablename__ = 'event_log_horizon'
+
+    # A single row shared by every worker: events with an id up to `pruned_up_to` may have been pruned
+    id = Column(Integer, primary_key=True)
+    pruned_up_to = Column(BigInteger, nullable=False, default=0, server_default='0')
@@ -1,15 +1,33 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy import Column, Integer, String, ForeignKey, TIMESTAMP, Index, LargeBinary, text
 from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
 from app.db import Base
 
 class Message(Base):
     __tablename__ = 'messages'
+    __table_args__ = (
+        # Serves both directions of a conversation and keyset pagination on (timestamp, id)
+        Index('ix_messages_conversation', 'sender_id', 'receiver_id', 'timestamp', 'id'),
+        # Lets the expiry scheduler load its next window as a range scan over self-destructing rows only
+        Index('ix_messages_expires_at', 'expires_at',
+              postgresql_where=text('expires_at IS NOT NULL'), sqlite_where=text('expires_at IS NOT NULL')),
+        # Download access checks look up the messages that share an attachment
+        Index('ix_messages_attachment_id', 'attachment_id',
+              postgresql_where=text('attachment_id IS NOT NULL'), sqlite_where=text('attachment_id IS NOT NULL')),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     sender_id = Column(Integer, ForeignKey('users.id'))
     receiver_id = Column(Integer, ForeignKey('users.id'))
     content = Column(String)
-    timestamp = Column(String)
+    # Encrypted messages (WebSocket path) store the AES nonce and ciphertext as raw bytes
+    nonce = Column(LargeBinary, nullable=True)
+    ciphertext = Column(LargeBinary, nullable=True)
+    timestamp = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False)
     status = Column(String)
+    # Self-destructing messages are purged once this passes; NULL means the message never expires
+    expires_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    # Encrypted file sent with the message, stored in chunks outside the table
+    attachment_id = Column(Integer, ForeignKey('attachments.id'), nullable=True)
     sender = relationship('User', foreign_keys=[sender_id])
-    receiver = relationship('User', foreign_keys=[receiver_id])
\ No newline at end of file
+    receiver = relationship('User', foreign_keys=[receiver_id])
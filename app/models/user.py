@@ -1,11 +1,12 @@
-from sqlalchemy import Column, BigInteger, String, Text, Boolean, TIMESTAMP
+from sqlalchemy import Column, BigInteger, Integer, String, Text, Boolean, TIMESTAMP
 from sqlalchemy.sql import func
 from app.db import Base
 
 class User(Base):
     __tablename__ = 'users'
 
-    id = Column(BigInteger, primary_key=True, index=True)
+    # SQLite only autoincrements INTEGER primary keys, so use that for the local stand-in database
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, index=True)
     username = Column(String, unique=True, index=True, nullable=False)
     email = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(Text, nullable=False)
@@ -0,0 +1,114 @@
+from fastapi import APIRouter, HTTPException, Depends, Header, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from urllib.parse import quote
+import logging
+from fastapi.security import OAuth2PasswordBearer
+from app.schemas.attachment import AttachmentCreate, AttachmentResponse
+from app.schemas.user import User
+from app.services.attachments import (
+    chunk_length,
+    create_attachment,
+    get_attachment,
+    get_attachment_store,
+    parse_byte_range,
+    upload_chunk,
+)
+from app.services.auth import get_current_user
+from app.db import get_db
+
+router = APIRouter()
+
+logger = logging.getLogger(__name__)
+
+# Define OAuth2 scheme
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
+
+
+@router.post("", response_model=AttachmentResponse, summary="Start an attachment upload")
+async def start_upload(
+        request: AttachmentCreate,
+        db: AsyncSession = Depends(get_db),
+        token: str = Depends(oauth2_scheme),  # Token is automatically extracted from the Authorization header
+        current_user: User = Depends(get_current_user)
+):
+    """
+    Endpoint to register a file of a known size. The response gives the chunk size and count;
+    upload the chunks in order, then send a message with the returned `id` as its `attachment_id`.
+    """
+    logger.debug("Current user attempting to start an upload: %s", current_user.username)
+    return await create_attachment(current_user.id, request, db)
+
+
+@router.get("/{attachment_id}", response_model=AttachmentResponse, summary="Get an attachment's upload state")
+async def get_upload(
+        attachment_id: int,
+        db: AsyncSession = Depends(get_db),
+        token: str = Depends(oauth2_scheme),  # Token is automatically extracted from the Authorization header
+        current_user: User = Depends(get_current_user)
+):
+    """
+    Endpoint to read an attachment's metadata; `received_chunks` is where an interrupted upload resumes.
+    """
+    return await get_attachment(attachment_id, current_user.id, db)
+
+
+@router.put("/{attachment_id}/chunks/{index}", response_model=AttachmentResponse, summary="Upload one chunk")
+async def put_chunk(
+        attachment_id: int,
+        index: int,
+        request: Request,
+        db: AsyncSession = Depends(get_db),
+        token: str = Depends(oauth2_scheme),  # Token is automatically extracted from the Authorization header
+        current_user: User = Depends(get_current_user)
+):
+    """
+    Endpoint to upload chunk `index` as the raw request body. The body is encrypted and written
+    to disk as it streams in, so it is never held in memory whole.
+    """
+    attachment = await get_attachment(attachment_id, current_user.id, db)
+    if attachment.owner_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Only the uploader can add chunks.")
+
+    # Reject a wrong-sized chunk from its headers before reading the body
+    content_length = request.headers.get("content-length")
+    if (content_length is not None and content_length.isdigit() and 0 <= index < attachment.chunk_count
+            and int(content_length) != chunk_length(attachment, index)):
+        raise HTTPException(status_code=400, detail=f"Chunk {index} must be {chunk_length(attachment, index)} bytes.")
+
+    attachment = await upload_chunk(attachment, index, request.stream(), db)
+    logger.debug("Attachment %s has %s of %s chunks", attachment.id, attachment.received_chunks, attachment.chunk_count)
+    return attachment
+
+
+@router.get("/{attachment_id}/content", response_class=StreamingResponse, summary="Download an attachment")
+async def download(
+        attachment_id: int,
+        byte_range: Optional[str] = Header(None, alias="Range", description="A single byte range, e.g. bytes=0-1048575"),
+        db: AsyncSession = Depends(get_db),
+        token: str = Depends(oauth2_scheme),  # Token is automatically extracted from the Authorization header
+        current_user: User = Depends(get_current_user)
+):
+    """
+    Endpoint to stream a decrypted attachment, whole or a single byte range (206 Partial Content).
+    Only the chunks the range spans are read, one at a time.
+    """
+    attachment = await get_attachment(attachment_id, current_user.id, db)
+    if not attachment.complete:
+        raise HTTPException(status_code=409, detail="Attachment upload is not complete.")
+
+    requested = parse_byte_range(byte_range, attachment.size)
+    start, end = requested or (0, attachment.size - 1)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(end - start + 1),
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(attachment.filename)}",
+        "Cache-Control": "private, max-age=31536000, immutable",
+    }
+    if requested is not None:
+        headers["Content-Range"] = f"bytes {start}-{end}/{attachment.size}"
+
+    body = get_attachment_store().stream(attachment.id, attachment.chunk_size, start, end) if attachment.size else iter(())
+    return StreamingResponse(body, status_code=206 if requested else 200, media_type=attachment.content_type,
+                             headers=headers)
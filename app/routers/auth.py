@@ -1,15 +1,15 @@
 from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.schemas.user import SignupRequest, LoginRequest, LoginResponse, UpdateUserRequest, User
-from app.services.auth import signup_user, login_user, get_current_user, update_user
+from app.services.auth import signup_user, login_user, get_current_user, update_user, deactivate_user
 from app.db import get_db
 
 router = APIRouter()
 
 
 @router.post("/login", response_model=LoginResponse)
-async def login(request: LoginRequest, db: Session = Depends(get_db)):
-    user_data = login_user(request, db)
+async def login(request: LoginRequest, db: AsyncSession = Depends(get_db)):
+    user_data = await login_user(request, db)
     if user_data:
         user = User(
             id=user_data["user_id"],
@@ -27,11 +27,17 @@ async def login(request: LoginRequest, db: Session = Depends(get_db)):
 
 
 @router.post("/signup", response_model=dict)
-async def signup(request: SignupRequest, db: Session = Depends(get_db)):
-    return signup_user(request, db)
+async def signup(request: SignupRequest, db: AsyncSession = Depends(get_db)):
+    return await signup_user(request, db)
 
 
 @router.put("/user/update", response_model=User, summary="Update user profile")
-async def update_user_profile(request: UpdateUserRequest, db: Session = Depends(get_db), current_user: User= Depends(get_current_user)):
-    updated_user = update_user(current_user.id, request, db)
-    return updated_user
\ No newline at end of file
+async def update_user_profile(request: UpdateUserRequest, db: AsyncSession = Depends(get_db), current_user: User= Depends(get_current_user)):
+    updated_user = await update_user(current_user.id, request, db)
+    return updated_user
+
+
+@router.delete("/user", response_model=dict, summary="Deactivate the current user's account")
+async def deactivate_user_account(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    await deactivate_user(current_user.id, db)
+    return {"detail": "Account deactivated"}
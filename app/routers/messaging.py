@@ -1,19 +1,34 @@
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, Header, Query
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
 import logging
 from fastapi.security import OAuth2PasswordBearer
-from app.services.messaging import MessagingService
-from app.schemas.message import MessageCreate, MessageResponse, MessageRequest
+from app.core.serialization import RawJSONResponse, etag_matches
+from app.services.messaging import MessagingService, decode_cursor, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.schemas.message import (
+    BatchMessageRequest,
+    BatchMessageResponse,
+    ConversationTTLRequest,
+    ConversationTTLResponse,
+    InboxPage,
+    MessageCreate,
+    MessagePage,
+    MessageResponse,
+    MessageRequest,
+)
 from app.schemas.user import User
-from app.services.auth import get_current_user
-from app.models.user import User as UserModel
+from app.services.auth import (
+    get_current_user,
+    get_user_ids_by_identifiers,
+    resolve_user_id_by_email,
+    resolve_user_id_by_username,
+)
 from app.db import get_db
 
 router = APIRouter()
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
 
 # Define OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
@@ -24,85 +39,244 @@ messaging_service = MessagingService()
 @router.post("/send", response_model=MessageResponse, summary="Send a message to another user")
 async def send_message(
         request: MessageRequest,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         token: str = Depends(oauth2_scheme),  # Token is automatically extracted from the Authorization header
         current_user: User = Depends(get_current_user)
 ):
     """
     Endpoint to send a message.
     """
-    logging.info(f"Current user attempting to send a message: {current_user.username}")
+    logger.debug("Current user attempting to send a message: %s", current_user.username)
 
     # Ensure current user is available
     if not current_user:
-        logging.error("Current user is None after token validation.")
+        logger.error("Current user is None after token validation.")
         raise HTTPException(status_code=401, detail="Unauthorized")
 
     # Find the recipient user based on the provided username or email
-    receiver = None
+    receiver_id = None
     if request.receiver_username:
-        receiver = db.query(UserModel).filter(UserModel.username == request.receiver_username).first()
+        receiver_id = await resolve_user_id_by_username(request.receiver_username, db)
     elif request.receiver_email:
-        receiver = db.query(UserModel).filter(UserModel.email == request.receiver_email).first()
+        receiver_id = await resolve_user_id_by_email(request.receiver_email, db)
 
-    if not receiver:
-        logging.error("Receiver not found.")
+    if receiver_id is None:
+        logger.error("Receiver not found.")
         raise HTTPException(status_code=404, detail="Receiver not found.")
 
-    logging.info(f"Receiver found: {receiver.username}")
+    logger.debug("Receiver found: %s", receiver_id)
 
     # Prepare the message data
     message_data = MessageCreate(
         sender_id=current_user.id,
-        receiver_id=receiver.id,
-        content=request.content
+        receiver_id=receiver_id,
+        content=request.content,
+        ttl_seconds=request.ttl_seconds,
+        attachment_id=request.attachment_id
     )
 
     try:
         # Send the message
         message = await messaging_service.send_message(message_data, db)
-        logging.info(f"Message successfully sent from {current_user.username} to {receiver.username}.")
+        logger.debug("Message successfully sent from %s to user ID %s.", current_user.username, receiver_id)
         return message
+    except HTTPException:
+        # e.g. an attachment that is not the sender's or not fully uploaded
+        raise
     except Exception as e:
-        logging.error(f"Failed to send message: {e}")
+        logger.error("Failed to send message: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to send message: {str(e)}")
 
 
-@router.get("/get/{user_id}", response_model=List[MessageResponse], summary="Retrieve messages with a specific user")
+@router.post("/send/batch", response_model=BatchMessageResponse, summary="Send many messages in one request")
+async def send_messages_batch(
+        request: BatchMessageRequest,
+        db: AsyncSession = Depends(get_db),
+        token: str = Depends(oauth2_scheme),  # Token is automatically extracted from the Authorization header
+        current_user: User = Depends(get_current_user)
+):
+    """
+    Endpoint to send a batch of messages.
+    Receivers are resolved with one query and all messages are stored in one transaction.
+    Results come back in request order; messages whose receiver cannot be found carry an error.
+    """
+    logger.debug("Current user attempting to send %s messages: %s", len(request.messages), current_user.username)
+
+    receivers_by_username, receivers_by_email = await get_user_ids_by_identifiers(
+        [item.receiver_username for item in request.messages if item.receiver_username],
+        [item.receiver_email for item in request.messages if item.receiver_email and not item.receiver_username],
+        db,
+    )
+
+    # Plain dicts in the BatchMessageResult shape; the response is encoded without revalidation
+    results = [{"index": index, "message": None, "error": None} for index in range(len(request.messages))]
+    pending_indexes, pending_messages = [], []
+    for index, item in enumerate(request.messages):
+        if item.receiver_username:
+            receiver_id = receivers_by_username.get(item.receiver_username)
+        else:
+            receiver_id = receivers_by_email.get(item.receiver_email)
+        if receiver_id is None:
+            results[index]["error"] = "Receiver not found."
+            continue
+        pending_indexes.append(index)
+        pending_messages.append(MessageCreate(
+            sender_id=current_user.id, receiver_id=receiver_id, content=item.content, ttl_seconds=item.ttl_seconds,
+            attachment_id=item.attachment_id
+        ))
+
+    try:
+        created = await messaging_service.send_messages(pending_messages, db, raw=True)
+    except HTTPException:
+        # e.g. an attachment that is not the sender's or not fully uploaded
+        raise
+    except Exception as e:
+        logger.error("Failed to send messages: %s", e)
+        raise HTTPException(status_code=500, detail=f"Failed to send messages: {str(e)}")
+
+    for index, message in zip(pending_indexes, created):
+        results[index]["message"] = message
+
+    logger.debug("%s of %s messages sent by %s.", len(created), len(results), current_user.username)
+    return RawJSONResponse({"results": results, "sent": len(created), "failed": len(results) - len(created)})
+
+
+@router.get("/get/{user_id}", response_model=MessagePage, summary="Retrieve messages with a specific user")
 async def get_messages(
         user_id: int,  # Assuming user_id is an integer
-        db: Session = Depends(get_db),
+        before: Optional[str] = Query(None, description="Cursor: return messages older than this one"),
+        after: Optional[str] = Query(None, description="Cursor: return messages newer than this one"),
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+        if_none_match: Optional[str] = Header(None, description="ETag of a page the client already has"),
+        db: AsyncSession = Depends(get_db),
         token: str = Depends(oauth2_scheme),  # Token is automatically extracted from the Authorization header
         current_user: User = Depends(get_current_user)
 ):
     """
-    Endpoint to get messages between the current user and a specific user.
+    Endpoint to get one page of messages between the current user and a specific user.
+    Pages carry an ETag; polling with If-None-Match gets a bodyless 304 while the page is unchanged.
     """
-    logging.info(f"Current user attempting to retrieve messages: {current_user.username}")
+    logger.debug("Current user attempting to retrieve messages: %s", current_user.username)
 
     if not current_user:
-        logging.error("Current user is None after token validation.")
+        logger.error("Current user is None after token validation.")
         raise HTTPException(status_code=401, detail="Unauthorized")
 
     if user_id == current_user.id:
-        logging.error("User attempted to retrieve messages with themselves.")
+        logger.error("User attempted to retrieve messages with themselves.")
         raise HTTPException(status_code=400, detail="Cannot retrieve messages with yourself.")
 
-    logging.info(f"Retrieving messages between {current_user.username} and user ID {user_id}")
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either 'before' or 'after', not both.")
+    before_cursor = decode_cursor(before) if before else None
+    after_cursor = decode_cursor(after) if after else None
+
+    logger.debug("Retrieving messages between %s and user ID %s", current_user.username, user_id)
 
     try:
-        messages = await messaging_service.get_messages(current_user.id, user_id, db)
-        logging.info(f"Messages between {current_user.username} and user ID {user_id} retrieved successfully.")
-        return messages
+        # One summary lookup decides whether the messages need to be read at all
+        etag = await messaging_service.conversation_etag(
+            current_user.id, user_id, db, before=before_cursor, after=after_cursor, limit=limit
+        )
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if etag_matches(if_none_match, etag):
+            logger.debug("Messages between %s and user ID %s not modified.", current_user.username, user_id)
+            return Response(status_code=304, headers=headers)
+
+        page = await messaging_service.get_messages(
+            current_user.id, user_id, db, before=before_cursor, after=after_cursor, limit=limit, raw=True
+        )
+        logger.debug("Messages between %s and user ID %s retrieved successfully.", current_user.username, user_id)
+        # Rows go straight to JSON; response_model only documents the shape
+        return RawJSONResponse(page, headers=headers)
     except Exception as e:
-        logging.error(f"Failed to retrieve messages: {e}")
+        logger.error("Failed to retrieve messages: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to retrieve messages: {str(e)}")
 
 
+@router.get("/inbox", response_model=InboxPage, summary="List conversations by last activity")
+async def get_inbox(
+        before: Optional[str] = Query(None, description="Cursor: return conversations active before this one"),
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+        db: AsyncSession = Depends(get_db),
+        token: str = Depends(oauth2_scheme),  # Token is automatically extracted from the Authorization header
+        current_user: User = Depends(get_current_user)
+):
+    """
+    Endpoint to list the current user's conversations, most recently active first,
+    each with a preview of the last message and the number of unread messages.
+    """
+    logger.debug("Current user attempting to retrieve their inbox: %s", current_user.username)
+    before_cursor = decode_cursor(before) if before else None
+    return await messaging_service.get_inbox(current_user.id, db, before=before_cursor, limit=limit)
+
+
+@router.get("/export/{user_id}", summary="Export the full conversation with a specific user as NDJSON",
+            response_class=StreamingResponse)
+async def export_messages(
+        user_id: int,
+        token: str = Depends(oauth2_scheme),  # Token is automatically extracted from the Authorization header
+        current_user: User = Depends(get_current_user)
+):
+    """
+    Endpoint to stream every message between the current user and a specific user,
+    one JSON object per line, oldest first.
+    """
+    logger.debug("Current user attempting to export messages: %s", current_user.username)
+
+    if user_id == current_user.id:
+        logger.error("User attempted to export messages with themselves.")
+        raise HTTPException(status_code=400, detail="Cannot export messages with yourself.")
+
+    return StreamingResponse(
+        messaging_service.export_messages(current_user.id, user_id),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="conversation-{user_id}.ndjson"'},
+    )
+
+
+@router.get("/ttl/{user_id}", response_model=ConversationTTLResponse,
+            summary="Get the self-destruct timer for a conversation")
+async def get_conversation_ttl(
+        user_id: int,
+        db: AsyncSession = Depends(get_db),
+        token: str = Depends(oauth2_scheme),  # Token is automatically extracted from the Authorization header
+        current_user: User = Depends(get_current_user)
+):
+    """
+    Endpoint to read the default TTL applied to new messages between the current user and a specific user.
+    """
+    ttl_seconds = await messaging_service.get_conversation_ttl(current_user.id, user_id, db)
+    return ConversationTTLResponse(user_id=current_user.id, peer_id=user_id, ttl_seconds=ttl_seconds)
+
+
+@router.put("/ttl/{user_id}", response_model=ConversationTTLResponse,
+            summary="Set the self-destruct timer for a conversation")
+async def set_conversation_ttl(
+        user_id: int,
+        request: ConversationTTLRequest,
+        db: AsyncSession = Depends(get_db),
+        token: str = Depends(oauth2_scheme),  # Token is automatically extracted from the Authorization header
+        current_user: User = Depends(get_current_user)
+):
+    """
+    Endpoint to set the default TTL for new messages between the current user and a specific user.
+    Either participant can change it; a null `ttl_seconds` turns self-destruct off.
+    """
+    logger.debug("Current user attempting to set a conversation TTL: %s", current_user.username)
+
+    if user_id == current_user.id:
+        logger.error("User attempted to set a TTL for a conversation with themselves.")
+        raise HTTPException(status_code=400, detail="Cannot set a TTL for a conversation with yourself.")
+
+    await messaging_service.set_conversation_ttl(current_user.id, user_id, request.ttl_seconds, db)
+    return ConversationTTLResponse(user_id=current_user.id, peer_id=user_id, ttl_seconds=request.ttl_seconds)
+
+
 @router.delete("/delete/{message_id}", summary="Delete a specific message")
 async def delete_message(
         message_id: int,  # Assuming message_id is an integer
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         token: str = Depends(oauth2_scheme),  # Token is automatically extracted from the Authorization header
         current_user: User = Depends(get_current_user)
 ):
@@ -110,16 +284,19 @@ async def delete_message(
     Endpoint to delete a message by its ID.
     Only the sender can delete a message.
     """
-    logging.info(f"Current user attempting to delete a message: {current_user.username}")
+    logger.debug("Current user attempting to delete a message: %s", current_user.username)
 
     if not current_user:
-        logging.error("Current user is None after token validation.")
+        logger.error("Current user is None after token validation.")
         raise HTTPException(status_code=401, detail="Unauthorized")
 
     try:
         await messaging_service.delete_message(message_id, current_user.id, db)
-        logging.info(f"Message with ID {message_id} deleted successfully by user {current_user.username}.")
+        logger.debug("Message with ID %s deleted successfully by user %s.", message_id, current_user.username)
         return {"detail": "Message deleted successfully"}
+    except HTTPException:
+        # 404 for an unknown message, 403 for someone else's, 409 for a concurrent archive rewrite
+        raise
     except Exception as e:
-        logging.error(f"Failed to delete message: {e}")
+        logger.error("Failed to delete message: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to delete message: {str(e)}")
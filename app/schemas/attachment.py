@@ -0,0 +1,26 @@
+from pydantic import BaseModel, Field
+from datetime import datetime
+
+
+class AttachmentCreate(BaseModel):
+    filename: str = Field(..., min_length=1, max_length=255)
+    content_type: str = Field("application/octet-stream", max_length=255)
+    # Plaintext size in bytes; fixes how many chunks the upload takes
+    size: int = Field(..., ge=0)
+
+
+class AttachmentResponse(BaseModel):
+    id: int
+    owner_id: int
+    filename: str
+    content_type: str
+    size: int
+    # Upload chunk `received_chunks` next, `chunk_size` bytes each (the last one may be shorter)
+    chunk_size: int
+    chunk_count: int
+    received_chunks: int
+    complete: bool
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
@@ -1,15 +1,25 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
+from typing import List, Optional
+
+# Longest self-destruct timer accepted for a message or a conversation (one year)
+MAX_TTL_SECONDS = 365 * 24 * 3600
 
 class MessageCreate(BaseModel):
     sender_id: int
     receiver_id: int
     content: str
+    # Self-destruct after this many seconds; None falls back to the conversation's default
+    ttl_seconds: Optional[int] = None
+    attachment_id: Optional[int] = None
 
 class MessageRequest(BaseModel):
     receiver_username: str | None = None
     receiver_email: str | None = None
     content: str
+    ttl_seconds: Optional[int] = Field(None, gt=0, le=MAX_TTL_SECONDS)
+    # A completed upload from POST /attachments; `content` can then be an empty caption
+    attachment_id: Optional[int] = None
 
 class MessageResponse(BaseModel):
     id: int
@@ -17,3 +27,57 @@ class MessageResponse(BaseModel):
     receiver_id: int
     content: str
     timestamp: datetime
+    expires_at: Optional[datetime] = None
+    attachment_id: Optional[int] = None
+    # sent, delivered or seen, derived from the receiver's read-receipt watermarks
+    status: str = "sent"
+
+# Upper bound on the number of messages accepted by a single batch send
+MAX_BATCH_SIZE = 5000
+
+class BatchMessageRequest(BaseModel):
+    messages: List[MessageRequest] = Field(..., min_length=1, max_length=MAX_BATCH_SIZE)
+
+class BatchMessageResult(BaseModel):
+    # Position of the message in the request's `messages` list
+    index: int
+    message: Optional[MessageResponse] = None
+    error: Optional[str] = None
+
+class BatchMessageResponse(BaseModel):
+    results: List[BatchMessageResult]
+    sent: int
+    failed: int
+
+class MessagePage(BaseModel):
+    messages: List[MessageResponse]
+    # Pass as `before` to fetch older messages, or as `after` to fetch newer ones
+    before_cursor: Optional[str] = None
+    after_cursor: Optional[str] = None
+    # Whether more messages exist beyond this page in the requested direction
+    has_more: bool = False
+
+class ConversationTTLRequest(BaseModel):
+    # Default self-destruct timer for new messages with this user; None turns it off
+    ttl_seconds: Optional[int] = Field(None, gt=0, le=MAX_TTL_SECONDS)
+
+class ConversationTTLResponse(BaseModel):
+    user_id: int
+    peer_id: int
+    ttl_seconds: Optional[int] = None
+
+class InboxEntry(BaseModel):
+    peer_id: int
+    peer_username: Optional[str] = None
+    last_message_id: int
+    last_message_at: datetime
+    last_sender_id: int
+    # The start of the last message, decrypted
+    preview: str
+    unread_count: int = 0
+
+class InboxPage(BaseModel):
+    # Most recently active first
+    conversations: List[InboxEntry]
+    # Pass as `before` to fetch the next (older) page
+    next_cursor: Optional[str] = None
@@ -0,0 +1,404 @@
+import asyncio
+import logging
+import zlib
+from collections import deque, namedtuple
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+import msgpack
+from sqlalchemy import and_, delete, func, insert, or_, select, update
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import get_settings
+from app.core.metrics import MESSAGES_ARCHIVED
+from app.db import SessionLocal
+from app.models.archive import ArchiveSegment
+from app.models.message import Message as MessageModel
+from app.services.expiry import conversation_key
+
+logger = logging.getLogger(__name__)
+
+# A message read back from an archive segment; attribute-compatible with `messages` rows
+ArchivedMessage = namedtuple(
+    "ArchivedMessage",
+    "id sender_id receiver_id content nonce ciphertext timestamp status expires_at attachment_id",
+)
+
+# The columns moved into segments, in ArchivedMessage order
+ARCHIVE_COLUMNS = tuple(getattr(MessageModel, field) for field in ArchivedMessage._fields)
+
+# Segments fetched per round-trip while paging through an archive
+SEGMENT_FETCH_SIZE = 4
+
+
+def _utc(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes; everything is stored in UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def _micros(value: Optional[datetime]) -> Optional[int]:
+    if value is None:
+        return None
+    delta = _utc(value) - datetime(1970, 1, 1, tzinfo=timezone.utc)
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _datetime(micros: Optional[int]) -> Optional[datetime]:
+    if micros is None:
+        return None
+    return datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(microseconds=micros)
+
+
+def message_key(row) -> Tuple[datetime, int]:
+    """
+    The (timestamp, id) order of messages, comparable across hot rows and archived ones.
+    """
+    return _utc(row.timestamp), row.id
+
+
+def encode_segment(rows: List) -> bytes:
+    packed = [
+        [row.id, row.sender_id, row.receiver_id, row.content, row.nonce, row.ciphertext, _micros(row.timestamp),
+         row.status, _micros(row.expires_at), row.attachment_id]
+        for row in rows
+    ]
+    return zlib.compress(msgpack.packb(packed, use_bin_type=True))
+
+
+def decode_segment(payload: bytes) -> List[ArchivedMessage]:
+    return [
+        ArchivedMessage(id, sender_id, receiver_id, content, nonce, ciphertext, _datetime(timestamp), status,
+                        _datetime(expires_at), attachment_id)
+        for id, sender_id, receiver_id, content, nonce, ciphertext, timestamp, status, expires_at, attachment_id
+        in msgpack.unpackb(zlib.decompress(payload), raw=False)
+    ]
+
+
+def archive_horizon(now: Optional[datetime] = None) -> datetime:
+    """
+    Nothing newer than this has been archived, so pages that stay above it never read the archive.
+    """
+    return (now or datetime.now(timezone.utc)) - timedelta(seconds=get_settings().archive_after_seconds)
+
+
+def reaches_archive(candidates: List, after: Optional[Tuple[datetime, int]], limit: int, now: datetime) -> bool:
+    """
+    Whether a page built from `candidates`, the up to `limit + 1` hot rows in the page's order,
+    could include archived messages: it walks forward from a cursor older than the archive
+    horizon, or walks back and is either short or already reaches below the horizon.
+    """
+    horizon = archive_horizon(now)
+    if after is not None:
+        return _utc(after[0]) < horizon
+    return len(candidates) <= limit or message_key(candidates[-1])[0] < horizon
+
+
+def _segment_filter(user_id: int, peer_id: int):
+    user_a, user_b = conversation_key(user_id, peer_id)
+    return and_(ArchiveSegment.user_a_id == user_a, ArchiveSegment.user_b_id == user_b)
+
+
+async def load_archived(
+        db: AsyncSession,
+        user_id: int,
+        peer_id: int,
+        before: Optional[Tuple[datetime, int]] = None,
+        after: Optional[Tuple[datetime, int]] = None,
+        limit: int = 50,
+) -> List[ArchivedMessage]:
+    """
+    Up to `limit` archived messages of a conversation past a keyset cursor: the newest ones
+    older than `before` (or overall), newest first, or the oldest ones newer than `after`,
+    oldest first. Segments are read in key order and decoding stops as soon as no further
+    segment can hold a message that belongs on the page.
+    """
+    if after is not None:
+        cursor = (_utc(after[0]), after[1])
+        query = (
+            select(ArchiveSegment.first_at, ArchiveSegment.first_id, ArchiveSegment.payload)
+            .where(_segment_filter(user_id, peer_id),
+                   or_(ArchiveSegment.last_at > after[0],
+                       and_(ArchiveSegment.last_at == after[0], ArchiveSegment.last_id > after[1])))
+            .order_by(ArchiveSegment.first_at, ArchiveSegment.first_id)
+        )
+        wanted, newest_first = (lambda key: key > cursor), False
+    else:
+        cursor = (_utc(before[0]), before[1]) if before is not None else None
+        query = select(ArchiveSegment.last_at, ArchiveSegment.last_id, ArchiveSegment.payload).where(
+            _segment_filter(user_id, peer_id)
+        )
+        if before is not None:
+            query = query.where(or_(ArchiveSegment.first_at < before[0],
+                                    and_(ArchiveSegment.first_at == before[0], ArchiveSegment.first_id < before[1])))
+        query = query.order_by(ArchiveSegment.last_at.desc(), ArchiveSegment.last_id.desc())
+        wanted, newest_first = (lambda key: cursor is None or key < cursor), True
+
+    messages: List[ArchivedMessage] = []
+    result = await db.stream(query.execution_options(yield_per=SEGMENT_FETCH_SIZE))
+    try:
+        async for bound_at, bound_id, payload in result:
+            # Segments come in the page's direction by their near edge: once a full page is
+            # collected and the next segment starts beyond its far end, nothing else can qualify
+            if len(messages) >= limit:
+                edge = (_utc(bound_at), bound_id)
+                if (edge < message_key(messages[-1])) if newest_first else (edge > message_key(messages[-1])):
+                    break
+            messages.extend(message for message in decode_segment(payload) if wanted(message_key(message)))
+            messages.sort(key=message_key, reverse=newest_first)
+            del messages[limit:]
+    finally:
+        await result.close()
+    return messages
+
+
+async def latest_archived(db: AsyncSession, keys: Iterable[Tuple[int, int]]) -> Dict[Tuple[int, int], ArchivedMessage]:
+    """
+    The newest archived message of each conversation (by `conversation_key`) that has any, in one
+    query: only the segment ending last in each conversation is read and decoded.
+    """
+    keys = set(keys)
+    if not keys:
+        return {}
+    ranked = (
+        select(
+            ArchiveSegment.user_a_id,
+            ArchiveSegment.user_b_id,
+            ArchiveSegment.payload,
+            func.row_number().over(
+                partition_by=(ArchiveSegment.user_a_id, ArchiveSegment.user_b_id),
+                order_by=(ArchiveSegment.last_at.desc(), ArchiveSegment.last_id.desc()),
+            ).label("rank"),
+        )
+        .where(or_(*(and_(ArchiveSegment.user_a_id == user_a, ArchiveSegment.user_b_id == user_b)
+                     for user_a, user_b in keys)))
+        .subquery()
+    )
+    result = await db.execute(select(ranked.c.user_a_id, ranked.c.user_b_id, ranked.c.payload).where(ranked.c.rank == 1))
+    return {
+        (user_a, user_b): max(decode_segment(payload), key=message_key)
+        for user_a, user_b, payload in result.all()
+    }
+
+
+async def iter_archived(db: AsyncSession, user_id: int, peer_id: int) -> AsyncIterator[List[ArchivedMessage]]:
+    """
+    A conversation's whole archive, oldest first, one decoded segment at a time.
+    """
+    result = await db.stream(
+        select(ArchiveSegment.payload)
+        .where(_segment_filter(user_id, peer_id))
+        .order_by(ArchiveSegment.first_at, ArchiveSegment.first_id)
+        .execution_options(yield_per=SEGMENT_FETCH_SIZE)
+    )
+    async for payload, in result:
+        yield decode_segment(payload)
+
+
+async def find_archived(db: AsyncSession, message_id: int, user_id: int) -> Optional[ArchivedMessage]:
+    """
+    An archived message of one of the user's conversations, or None. Only segments whose id
+    range covers `message_id` are decoded.
+    """
+    result = await db.execute(
+        select(ArchiveSegment.payload)
+        .where(or_(ArchiveSegment.user_a_id == user_id, ArchiveSegment.user_b_id == user_id),
+               ArchiveSegment.min_id <= message_id, ArchiveSegment.max_id >= message_id)
+    )
+    for payload, in result.all():
+        for message in decode_segment(payload):
+            if message.id == message_id:
+                return message
+    return None
+
+
+async def delete_archived(db: AsyncSession, message: ArchivedMessage):
+    """
+    Remove an archived message, in the caller's transaction, by rewriting the segment that holds
+    it, or dropping the segment if it was the last message inside. The rewrite only applies if
+    the segment is unchanged since it was read; a concurrent delete from the same segment gets a
+    409 and can simply be retried.
+    """
+    result = await db.execute(
+        select(ArchiveSegment.id, ArchiveSegment.message_count, ArchiveSegment.payload)
+        .where(_segment_filter(message.sender_id, message.receiver_id),
+               ArchiveSegment.min_id <= message.id, ArchiveSegment.max_id >= message.id)
+    )
+    for segment_id, message_count, payload in result.all():
+        remaining = [row for row in decode_segment(payload) if row.id != message.id]
+        if len(remaining) == message_count:
+            continue
+        current = and_(ArchiveSegment.id == segment_id, ArchiveSegment.message_count == message_count)
+        if remaining:
+            changed = await db.execute(update(ArchiveSegment).where(current).values(
+                first_at=remaining[0].timestamp,
+                first_id=remaining[0].id,
+                last_at=remaining[-1].timestamp,
+                last_id=remaining[-1].id,
+                min_id=min(row.id for row in remaining),
+                max_id=max(row.id for row in remaining),
+                message_count=len(remaining),
+                payload=encode_segment(remaining),
+            ))
+        else:
+            changed = await db.execute(delete(ArchiveSegment).where(current))
+        if changed.rowcount == 1:
+            return
+        break
+    raise HTTPException(status_code=409, detail="The message was changed concurrently; try again.")
+
+
+async def merge_sorted(first: AsyncIterator[list], second: AsyncIterator[list]) -> AsyncIterator[list]:
+    """
+    Merge two streams of row chunks, each sorted by `message_key`, into one sorted stream of chunks.
+    """
+    buffers = (deque(), deque())
+    sources = [first, second]
+    while True:
+        for buffer, index in zip(buffers, (0, 1)):
+            while not buffer and sources[index] is not None:
+                try:
+                    buffer.extend(await sources[index].__anext__())
+                except StopAsyncIteration:
+                    sources[index] = None
+        if not buffers[0] or not buffers[1]:
+            chunk = list(buffers[0] or buffers[1])
+            if not chunk:
+                return
+            buffers[0].clear()
+            buffers[1].clear()
+            yield chunk
+            continue
+        # Everything up to the smaller of the two buffered tails is final
+        bound = min(message_key(buffers[0][-1]), message_key(buffers[1][-1]))
+        chunk = []
+        while True:
+            heads = [buffer for buffer in buffers if buffer and message_key(buffer[0]) <= bound]
+            if not heads:
+                break
+            chunk.append(min(heads, key=lambda buffer: message_key(buffer[0])).popleft())
+        yield chunk
+
+
+class MessageArchiver:
+    """
+    Moves messages older than `age` seconds out of the `messages` table into archive segments,
+    keeping the hot table, and its indexes, bounded by recent traffic rather than history.
+
+    Every `interval` seconds the oldest eligible rows are moved `batch_size` at a time: one
+    `DELETE ... RETURNING` takes them out of the hot table and, in the same transaction, they
+    are written as per-conversation segments of up to `segment_size` messages (zlib-compressed
+    MessagePack, one row and one index entry per segment). Rows a DELETE did not actually
+    remove are never written, so several workers archiving at once cannot duplicate a message.
+
+    Self-destructing messages are left for the expiry scheduler, and messages with attachments
+    stay hot because attachment access is checked against them. Deleting an archived message
+    rewrites its segment without it (`delete_archived`).
+    """
+
+    def __init__(self, session_factory=SessionLocal, age: float = 180 * 24 * 3600, interval: float = 3600,
+                 batch_size: int = 5000, segment_size: int = 500):
+        self.session_factory = session_factory
+        self.age = age
+        self.interval = interval
+        self.batch_size = batch_size
+        self.segment_size = segment_size
+        self.archived = 0
+        self.segments = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.archive()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Message archival failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def archive(self, now: Optional[datetime] = None) -> int:
+        """
+        Move every eligible message older than the cutoff; returns how many were moved.
+        """
+        cutoff = (now or datetime.now(timezone.utc)) - timedelta(seconds=self.age)
+        moved = 0
+        while True:
+            batch = await self._archive_batch(cutoff)
+            moved += batch
+            if batch < self.batch_size:
+                break
+        if moved:
+            logger.info("Archived %s messages older than %s", moved, cutoff.isoformat())
+        return moved
+
+    async def _archive_batch(self, cutoff: datetime) -> int:
+        oldest = (
+            select(MessageModel.id)
+            .where(MessageModel.timestamp < cutoff, MessageModel.expires_at.is_(None),
+                   MessageModel.attachment_id.is_(None))
+            .order_by(MessageModel.timestamp, MessageModel.id)
+            .limit(self.batch_size)
+        )
+        async with self.session_factory() as session:
+            result = await session.execute(
+                delete(MessageModel)
+                .where(MessageModel.id.in_(oldest))
+                .returning(*ARCHIVE_COLUMNS)
+                .execution_options(synchronize_session=False)
+            )
+            rows = result.all()
+            if not rows:
+                return 0
+
+            conversations: Dict[Tuple[int, int], list] = {}
+            for row in rows:
+                conversations.setdefault(conversation_key(row.sender_id, row.receiver_id), []).append(row)
+            segments = []
+            for (user_a, user_b), messages in conversations.items():
+                messages.sort(key=message_key)
+                for start in range(0, len(messages), self.segment_size):
+                    chunk = messages[start:start + self.segment_size]
+                    segments.append({
+                        "user_a_id": user_a,
+                        "user_b_id": user_b,
+                        "first_at": chunk[0].timestamp,
+                        "first_id": chunk[0].id,
+                        "last_at": chunk[-1].timestamp,
+                        "last_id": chunk[-1].id,
+                        "min_id": min(message.id for message in chunk),
+                        "max_id": max(message.id for message in chunk),
+                        "message_count": len(chunk),
+                        "payload": encode_segment(chunk),
+                    })
+            await session.execute(insert(ArchiveSegment), segments)
+            await session.commit()
+
+        self.archived += len(rows)
+        self.segments += len(segments)
+        MESSAGES_ARCHIVED.inc(len(rows))
+        return len(rows)
+
+    def stats(self) -> dict:
+        return {"archived": self.archived, "segments": self.segments}
+
+
+@lru_cache(maxsize=None)
+def get_archiver() -> MessageArchiver:
+    settings = get_settings()
+    return MessageArchiver(
+        age=settings.archive_after_seconds,
+        interval=settings.archive_interval_seconds,
+        batch_size=settings.archive_batch_size,
+        segment_size=settings.archive_segment_size,
+    )
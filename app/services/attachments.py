@@ -0,0 +1,343 @@
+import asyncio
+import logging
+import os
+import shutil
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from secrets import token_hex
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+from fastapi import HTTPException
+from sqlalchemy import and_, delete, exists, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import get_settings
+from app.core.encryption import GCM_NONCE_SIZE, GCM_TAG_SIZE
+from app.db import SessionLocal
+from app.models.attachment import Attachment
+from app.models.message import Message as MessageModel
+from app.schemas.attachment import AttachmentCreate
+
+logger = logging.getLogger(__name__)
+
+
+class AttachmentStore:
+    """
+    Encrypted attachment chunks on local disk, one file per chunk: `<directory>/<id>/<index>`.
+
+    Each chunk is sealed on its own with AES-GCM (random nonce, tag appended) and authenticated
+    against its attachment id and index, so chunks cannot be swapped or reordered on disk. A
+    chunk is encrypted and written piece by piece as the request body arrives and read back one
+    chunk at a time, so memory per transfer is bounded by the chunk size whatever the file size.
+    File I/O runs on the default executor, off the event loop.
+    """
+
+    def __init__(self, directory: str, key: Optional[bytes] = None):
+        self.directory = directory
+        self.key = key
+
+    def path(self, attachment_id: int, index: Optional[int] = None) -> str:
+        directory = os.path.join(self.directory, str(attachment_id))
+        return directory if index is None else os.path.join(directory, str(index))
+
+    @staticmethod
+    def _associated_data(attachment_id: int, index: int) -> bytes:
+        return f"{attachment_id}:{index}".encode()
+
+    def _cipher(self, attachment_id: int, index: int, nonce: bytes):
+        cipher = AES.new(self.key or get_settings().encryption_key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(self._associated_data(attachment_id, index))
+        return cipher
+
+    def _open_part(self, attachment_id: int, index: int):
+        os.makedirs(self.path(attachment_id), exist_ok=True)
+        part = f"{self.path(attachment_id, index)}.part-{token_hex(4)}"
+        return part, open(part, "wb")
+
+    async def write_chunk(self, attachment_id: int, index: int, size: int, pieces: AsyncIterator[bytes]):
+        """
+        Encrypt a chunk of exactly `size` plaintext bytes from `pieces` and store it. The chunk
+        is written to a temporary file and renamed into place, so readers and concurrent retries
+        only ever see complete chunks. Raises ValueError if the body is not `size` bytes long.
+        """
+        loop = asyncio.get_running_loop()
+        nonce = get_random_bytes(GCM_NONCE_SIZE)
+        cipher = self._cipher(attachment_id, index, nonce)
+        part, file = await loop.run_in_executor(None, self._open_part, attachment_id, index)
+        try:
+            written = 0
+            await loop.run_in_executor(None, file.write, nonce)
+            async for piece in pieces:
+                written += len(piece)
+                if written > size:
+                    raise ValueError(f"Chunk {index} is longer than {size} bytes")
+                await loop.run_in_executor(None, file.write, cipher.encrypt(piece))
+            if written != size:
+                raise ValueError(f"Chunk {index} has {written} bytes, expected {size}")
+            await loop.run_in_executor(None, file.write, cipher.digest())
+            await loop.run_in_executor(None, file.close)
+            await loop.run_in_executor(None, os.replace, part, self.path(attachment_id, index))
+        except BaseException:
+            file.close()
+            await loop.run_in_executor(None, _remove, part)
+            raise
+
+    def read_chunk(self, attachment_id: int, index: int) -> bytes:
+        """
+        Decrypt and authenticate one stored chunk; raises ValueError if it was tampered with.
+        """
+        with open(self.path(attachment_id, index), "rb") as file:
+            sealed = file.read()
+        nonce, ciphertext, tag = sealed[:GCM_NONCE_SIZE], sealed[GCM_NONCE_SIZE:-GCM_TAG_SIZE], sealed[-GCM_TAG_SIZE:]
+        return self._cipher(attachment_id, index, nonce).decrypt_and_verify(ciphertext, tag)
+
+    async def stream(self, attachment_id: int, chunk_size: int, start: int, end: int) -> AsyncIterator[bytes]:
+        """
+        Plaintext bytes `start` to `end` (inclusive), decrypting only the chunks they span.
+        """
+        loop = asyncio.get_running_loop()
+        for index in range(start // chunk_size, end // chunk_size + 1):
+            plain = await loop.run_in_executor(None, self.read_chunk, attachment_id, index)
+            offset = index * chunk_size
+            yield plain[max(start - offset, 0):end + 1 - offset]
+
+    async def remove(self, attachment_ids: Iterable[int]):
+        """
+        Delete the stored chunks of each attachment; ones with nothing on disk are skipped.
+        """
+        loop = asyncio.get_running_loop()
+        for attachment_id in attachment_ids:
+            await loop.run_in_executor(None, shutil.rmtree, self.path(attachment_id), True)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def chunk_length(attachment: Attachment, index: int) -> int:
+    """
+    Plaintext bytes in chunk `index`: the chunk size, except for a shorter last chunk.
+    """
+    return min(attachment.chunk_size, attachment.size - index * attachment.chunk_size)
+
+
+def parse_byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    The (start, end) bytes, inclusive, requested by a single-range `Range` header. None means
+    the whole file: no header, a header that does not parse, or several ranges, which are
+    answered in full as RFC 9110 allows. Unsatisfiable ranges raise a 416.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            # A suffix range: the last N bytes
+            length = int(last)
+            start, end = (max(size - length, 0), size - 1) if length > 0 else (size, size - 1)
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, detail="Range not satisfiable.", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+async def create_attachment(owner_id: int, request: AttachmentCreate, db: AsyncSession) -> Attachment:
+    settings = get_settings()
+    if request.size > settings.attachment_max_size:
+        raise HTTPException(status_code=413, detail=f"Attachments are limited to {settings.attachment_max_size} bytes.")
+    attachment = Attachment(
+        owner_id=owner_id,
+        filename=request.filename,
+        content_type=request.content_type,
+        size=request.size,
+        chunk_size=settings.attachment_chunk_size,
+        received_chunks=0,
+    )
+    db.add(attachment)
+    await db.commit()
+    await db.refresh(attachment)
+    logger.info("Attachment %s created by user %s: %s bytes", attachment.id, owner_id, attachment.size)
+    return attachment
+
+
+async def get_attachment(attachment_id: int, user_id: int, db: AsyncSession) -> Attachment:
+    """
+    An attachment the user may read: their own, or one sent in a message to or from them.
+    Anything else is reported as missing rather than forbidden.
+    """
+    attachment = await db.get(Attachment, attachment_id)
+    if attachment is not None and attachment.owner_id != user_id:
+        shared = await db.scalar(
+            select(MessageModel.id)
+            .where(MessageModel.attachment_id == attachment_id,
+                   or_(MessageModel.sender_id == user_id, MessageModel.receiver_id == user_id))
+            .limit(1)
+        )
+        if shared is None:
+            attachment = None
+    if attachment is None:
+        raise HTTPException(status_code=404, detail="Attachment not found.")
+    return attachment
+
+
+async def upload_chunk(
+        attachment: Attachment, index: int, pieces: AsyncIterator[bytes], db: AsyncSession,
+        store: Optional[AttachmentStore] = None
+) -> Attachment:
+    """
+    Store chunk `index` of an upload. Chunks go in order: resending one that is already stored
+    is acknowledged without rewriting it, so a client that lost a response can simply resume
+    from the `received_chunks` it gets back.
+    """
+    if index < attachment.received_chunks:
+        return attachment
+    if index != attachment.received_chunks or index >= attachment.chunk_count:
+        raise HTTPException(status_code=409, detail=f"Expected chunk {attachment.received_chunks} of {attachment.chunk_count}.")
+    try:
+        await (store or get_attachment_store()).write_chunk(attachment.id, index, chunk_length(attachment, index), pieces)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Conditional, so a concurrent retry of the same chunk cannot move the count twice
+    await db.execute(
+        update(Attachment)
+        .where(Attachment.id == attachment.id, Attachment.received_chunks == index)
+        .values(received_chunks=index + 1)
+    )
+    await db.commit()
+    await db.refresh(attachment)
+    return attachment
+
+
+async def check_attachments(pairs: Iterable[Tuple[int, int]], db: AsyncSession):
+    """
+    Ensure every (sender id, attachment id) pair names a complete upload owned by that sender,
+    with one query for the whole batch. Raises a 400 otherwise.
+    """
+    pairs = {(sender_id, attachment_id) for sender_id, attachment_id in pairs}
+    if not pairs:
+        return
+    result = await db.execute(
+        select(Attachment).where(or_(*(and_(Attachment.id == attachment_id, Attachment.owner_id == sender_id)
+                                       for sender_id, attachment_id in pairs)))
+    )
+    ready = {(attachment.owner_id, attachment.id) for attachment in result.scalars().all() if attachment.complete}
+    missing = sorted(attachment_id for _, attachment_id in pairs - ready)
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Attachments not found or not fully uploaded: {missing}")
+
+
+def unreferenced():
+    return ~exists().where(MessageModel.attachment_id == Attachment.id)
+
+
+async def release_attachments(db: AsyncSession, attachment_ids: Iterable[Optional[int]]) -> List[int]:
+    """
+    Delete, in the caller's transaction, the attachments among `attachment_ids` that no message
+    refers to any more, e.g. after the last message sharing one was deleted or purged. Returns
+    their ids; pass them to `AttachmentStore.remove` once the transaction has committed.
+    """
+    attachment_ids = {attachment_id for attachment_id in attachment_ids if attachment_id is not None}
+    if not attachment_ids:
+        return []
+    result = await db.execute(
+        delete(Attachment)
+        .where(Attachment.id.in_(attachment_ids), unreferenced())
+        .returning(Attachment.id)
+        .execution_options(synchronize_session=False)
+    )
+    return [row.id for row in result.all()]
+
+
+class AttachmentReaper:
+    """
+    Deletes uploads that were abandoned: attachments created more than `ttl` seconds ago that no
+    message refers to, whether the upload never finished or the file was simply never sent.
+
+    Every `interval` seconds rows are removed `batch_size` at a time with one `DELETE ... RETURNING`
+    whose reference check runs in the same statement, and the chunks of the rows it actually
+    removed are then deleted from disk, so several workers sweeping at once never race on a file.
+    """
+
+    def __init__(self, session_factory=SessionLocal, store: Optional[AttachmentStore] = None,
+                 ttl: float = 24 * 3600, interval: float = 3600, batch_size: int = 1000):
+        self.session_factory = session_factory
+        self.store = store
+        self.ttl = ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self.reaped = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.reap()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Attachment cleanup failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def reap(self, now: Optional[datetime] = None) -> int:
+        """
+        Delete every abandoned attachment older than the cutoff; returns how many were deleted.
+        """
+        cutoff = (now or datetime.now(timezone.utc)) - timedelta(seconds=self.ttl)
+        reaped = 0
+        while True:
+            oldest = (
+                select(Attachment.id)
+                .where(Attachment.created_at < cutoff, unreferenced())
+                .order_by(Attachment.id)
+                .limit(self.batch_size)
+            )
+            async with self.session_factory() as session:
+                result = await session.execute(
+                    delete(Attachment)
+                    .where(Attachment.id.in_(oldest), unreferenced())
+                    .returning(Attachment.id)
+                    .execution_options(synchronize_session=False)
+                )
+                attachment_ids = [row.id for row in result.all()]
+                await session.commit()
+            await (self.store or get_attachment_store()).remove(attachment_ids)
+            reaped += len(attachment_ids)
+            if len(attachment_ids) < self.batch_size:
+                break
+        if reaped:
+            self.reaped += reaped
+            logger.info("Deleted %s abandoned attachments created before %s", reaped, cutoff.isoformat())
+        return reaped
+
+
+@lru_cache(maxsize=None)
+def get_attachment_store() -> AttachmentStore:
+    return AttachmentStore(get_settings().attachment_dir)
+
+
+@lru_cache(maxsize=None)
+def get_attachment_reaper() -> AttachmentReaper:
+    settings = get_settings()
+    return AttachmentReaper(ttl=settings.attachment_upload_ttl_seconds, interval=settings.attachment_sweep_interval_seconds)
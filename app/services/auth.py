@@ -1,29 +1,72 @@
 from datetime import datetime, timedelta
-from typing import Optional
+from functools import lru_cache
+from typing import Dict, Optional, Set, Tuple
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.db import get_db
+from app.core.password_pool import get_password_pool
+from app.core.cache import TTLCache
+from app.services.resolver import EMAIL, USERNAME, get_user_resolver
+from app.core.config import get_settings
 from app.models.user import User as UserModel
 from app.schemas.user import User, SignupRequest, LoginRequest, UpdateUserRequest
 import logging
-import bcrypt
-import os
+import time
 
 # Set up logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 # Define OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
-# JWT configuration
-SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key")
+# JWT configuration; the signing key comes from settings on first use
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Verified token -> authenticated User principal, so a hot token costs no decode or DB round-trip
+tokens_by_user: Dict[int, Set[str]] = {}
+
+
+def _forget_token(token: str, user: User):
+    tokens = tokens_by_user.get(user.id)
+    if tokens is not None:
+        tokens.discard(token)
+        if not tokens:
+            del tokens_by_user[user.id]
+
+
+@lru_cache(maxsize=None)
+def get_principal_cache() -> TTLCache:
+    settings = get_settings()
+    return TTLCache(
+        maxsize=settings.token_cache_size,
+        ttl=settings.token_cache_ttl,
+        on_evict=_forget_token,
+    )
+
+
+def cache_principal(token: str, user: User, expires_at: Optional[float]):
+    """
+    Cache a verified principal for at most the configured TTL and never past the token's exp.
+    """
+    ttl = get_settings().token_cache_ttl if expires_at is None else expires_at - time.time()
+    if ttl <= 0:
+        return
+    get_principal_cache().set(token, user, ttl=ttl)
+    tokens_by_user.setdefault(user.id, set()).add(token)
+
+
+def invalidate_user(user_id: int):
+    """
+    Drop every cached principal for a user, e.g. after a profile change or deactivation.
+    """
+    for token in tokens_by_user.pop(user_id, set()):
+        get_principal_cache().pop(token)
+
 
 # Function to create a new access token
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -33,50 +76,108 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, get_settings().jwt_secret_key, algorithm=ALGORITHM)
     return encoded_jwt
 
 
 # Function to get the current user based on the provided JWT token
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
 
+    cached_user = get_principal_cache().get(token)
+    if cached_user is not None:
+        if cached_user.is_active is False:
+            raise credentials_exception
+        return cached_user
+
     try:
-        logger.debug(f"Decoding token: {token}")
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, get_settings().jwt_secret_key, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
         if user_id is None:
             logger.error("Token missing 'sub' field.")
             raise credentials_exception
-        logger.debug(f"Token decoded successfully: {payload}")
 
     except JWTError as e:
-        logger.error(f"JWT decoding failed: {e}")
+        logger.error("JWT decoding failed: %s", e)
+        raise credentials_exception
+
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        logger.error("Token 'sub' field is not a user ID.")
         raise credentials_exception
 
     # Lookup user in the database
-    logger.debug(f"Looking up user with ID: {user_id}")
-    user = db.query(UserModel).filter(UserModel.id == user_id).first()
+    logger.debug("Looking up user with ID: %s", user_id)
+    result = await db.execute(select(UserModel).where(UserModel.id == user_id))
+    user = result.scalars().first()
     if not user:
-        logger.error(f"User with ID {user_id} not found.")
+        logger.error("User with ID %s not found.", user_id)
         raise credentials_exception
+    if user.is_active is False:
+        logger.error("User with ID %s is deactivated.", user_id)
+        raise credentials_exception
+
+    logger.debug("User %s authenticated successfully.", user.username)
+    current_user = User(id=user.id, username=user.username, email=user.email, is_active=user.is_active)
+    cache_principal(token, current_user, payload.get("exp"))
+    return current_user
 
-    logger.info(f"User {user.username} authenticated successfully.")
-    return User(id=user.id, username=user.username, email=user.email, is_active=user.is_active)
+
+# Helpers to look up a user by a unique field
+async def get_user_by_username(username: str, db: AsyncSession) -> Optional[UserModel]:
+    result = await db.execute(select(UserModel).where(UserModel.username == username))
+    return result.scalars().first()
+
+
+async def get_user_by_email(email: str, db: AsyncSession) -> Optional[UserModel]:
+    result = await db.execute(select(UserModel).where(UserModel.email == email))
+    return result.scalars().first()
+
+
+async def resolve_user_id_by_username(username: str, db: AsyncSession) -> Optional[int]:
+    async def load(value: str) -> Optional[int]:
+        result = await db.execute(select(UserModel.id).where(UserModel.username == value))
+        return result.scalar()
+    return await get_user_resolver().resolve(USERNAME, username, load)
+
+
+async def resolve_user_id_by_email(email: str, db: AsyncSession) -> Optional[int]:
+    async def load(value: str) -> Optional[int]:
+        result = await db.execute(select(UserModel.id).where(UserModel.email == value))
+        return result.scalar()
+    return await get_user_resolver().resolve(EMAIL, email, load)
+
+
+async def get_user_ids_by_identifiers(usernames, emails, db: AsyncSession) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """
+    Resolve many usernames and emails to user IDs through the resolver cache; the misses for
+    each field are loaded with a single IN query.
+    Returns (username -> id, email -> id); unknown identifiers are simply absent.
+    """
+    def loader(column):
+        async def load(values: set) -> Dict[str, int]:
+            result = await db.execute(select(column, UserModel.id).where(column.in_(values)))
+            return {value: user_id for value, user_id in result.all()}
+        return load
+
+    by_username = await get_user_resolver().resolve_many(USERNAME, usernames, loader(UserModel.username))
+    by_email = await get_user_resolver().resolve_many(EMAIL, emails, loader(UserModel.email))
+    return by_username, by_email
 
 
 # Function to sign up a new user
-def signup_user(request: SignupRequest, db: Session) -> dict:
-    if db.query(UserModel).filter(UserModel.username == request.username).first():
+async def signup_user(request: SignupRequest, db: AsyncSession) -> dict:
+    if await get_user_by_username(request.username, db):
         raise HTTPException(status_code=400, detail="Username already taken")
-    if db.query(UserModel).filter(UserModel.email == request.email).first():
+    if await get_user_by_email(request.email, db):
         raise HTTPException(status_code=400, detail="Email already taken")
 
-    hashed_password = bcrypt.hashpw(request.password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    hashed_password = await get_password_pool().hash_password(request.password)
 
     new_user = UserModel(
         username=request.username,
@@ -87,29 +188,29 @@ def signup_user(request: SignupRequest, db: Session) -> dict:
     )
 
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
+    # The new names may have been cached as unknown
+    get_user_resolver().invalidate(username=new_user.username, email=new_user.email)
 
-    logger.info(f"User {new_user.username} successfully registered.")
+    logger.info("User %s successfully registered.", new_user.username)
     return {"message": "Signup successful"}
 
 
-# Function to verify a password
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
-
-
 # Function to handle user login
-def login_user(request: LoginRequest, db: Session) -> dict:
-    user = db.query(UserModel).filter(UserModel.email == request.email).first()
-    if not user or not verify_password(request.password, user.hashed_password):
-        logger.error(f"Invalid credentials for email: {request.email}")
+async def login_user(request: LoginRequest, db: AsyncSession) -> dict:
+    user = await get_user_by_email(request.email, db)
+    if not user or not await get_password_pool().verify_password(request.password, user.hashed_password):
+        logger.error("Invalid credentials for email: %s", request.email)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+    if user.is_active is False:
+        logger.error("Login attempt for deactivated user: %s", user.username)
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Account is deactivated")
 
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(data={"sub": str(user.id)}, expires_delta=access_token_expires)
 
-    logger.info(f"User {user.username} logged in successfully. Token generated.")
+    logger.debug("User %s logged in successfully. Token generated.", user.username)
     return {
         "message": "Login successful",
         "access_token": access_token,
@@ -121,22 +222,45 @@ def login_user(request: LoginRequest, db: Session) -> dict:
     }
 
 
-def update_user(user_id: int, request: UpdateUserRequest, db: Session) -> UserModel:
-    user = db.query(UserModel).filter(UserModel.id == user_id).first()
+async def update_user(user_id: int, request: UpdateUserRequest, db: AsyncSession) -> UserModel:
+    result = await db.execute(select(UserModel).where(UserModel.id == user_id))
+    user = result.scalars().first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
+    previous_username = user.username
     if request.username:
         # Check if new username already exists
-        if db.query(UserModel).filter(UserModel.username == request.username).first():
+        if await get_user_by_username(request.username, db):
             raise HTTPException(status_code=400, detail="Username already taken")
         user.username = request.username
 
     if request.phone_number:
         user.phone_number = request.phone_number
 
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
+    invalidate_user(user.id)
+    if user.username != previous_username:
+        get_user_resolver().invalidate(username=previous_username)
+        get_user_resolver().invalidate(username=user.username)
 
-    logger.info(f"User {user.username} updated successfully.")
+    logger.info("User %s updated successfully.", user.username)
     return user
+
+
+async def deactivate_user(user_id: int, db: AsyncSession):
+    """
+    Deactivate an account. Its cached principals are dropped at once, so its tokens stop
+    working on this worker immediately and, since inactive users are rejected on every
+    lookup, everywhere else once their cache entries expire (at most `TOKEN_CACHE_TTL`).
+    """
+    result = await db.execute(select(UserModel).where(UserModel.id == user_id))
+    user = result.scalars().first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    user.is_active = False
+    await db.commit()
+    invalidate_user(user.id)
+    logger.info("User %s deactivated.", user.username)
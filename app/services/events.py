@@ -0,0 +1,286 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+import msgpack
+from sqlalchemy import delete, func, insert, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from app.core.config import get_settings
+from app.db import SessionLocal
+from app.models.event import EventLogHorizon, UserEvent
+
+logger = logging.getLogger(__name__)
+
+# Prune positions are remembered per minute, so their number is bounded by retention, not traffic
+CHECKPOINT_INTERVAL = 60
+
+# Class of the per-recipient advisory locks ordering event log commits on PostgreSQL (an arbitrary
+# int4 constant); the lock's second key is the recipient's user id
+EVENT_LOG_LOCK_CLASS = 0x65766e74
+
+# Key of the one row of `event_log_horizon`
+HORIZON_ROW_ID = 1
+
+
+def encode_event(event: dict) -> bytes:
+    return msgpack.packb(event, use_bin_type=True)
+
+
+def decode_event(event_id: int, payload: bytes) -> dict:
+    event = msgpack.unpackb(payload, raw=False)
+    event['event_id'] = event_id
+    return event
+
+
+def upsert_horizon(dialect_name: str, pruned_up_to: int):
+    """
+    Raise the shared prune horizon to `pruned_up_to`; it never moves back, whichever worker prunes.
+    """
+    if dialect_name == "postgresql":
+        statement = postgresql.insert(EventLogHorizon)
+        greatest = func.greatest
+    elif dialect_name == "sqlite":
+        statement = sqlite.insert(EventLogHorizon)
+        greatest = func.max
+    else:
+        raise NotImplementedError(f"The event log is not supported on {dialect_name}")
+    statement = statement.values(id=HORIZON_ROW_ID, pruned_up_to=pruned_up_to)
+    return statement.on_conflict_do_update(
+        index_elements=[EventLogHorizon.id],
+        set_={"pruned_up_to": greatest(EventLogHorizon.pruned_up_to, statement.excluded.pruned_up_to)},
+    )
+
+
+class EventLog:
+    """
+    Durable per-user log of the events pushed to sockets, so a reconnecting client can ask for
+    everything after the last `event_id` it saw instead of refetching whole conversations.
+
+    `append` is group-committed like the WebSocket write-behind queue: callers await a future
+    and a single flusher writes whatever is queued (up to `batch_size` events) as one multi-row
+    INSERT. An event is durable before it is published, so a sync that starts after a client
+    subscribes can never miss it. Each recipient gets its own row, and `replay` reads one user's
+    rows after a given id through the (user_id, id) index, so catching up costs reads
+    proportional to what was missed rather than to history size.
+
+    Each user's ids must become visible in order, or a sync could move that user's position past
+    an event that commits later. One flusher per worker keeps that true within a worker; on
+    PostgreSQL each group commit also takes a transaction-level advisory lock per recipient
+    before its ids are allocated, so two workers' batches for the same user commit one after the
+    other (SQLite has a single writer anyway). Batches for different users do not wait on each
+    other, so workers log in parallel. Locks are taken in user id order, so batches never
+    deadlock, and are held for one INSERT per batch, not per event.
+
+    Events older than `retention` seconds are pruned, by any worker. The highest id pruned is
+    recorded in the shared `event_log_horizon` row in the same transaction; `load_horizon`
+    reads it, and a client whose last id is below it may have missed pruned events and must
+    resync over REST. `horizon` is the last value this worker saw.
+    """
+
+    def __init__(self, session_factory=SessionLocal, batch_size: int = 500, max_queue: int = 10000,
+                 retention: float = 7 * 24 * 3600):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self.retention = retention
+        self.horizon = 0
+        self.appended = 0
+        self.flushed_batches = 0
+        # (end of minute, highest id written by then), oldest first: prune cutoffs without a created_at index
+        self._checkpoints: deque = deque()
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pruner: Optional[asyncio.Task] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self):
+        if self._queue is not None:
+            return
+        # Set before the first await, so concurrent appends never start a second flusher
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        try:
+            async with self.session_factory() as session:
+                lowest, highest = (await session.execute(select(func.min(UserEvent.id), func.max(UserEvent.id)))).one()
+            # Anything below the oldest surviving row may have been pruned by an earlier process
+            self.horizon = lowest - 1 if lowest is not None else 0
+            await self.load_horizon()
+            if highest is not None:
+                self._checkpoint(highest)
+        except Exception as e:
+            # Appends still queue up; the flusher reports failures per batch
+            logger.error("Failed to read the event log bounds: %s", e)
+        self._task = asyncio.create_task(self._run())
+        self._pruner = asyncio.create_task(self._prune_periodically())
+
+    async def close(self):
+        """
+        Flush everything already queued, then stop the flusher.
+        """
+        if self._task is None:
+            return
+        self._pruner.cancel()
+        await self._queue.join()
+        self._task.cancel()
+        await asyncio.gather(self._task, self._pruner, return_exceptions=True)
+        self._task = self._pruner = self._queue = None
+
+    async def append(self, user_ids: Iterable[int], event: dict) -> Dict[int, int]:
+        """
+        Log `event` for each user; resolves to {user id: event id} once the rows are durable.
+        """
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(([int(user_id) for user_id in user_ids], event, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            events = len(batch[0][0])
+            while events < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                events += len(batch[-1][0])
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                logger.error("Failed to log %s events: %s", events, e)
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, batch: list):
+        rows = []
+        for user_ids, event, _ in batch:
+            payload = encode_event(event)
+            rows.extend({'user_id': user_id, 'type': event.get('type', ''), 'payload': payload} for user_id in user_ids)
+        if not rows:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_result({})
+            return
+
+        async with self.session_factory() as session:
+            if session.get_bind().dialect.name == "postgresql":
+                # Released at commit: each recipient's ids are allocated and made visible in order
+                await session.execute(
+                    text("SELECT pg_advisory_xact_lock(:lock_class, user_id) "
+                         "FROM unnest(CAST(:user_ids AS integer[])) AS user_id"),
+                    {"lock_class": EVENT_LOG_LOCK_CLASS, "user_ids": sorted({row['user_id'] for row in rows})},
+                )
+            result = await session.execute(
+                insert(UserEvent).returning(UserEvent.id, sort_by_parameter_order=True), rows
+            )
+            ids = result.scalars().all()
+            await session.commit()
+
+        position = 0
+        for user_ids, _, future in batch:
+            event_ids = dict(zip(user_ids, ids[position:position + len(user_ids)]))
+            position += len(user_ids)
+            if not future.done():
+                future.set_result(event_ids)
+        self.appended += len(rows)
+        self.flushed_batches += 1
+        self._checkpoint(max(ids))
+
+    def _checkpoint(self, event_id: int):
+        minute_end = (int(time.time() // CHECKPOINT_INTERVAL) + 1) * CHECKPOINT_INTERVAL
+        if self._checkpoints and self._checkpoints[-1][0] == minute_end:
+            self._checkpoints[-1] = (minute_end, event_id)
+        else:
+            self._checkpoints.append((minute_end, event_id))
+
+    async def load_horizon(self) -> int:
+        """
+        The highest event id any worker has pruned; positions below it cannot be replayed.
+        """
+        async with self.session_factory() as session:
+            pruned_up_to = await session.scalar(
+                select(EventLogHorizon.pruned_up_to).where(EventLogHorizon.id == HORIZON_ROW_ID)
+            )
+        self.horizon = max(self.horizon, pruned_up_to or 0)
+        return self.horizon
+
+    async def replay(self, user_id: int, after: int, limit: int) -> List[dict]:
+        """
+        Up to `limit` of the user's events with an id above `after`, oldest first.
+        """
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(UserEvent.id, UserEvent.payload)
+                .where(UserEvent.user_id == int(user_id), UserEvent.id > after)
+                .order_by(UserEvent.id)
+                .limit(limit)
+            )
+            return [decode_event(event_id, payload) for event_id, payload in result.all()]
+
+    async def exceeds(self, user_id: int, after: int, limit: int) -> bool:
+        """
+        Whether the user has more than `limit` events after `after`, without reading them.
+        """
+        async with self.session_factory() as session:
+            beyond = await session.scalar(
+                select(UserEvent.id)
+                .where(UserEvent.user_id == int(user_id), UserEvent.id > after)
+                .order_by(UserEvent.id)
+                .offset(limit)
+                .limit(1)
+            )
+        return beyond is not None
+
+    async def latest(self, user_id: int) -> int:
+        """
+        The user's newest event id (0 if none), e.g. the position to sync from after a full resync.
+        """
+        async with self.session_factory() as session:
+            latest = await session.scalar(select(func.max(UserEvent.id)).where(UserEvent.user_id == int(user_id)))
+        return latest or 0
+
+    async def prune(self):
+        """
+        Delete events older than the retention period.
+        """
+        threshold = time.time() - self.retention
+        cutoff = None
+        while self._checkpoints and self._checkpoints[0][0] < threshold:
+            cutoff = self._checkpoints.popleft()[1]
+        if cutoff is None:
+            return
+        async with self.session_factory() as session:
+            result = await session.execute(delete(UserEvent).where(UserEvent.id <= cutoff))
+            await session.execute(upsert_horizon(session.get_bind().dialect.name, cutoff))
+            await session.commit()
+        self.horizon = max(self.horizon, cutoff)
+        if result.rowcount:
+            logger.info("Pruned %s events up to id %s", result.rowcount, cutoff)
+
+    async def _prune_periodically(self):
+        interval = min(self.retention, 3600)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.prune()
+            except Exception as e:
+                logger.error("Event log pruning failed: %s", e)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue_depth,
+            "appended": self.appended,
+            "flushed_batches": self.flushed_batches,
+            "horizon": self.horizon,
+        }
+
+
+@lru_cache(maxsize=None)
+def get_event_log() -> EventLog:
+    settings = get_settings()
+    return EventLog(batch_size=settings.event_log_batch_size, retention=settings.event_retention_seconds)
@@ -0,0 +1,319 @@
+import asyncio
+import heapq
+import logging
+import time
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import delete, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.cache import TTLCache
+from app.core.config import get_settings
+from app.db import SessionLocal
+from app.models.message import Message as MessageModel
+from app.services.attachments import get_attachment_store, release_attachments
+
+logger = logging.getLogger(__name__)
+
+# (lower user id, higher user id): both sides of a conversation share one TTL setting
+ConversationKey = Tuple[int, int]
+
+# Called with (user id, event) once per affected user after each purge, e.g. ConnectionManager.send_to_user
+Notify = Callable[[int, dict], Awaitable[None]]
+
+# Called with (session, purged rows) once each purge has committed, in a transaction of its own, e.g.
+# inbox.refresh_purged. Rows whose hook failed are passed again on the next attempt, at most `retry_delay` later.
+OnPurge = Callable[[AsyncSession, list], Awaitable[None]]
+
+
+@lru_cache(maxsize=None)
+def get_conversation_ttl_cache() -> TTLCache:
+    settings = get_settings()
+    return TTLCache(maxsize=settings.conversation_ttl_cache_size, ttl=settings.conversation_ttl_cache_ttl)
+
+
+def conversation_key(user_id: int, peer_id: int) -> ConversationKey:
+    return (user_id, peer_id) if user_id <= peer_id else (peer_id, user_id)
+
+
+def expiry_time(ttl_seconds: Optional[int], now: Optional[datetime] = None) -> Optional[datetime]:
+    if not ttl_seconds:
+        return None
+    return (now or datetime.now(timezone.utc)) + timedelta(seconds=ttl_seconds)
+
+
+def _epoch(value: datetime) -> float:
+    # SQLite hands back naive datetimes; everything is stored in UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def not_expired(now: Optional[datetime] = None):
+    """
+    Hide self-destructed messages that the expiry scheduler has not purged yet.
+    """
+    return or_(MessageModel.expires_at.is_(None), MessageModel.expires_at > (now or datetime.now(timezone.utc)))
+
+
+async def conversation_ttls(
+        pairs: Iterable[Tuple[int, int]],
+        loader: Callable[[set], Awaitable[Dict[ConversationKey, Optional[int]]]],
+) -> Dict[ConversationKey, Optional[int]]:
+    """
+    Default TTLs for many conversations at once; only cache misses are passed to `loader`.
+    Conversations without a TTL map to None.
+    """
+    cache = get_conversation_ttl_cache()
+    ttls, missing = {}, set()
+    for key in {conversation_key(*pair) for pair in pairs}:
+        cached = cache.get(key)
+        if cached is None:
+            missing.add(key)
+        else:
+            ttls[key] = cached or None
+    if missing:
+        loaded = await loader(missing)
+        for key in missing:
+            ttl = loaded.get(key)
+            # 0 caches "no TTL", since a missing entry reads back as None
+            cache.set(key, ttl or 0)
+            ttls[key] = ttl
+    return ttls
+
+
+class ExpiryScheduler:
+    """
+    Purges self-destructing messages once their `expires_at` passes.
+
+    Only expiries inside a sliding horizon (`horizon` seconds ahead) are kept in a min-heap. Later
+    ones stay in the database and are loaded a window at a time through the partial index on
+    `expires_at`, so memory is bounded by the expiries per horizon rather than the total pending,
+    and a restart rebuilds the heap the same way (overdue rows first) without a table scan.
+
+    Due entries are deleted `batch_size` at a time with one `DELETE ... WHERE id IN (...)
+    RETURNING`, and a backlog is drained without sleeping between batches. Each affected user then
+    gets a single `delete_message` event listing all of their purged ids. Only rows this DELETE
+    actually removed are reported, so duplicate heap entries or several workers purging the same
+    table never notify twice. An attachment whose last message is purged is deleted with it.
+
+    A message whose expiry is already inside the window when it is stored is only scheduled by
+    the worker that stored it. So that a worker dying does not leave those rows behind until the
+    next restart, every `sweep_interval` seconds each worker also picks up rows that are more than
+    `sweep_interval` seconds overdue, whoever scheduled them.
+    """
+
+    def __init__(self, session_factory=SessionLocal, horizon: float = 600, batch_size: int = 1000,
+                 notify: Optional[Notify] = None, on_purge: Optional[OnPurge] = None, sweep_interval: float = 60,
+                 retry_delay: float = 1.0):
+        self.session_factory = session_factory
+        self.horizon = horizon
+        self.batch_size = batch_size
+        self.sweep_interval = sweep_interval
+        self.notify = notify
+        self.on_purge = on_purge
+        self.retry_delay = retry_delay
+        # Purged rows whose on_purge hook has not succeeded yet
+        self._unrefreshed: list = []
+        self.purged = 0
+        self.purge_batches = 0
+        # (expires_at as epoch seconds, message id)
+        self._heap: List[Tuple[float, int]] = []
+        # Every expiry up to this epoch has been loaded into the heap; None until the first load
+        self._loaded_until: Optional[float] = None
+        self._next_sweep = 0.0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._heap)
+
+    async def start(self, notify: Optional[Notify] = None):
+        if notify is not None:
+            self.notify = notify
+        if self._task is None:
+            self._heap.clear()
+            self._loaded_until = None
+            self._next_sweep = time.time() + self.sweep_interval
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def schedule(self, message_id: int, expires_at: Optional[datetime]):
+        """
+        Track a newly stored message. Expiries beyond the loaded window are skipped here and
+        picked up from the index when the window advances.
+        """
+        if expires_at is None or self._task is None:
+            return
+        when = _epoch(expires_at)
+        if self._loaded_until is not None and when > self._loaded_until:
+            return
+        heapq.heappush(self._heap, (when, message_id))
+        if self._heap[0][1] == message_id:
+            self._wakeup.set()
+
+    async def _load_window(self):
+        previous, until = self._loaded_until, time.time() + self.horizon
+        query = select(MessageModel.id, MessageModel.expires_at).where(
+            MessageModel.expires_at.isnot(None),
+            MessageModel.expires_at <= datetime.fromtimestamp(until, timezone.utc),
+        )
+        if previous is not None:
+            query = query.where(MessageModel.expires_at > datetime.fromtimestamp(previous, timezone.utc))
+        # Advanced before the query runs: a message committed meanwhile is either seen by the
+        # query or pushed by schedule(), never dropped by both (duplicates are harmless)
+        self._loaded_until = until
+        loaded = 0
+        try:
+            async with self.session_factory() as session:
+                result = await session.stream(query.execution_options(yield_per=self.batch_size))
+                async for rows in result.partitions():
+                    self._heap.extend((_epoch(row.expires_at), row.id) for row in rows)
+                    loaded += len(rows)
+        except BaseException:
+            self._loaded_until = previous
+            raise
+        finally:
+            heapq.heapify(self._heap)
+        if loaded:
+            logger.info("Loaded %s message expiries; %s pending", loaded, len(self._heap))
+
+    async def _sweep_overdue(self) -> bool:
+        """
+        Queue rows that should have been purged a while ago, e.g. ones scheduled only by a worker
+        that has since died. Returns whether a full batch was found, so more may be waiting.
+        """
+        cutoff = datetime.fromtimestamp(time.time() - self.sweep_interval, timezone.utc)
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(MessageModel.id, MessageModel.expires_at)
+                .where(MessageModel.expires_at.isnot(None), MessageModel.expires_at <= cutoff)
+                .order_by(MessageModel.expires_at)
+                .limit(self.batch_size)
+            )
+            rows = result.all()
+        for row in rows:
+            heapq.heappush(self._heap, (_epoch(row.expires_at), row.id))
+        if rows:
+            logger.info("Found %s overdue message expiries", len(rows))
+        return len(rows) == self.batch_size
+
+    async def _run(self):
+        while True:
+            try:
+                # Advance the window halfway through, so the heap never runs dry before the next load
+                if self._loaded_until is None or time.time() >= self._loaded_until - self.horizon / 2:
+                    await self._load_window()
+                if time.time() >= self._next_sweep:
+                    more = await self._sweep_overdue()
+                    self._next_sweep = time.time() + (0 if more else self.sweep_interval)
+
+                if self._unrefreshed:
+                    await self._run_purge_hook([])
+
+                self._wakeup.clear()
+                now = time.time()
+                due = []
+                while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+                    due.append(heapq.heappop(self._heap)[1])
+                if due:
+                    await self._purge(due)
+                    continue
+
+                next_load = self._loaded_until - self.horizon / 2
+                next_due = self._heap[0][0] if self._heap else next_load
+                next_retry = now + self.retry_delay if self._unrefreshed else next_load
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(),
+                                           max(0.0, min(next_due, next_load, next_retry, self._next_sweep) - time.time()))
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Message expiry failed: %s", e)
+                await asyncio.sleep(1)
+
+    async def _purge(self, message_ids: List[int]):
+        try:
+            async with self.session_factory() as session:
+                result = await session.execute(
+                    delete(MessageModel)
+                    .where(MessageModel.id.in_(message_ids), MessageModel.expires_at <= datetime.now(timezone.utc))
+                    .returning(MessageModel.id, MessageModel.sender_id, MessageModel.receiver_id,
+                               MessageModel.attachment_id)
+                    .execution_options(synchronize_session=False)
+                )
+                rows = result.all()
+                released = await release_attachments(session, [row.attachment_id for row in rows])
+                await session.commit()
+        except Exception:
+            # Put the batch back so it is retried rather than left in the table
+            for message_id in message_ids:
+                heapq.heappush(self._heap, (0.0, message_id))
+            raise
+
+        # Derived data is rebuilt after the DELETE commits, so its row locks are not held meanwhile
+        await self._run_purge_hook(rows)
+        if released:
+            await get_attachment_store().remove(released)
+        self.purged += len(rows)
+        self.purge_batches += 1
+        purged_by_user: Dict[int, List[int]] = {}
+        for row in rows:
+            purged_by_user.setdefault(row.sender_id, []).append(row.id)
+            if row.receiver_id != row.sender_id:
+                purged_by_user.setdefault(row.receiver_id, []).append(row.id)
+        if rows:
+            logger.info("Purged %s expired messages for %s users", len(rows), len(purged_by_user))
+
+        if self.notify is not None:
+            for user_id, purged_ids in purged_by_user.items():
+                await self.notify(user_id, {
+                    'type': 'delete_message',
+                    'message_ids': purged_ids,
+                    'reason': 'expired',
+                })
+
+    async def _run_purge_hook(self, rows: list):
+        """
+        Run `on_purge` for newly purged rows together with any whose hook failed before.
+        """
+        rows, self._unrefreshed = self._unrefreshed + list(rows), []
+        if not rows or self.on_purge is None:
+            return
+        try:
+            async with self.session_factory() as session:
+                await self.on_purge(session, rows)
+                await session.commit()
+        except Exception as e:
+            # The messages are gone; only derived data such as inbox summaries (and the ETags
+            # built from them) fell behind, so the rows are kept and the hook is retried
+            logger.error("Purge hook failed for %s messages, will retry: %s", len(rows), e)
+            self._unrefreshed = rows
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._heap),
+            "loaded_until": self._loaded_until,
+            "purged": self.purged,
+            "purge_batches": self.purge_batches,
+        }
+
+
+@lru_cache(maxsize=None)
+def get_expiry_scheduler() -> ExpiryScheduler:
+    # Imported here: the inbox module itself builds on this one
+    from app.services.inbox import refresh_purged
+    settings = get_settings()
+    return ExpiryScheduler(
+        horizon=settings.expiry_horizon_seconds, batch_size=settings.expiry_batch_size, on_purge=refresh_purged,
+        sweep_interval=settings.expiry_sweep_interval_seconds,
+    )
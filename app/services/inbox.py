@@ -0,0 +1,328 @@
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import and_, case, delete, func, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.encryption import decrypt_messages, encrypt_messages
+from app.db import SessionLocal
+from app.models.conversation import ConversationSummary
+from app.models.message import Message as MessageModel
+from app.models.user import User as UserModel
+from app.services.archive import latest_archived, message_key
+from app.services.expiry import conversation_key, not_expired
+from app.services.receipts import load_watermarks
+from app.sockets.codecs import from_bytea
+
+# Characters of the last message kept (encrypted) in each summary
+PREVIEW_LENGTH = 80
+
+# Columns that describe a conversation's last message; replaced together
+LAST_MESSAGE_COLUMNS = ("last_message_id", "last_message_at", "last_sender_id", "preview_nonce", "preview_ciphertext")
+
+# What a summary is rebuilt from: enough of a message to order it and decrypt its preview
+SUMMARY_SOURCE_COLUMNS = (
+    MessageModel.id,
+    MessageModel.sender_id,
+    MessageModel.receiver_id,
+    MessageModel.content,
+    MessageModel.nonce,
+    MessageModel.ciphertext,
+    MessageModel.timestamp,
+)
+
+# (timestamp, message id) of the last message a page of the inbox ended at
+InboxCursor = Tuple[datetime, int]
+
+
+def upsert_summaries(dialect_name: str, rows: List[dict], replace: bool = False):
+    """
+    One multi-row upsert of conversation summaries.
+
+    By default rows are increments from new messages: the last message only moves forward (a
+    slower transaction cannot overwrite a newer preview) and `unread_count` is added to the
+    stored count. With `replace`, rows are recomputed summaries and overwrite what is stored.
+    Either way an existing row's `version` is bumped.
+    """
+    if dialect_name == "postgresql":
+        statement = postgresql.insert(ConversationSummary).values(rows)
+    elif dialect_name == "sqlite":
+        statement = sqlite.insert(ConversationSummary).values(rows)
+    else:
+        raise NotImplementedError(f"Conversation summaries are not supported on {dialect_name}")
+    excluded = statement.excluded
+    if replace:
+        set_ = {column: excluded[column] for column in LAST_MESSAGE_COLUMNS + ("unread_count",)}
+    else:
+        newer = excluded.last_message_id > ConversationSummary.last_message_id
+        set_ = {
+            column: case((newer, excluded[column]), else_=getattr(ConversationSummary, column))
+            for column in LAST_MESSAGE_COLUMNS
+        }
+        set_["unread_count"] = ConversationSummary.unread_count + excluded.unread_count
+    set_["version"] = ConversationSummary.version + 1
+    return statement.on_conflict_do_update(index_elements=[ConversationSummary.user_id, ConversationSummary.peer_id], set_=set_)
+
+
+def summary_rows(messages: Iterable[Tuple[int, int, int, datetime, str]]) -> List[dict]:
+    """
+    Summary increments for newly stored (id, sender id, receiver id, timestamp, plain text)
+    messages: both sides get the newest message of their conversation, and the receiver's
+    unread count goes up by the number of messages they were sent.
+    """
+    rows = {}
+    for message_id, sender_id, receiver_id, timestamp, content in messages:
+        for user_id, peer_id, unread in ((sender_id, receiver_id, 0), (receiver_id, sender_id, 1)):
+            if user_id == peer_id and unread:
+                continue
+            row = rows.get((user_id, peer_id))
+            if row is None:
+                row = rows[(user_id, peer_id)] = {"user_id": user_id, "peer_id": peer_id, "unread_count": 0}
+            if "last_message_id" not in row or message_id > row["last_message_id"]:
+                row.update(last_message_id=message_id, last_message_at=timestamp, last_sender_id=sender_id,
+                           preview=content[:PREVIEW_LENGTH])
+            row["unread_count"] += unread
+    rows = list(rows.values())
+    # One encryption call for every preview in the batch
+    for row, (nonce, ciphertext) in zip(rows, encrypt_messages([row.pop("preview") for row in rows])):
+        row["preview_nonce"], row["preview_ciphertext"] = nonce, ciphertext
+    return rows
+
+
+async def record_messages(db: AsyncSession, messages: Iterable[Tuple[int, int, int, datetime, str]]):
+    """
+    Fold newly stored messages into both participants' summaries, in the caller's transaction.
+    """
+    rows = summary_rows(messages)
+    if rows:
+        await db.execute(upsert_summaries(db.get_bind().dialect.name, rows))
+
+
+async def record_stored_messages(rows: List[dict]):
+    """
+    MessageWriter hook for messages stored through Supabase: update summaries for the batch in
+    one transaction. Previews are decrypted from the stored (bytea) nonce and ciphertext.
+    """
+    plain_texts = decrypt_messages([(from_bytea(row['nonce']), from_bytea(row['ciphertext'])) for row in rows])
+    messages = [
+        (row['id'], row['sender_id'], row['receiver_id'], _timestamp(row['timestamp']), plain_text)
+        for row, plain_text in zip(rows, plain_texts)
+    ]
+    async with SessionLocal() as session:
+        await record_messages(session, messages)
+        await session.commit()
+
+
+def _timestamp(value) -> datetime:
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+
+def message_texts(messages) -> List[Optional[str]]:
+    """
+    The plain text of each message row. REST messages keep their text in `content`; WebSocket
+    messages only store the nonce and ciphertext, which are decrypted here in one batch.
+    """
+    encrypted = [(message.nonce, message.ciphertext) for message in messages
+                 if message.content is None and message.ciphertext is not None]
+    decrypted = iter(decrypt_messages(encrypted) if encrypted else ())
+    return [
+        message.content if message.content is not None or message.ciphertext is None else next(decrypted)
+        for message in messages
+    ]
+
+
+async def _unread(db: AsyncSession, user_id: int, peer_id: int, seen_up_to: int, now: datetime) -> int:
+    return await db.scalar(
+        select(func.count()).select_from(MessageModel).where(
+            MessageModel.sender_id == peer_id,
+            MessageModel.receiver_id == user_id,
+            MessageModel.id > seen_up_to,
+            not_expired(now),
+        )
+    )
+
+
+def _directions(sides: Iterable[Tuple[int, int]]):
+    # Messages sent in any of these (sender id, receiver id) directions
+    return or_(*(and_(MessageModel.sender_id == sender_id, MessageModel.receiver_id == receiver_id)
+                 for sender_id, receiver_id in sides))
+
+
+async def refresh_summaries(db: AsyncSession, pairs: Iterable[Tuple[int, int]]):
+    """
+    Recompute the summaries of these conversations from the messages table and archive, in
+    the caller's transaction. Used after deletes and expiry purges, which can remove the last or
+    unread messages; conversations with no messages left lose their summaries. However many
+    conversations change, this is one window query for the newest message of each, one for
+    their newest archived messages, one grouped count of unread messages and one upsert.
+    """
+    keys = {conversation_key(*pair) for pair in pairs}
+    if not keys:
+        return
+    now = datetime.now(timezone.utc)
+    sides = {side for user_a, user_b in keys for side in ((user_a, user_b), (user_b, user_a))}
+
+    ranked = (
+        select(
+            *SUMMARY_SOURCE_COLUMNS,
+            func.row_number().over(
+                partition_by=(MessageModel.sender_id, MessageModel.receiver_id),
+                order_by=(MessageModel.timestamp.desc(), MessageModel.id.desc()),
+            ).label("rank"),
+        )
+        .where(_directions(sides), not_expired(now))
+        .subquery()
+    )
+    latest = {}
+    for message in (await db.execute(select(ranked).where(ranked.c.rank == 1))).all():
+        key = conversation_key(message.sender_id, message.receiver_id)
+        if key not in latest or message_key(message) > message_key(latest[key]):
+            latest[key] = message
+    # A conversation whose recent messages were all deleted falls back to its archived history
+    for key, archived in (await latest_archived(db, keys)).items():
+        if key not in latest or message_key(archived) > message_key(latest[key]):
+            latest[key] = archived
+
+    emptied = [side for side in sides if conversation_key(*side) not in latest]
+    if emptied:
+        await db.execute(delete(ConversationSummary).where(
+            or_(*(and_(ConversationSummary.user_id == user_id, ConversationSummary.peer_id == peer_id)
+                  for user_id, peer_id in emptied))
+        ))
+    sides = [side for side in sides if conversation_key(*side) in latest]
+    if not sides:
+        return
+
+    watermarks = await load_watermarks(sides, db)
+    unread_filters = [
+        and_(MessageModel.sender_id == peer_id, MessageModel.receiver_id == user_id,
+             MessageModel.id > watermarks.get((user_id, peer_id), (0, 0))[1])
+        for user_id, peer_id in sides if user_id != peer_id
+    ]
+    unread = {}
+    if unread_filters:
+        result = await db.execute(
+            select(MessageModel.receiver_id, MessageModel.sender_id, func.count())
+            .where(or_(*unread_filters), not_expired(now))
+            .group_by(MessageModel.receiver_id, MessageModel.sender_id)
+        )
+        unread = {(user_id, peer_id): count for user_id, peer_id, count in result.all()}
+
+    previews = dict(zip(latest, encrypt_messages(
+        [text[:PREVIEW_LENGTH] for text in message_texts(list(latest.values()))]
+    )))
+    rows = []
+    for user_id, peer_id in sides:
+        key = conversation_key(user_id, peer_id)
+        message, (nonce, ciphertext) = latest[key], previews[key]
+        rows.append({
+            "user_id": user_id,
+            "peer_id": peer_id,
+            "last_message_id": message.id,
+            "last_message_at": message.timestamp,
+            "last_sender_id": message.sender_id,
+            "preview_nonce": nonce,
+            "preview_ciphertext": ciphertext,
+            "unread_count": unread.get((user_id, peer_id), 0),
+        })
+    await db.execute(upsert_summaries(db.get_bind().dialect.name, rows, replace=True))
+
+
+async def apply_watermarks(db: AsyncSession, watermarks: Iterable):
+    """
+    ReceiptCoalescer hook: bring unread counts in line with newly stored (user_id, peer_id,
+    seen_up_to) watermarks, in the flush's transaction. A reader who has seen the last message
+    (the usual case when a chat is opened) is reset to zero in one UPDATE; only partially read
+    conversations are counted.
+    """
+    seen = {(row.user_id, row.peer_id): row.seen_up_to for row in watermarks}
+    if not seen:
+        return
+    # Message statuses shown on both sides come from these watermarks, so both views change
+    await db.execute(
+        update(ConversationSummary)
+        .where(or_(*(and_(ConversationSummary.user_id == user_id, ConversationSummary.peer_id == peer_id)
+                     for pair in seen for user_id, peer_id in (pair, pair[::-1]))))
+        .values(version=ConversationSummary.version + 1)
+    )
+    result = await db.execute(
+        select(ConversationSummary.user_id, ConversationSummary.peer_id, ConversationSummary.last_message_id)
+        .where(or_(*(and_(ConversationSummary.user_id == user_id, ConversationSummary.peer_id == peer_id)
+                     for user_id, peer_id in seen)))
+        .where(ConversationSummary.unread_count > 0)
+    )
+    read_all, read_some = [], []
+    for user_id, peer_id, last_message_id in result.all():
+        (read_all if seen[(user_id, peer_id)] >= last_message_id else read_some).append((user_id, peer_id))
+
+    if read_all:
+        await db.execute(
+            update(ConversationSummary)
+            .where(or_(*(and_(ConversationSummary.user_id == user_id, ConversationSummary.peer_id == peer_id)
+                         for user_id, peer_id in read_all)))
+            .values(unread_count=0)
+        )
+    now = datetime.now(timezone.utc)
+    for user_id, peer_id in read_some:
+        unread = await _unread(db, user_id, peer_id, seen[(user_id, peer_id)], now)
+        await db.execute(
+            update(ConversationSummary)
+            .where(ConversationSummary.user_id == user_id, ConversationSummary.peer_id == peer_id)
+            .values(unread_count=unread)
+        )
+
+
+async def refresh_purged(db: AsyncSession, rows: Iterable):
+    """
+    ExpiryScheduler hook: refresh the conversations that lost messages in a purge.
+    """
+    await refresh_summaries(db, {(row.sender_id, row.receiver_id) for row in rows})
+
+
+async def load_version(db: AsyncSession, user_id: int, peer_id: int) -> Tuple[int, int]:
+    """
+    (last message id, version) of `user_id`'s side of a conversation, or (0, 0) if it has no
+    messages: a primary-key lookup that changes whenever the conversation's history does.
+    """
+    row = (await db.execute(
+        select(ConversationSummary.last_message_id, ConversationSummary.version)
+        .where(ConversationSummary.user_id == user_id, ConversationSummary.peer_id == peer_id)
+    )).first()
+    return tuple(row) if row is not None else (0, 0)
+
+
+async def load_last_message_ids(db: AsyncSession, keys: Iterable[Tuple[int, int]]) -> Dict[Tuple[int, int], int]:
+    """
+    ReceiptCoalescer bound: the newest message id of each (user, peer) conversation, read from
+    the summaries; conversations without messages are omitted.
+    """
+    keys = list(keys)
+    if not keys:
+        return {}
+    result = await db.execute(
+        select(ConversationSummary.user_id, ConversationSummary.peer_id, ConversationSummary.last_message_id)
+        .where(or_(*(and_(ConversationSummary.user_id == user_id, ConversationSummary.peer_id == peer_id)
+                     for user_id, peer_id in keys)))
+    )
+    return {(user_id, peer_id): last_message_id for user_id, peer_id, last_message_id in result.all()}
+
+
+async def load_inbox(db: AsyncSession, user_id: int, before: Optional[InboxCursor] = None, limit: int = 50):
+    """
+    Up to `limit + 1` (summary, peer username) rows of a user's conversations, most recently
+    active first, as a single range scan over the inbox index.
+    """
+    query = (
+        select(ConversationSummary, UserModel.username)
+        .outerjoin(UserModel, UserModel.id == ConversationSummary.peer_id)
+        .where(ConversationSummary.user_id == user_id)
+    )
+    if before is not None:
+        query = query.where(or_(
+            ConversationSummary.last_message_at < before[0],
+            and_(ConversationSummary.last_message_at == before[0], ConversationSummary.last_message_id < before[1]),
+        ))
+    result = await db.execute(
+        query.order_by(ConversationSummary.last_message_at.desc(), ConversationSummary.last_message_id.desc())
+        .limit(limit + 1)
+    )
+    return result.all()
@@ -1,53 +1,211 @@
-from datetime import datetime
-from typing import List
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from hashlib import blake2b
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+import json
 from fastapi import HTTPException, Depends
-from sqlalchemy.orm import Session
-from app.db import get_db
+from sqlalchemy import and_, insert, or_, select, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db import get_db, SessionLocal
+from app.models.conversation import ConversationSetting
 from app.models.message import Message as MessageModel  # Ensure your Message model is imported
-from app.schemas.message import MessageCreate, MessageResponse
+from app.schemas.message import InboxEntry, InboxPage, MessageCreate, MessagePage, MessageResponse
+from app.core.encryption import decrypt_messages
+from app.services.archive import (
+    delete_archived,
+    find_archived,
+    iter_archived,
+    load_archived,
+    merge_sorted,
+    message_key,
+    reaches_archive,
+)
+from app.services.attachments import check_attachments, get_attachment_store, release_attachments
+from app.services.inbox import load_inbox, load_version, message_texts, record_messages, refresh_summaries
+from app.services.receipts import load_watermarks, message_status
+from app.services.expiry import (
+    ConversationKey,
+    conversation_key,
+    conversation_ttls,
+    expiry_time,
+    get_conversation_ttl_cache,
+    get_expiry_scheduler,
+    not_expired,
+)
 import logging
 
 # Setup logger
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Rows fetched per server-side cursor round-trip when exporting a conversation
+EXPORT_CHUNK_SIZE = 1000
+
+# A keyset cursor: the (timestamp, id) of the message a page starts or ends at
+Cursor = Tuple[datetime, int]
+
+# The columns a MessageResponse is built from; reading only these skips ORM object construction
+MESSAGE_COLUMNS = (
+    MessageModel.id,
+    MessageModel.sender_id,
+    MessageModel.receiver_id,
+    MessageModel.content,
+    MessageModel.nonce,
+    MessageModel.ciphertext,
+    MessageModel.timestamp,
+    MessageModel.expires_at,
+    MessageModel.attachment_id,
+)
+
+
+def encode_cursor(timestamp: datetime, message_id: int) -> str:
+    raw = f"{timestamp.isoformat()}|{message_id}".encode()
+    return urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, message_id = urlsafe_b64decode(padded).decode().rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor.")
+
+
+def conversation_filter(user_id: int, peer_id: int):
+    """
+    Match messages exchanged between exactly these two users, in either direction.
+    """
+    return or_(
+        and_(MessageModel.sender_id == user_id, MessageModel.receiver_id == peer_id),
+        and_(MessageModel.sender_id == peer_id, MessageModel.receiver_id == user_id),
+    )
 
 
 class MessagingService:
 
-    def construct_message_response(self, message_data: MessageModel) -> MessageResponse:
+    def construct_message_response(
+            self, message_data: MessageModel, status: str = "sent", content: Optional[str] = None
+    ) -> MessageResponse:
         """
-        Helper method to construct a MessageResponse from database model instance.
+        Helper method to construct a MessageResponse from database model instance. `content`
+        overrides the row's own for messages stored encrypted (see `message_texts`).
         """
-        logger.debug(f"Constructing MessageResponse from data: {message_data}")
+        logger.debug("Constructing MessageResponse from data: %s", message_data)
         return MessageResponse(
             id=message_data.id,
             sender_id=message_data.sender_id,
             receiver_id=message_data.receiver_id,
-            content=message_data.content,
-            timestamp=message_data.timestamp
+            content=message_data.content if content is None else content,
+            timestamp=message_data.timestamp,
+            expires_at=message_data.expires_at,
+            attachment_id=message_data.attachment_id,
+            status=status
+        )
+
+    def construct_message_dict(self, row, status: str = "sent", content: Optional[str] = None) -> dict:
+        """
+        The MessageResponse shape as a plain dict, for routes that serialize rows straight to JSON.
+        Rows come from the database, so they are not validated again.
+        """
+        return {
+            "id": row.id,
+            "sender_id": row.sender_id,
+            "receiver_id": row.receiver_id,
+            "content": row.content if content is None else content,
+            "timestamp": row.timestamp,
+            "expires_at": row.expires_at,
+            "attachment_id": row.attachment_id,
+            "status": status,
+        }
+
+    async def load_conversation_ttls(
+            self, keys: set, db: AsyncSession
+    ) -> Dict[ConversationKey, Optional[int]]:
+        """
+        Loader for `conversation_ttls`: fetch the default TTL of many conversations in one query.
+        """
+        result = await db.execute(
+            select(ConversationSetting).where(
+                or_(*(and_(ConversationSetting.user_a_id == user_a, ConversationSetting.user_b_id == user_b)
+                      for user_a, user_b in keys))
+            )
         )
+        return {
+            (setting.user_a_id, setting.user_b_id): setting.message_ttl_seconds
+            for setting in result.scalars().all()
+        }
 
-    async def send_message(self, message_data: MessageCreate, db: Session = Depends(get_db)) -> MessageResponse:
+    async def resolve_expiries(self, messages: List[MessageCreate], db: AsyncSession, now: datetime) -> List[Optional[datetime]]:
+        """
+        Expiry time of each message: its own TTL, else its conversation's default TTL.
+        """
+        defaults = {}
+        without_ttl = [(message.sender_id, message.receiver_id) for message in messages if not message.ttl_seconds]
+        if without_ttl:
+            defaults = await conversation_ttls(without_ttl, lambda keys: self.load_conversation_ttls(keys, db))
+        return [
+            expiry_time(
+                message.ttl_seconds or defaults.get(conversation_key(message.sender_id, message.receiver_id)), now
+            )
+            for message in messages
+        ]
+
+    async def get_conversation_ttl(self, user_id: int, peer_id: int, db: AsyncSession) -> Optional[int]:
+        ttls = await conversation_ttls([(user_id, peer_id)], lambda keys: self.load_conversation_ttls(keys, db))
+        return ttls.get(conversation_key(user_id, peer_id))
+
+    async def set_conversation_ttl(self, user_id: int, peer_id: int, ttl_seconds: Optional[int], db: AsyncSession):
+        """
+        Set (or clear, with None) the default self-destruct timer for new messages between two users.
+        Messages already sent keep their own expiry.
+        """
+        try:
+            key = conversation_key(user_id, peer_id)
+            setting = await db.get(ConversationSetting, key)
+            if setting is None:
+                setting = ConversationSetting(user_a_id=key[0], user_b_id=key[1])
+                db.add(setting)
+            setting.message_ttl_seconds = ttl_seconds
+            await db.commit()
+            get_conversation_ttl_cache().pop(key)
+            logger.info("Conversation TTL between user %s and user %s set to %s", user_id, peer_id, ttl_seconds)
+        except Exception as e:
+            await db.rollback()
+            error_msg = f"Failed to set conversation TTL: {str(e)}"
+            logger.error(error_msg)
+            raise HTTPException(status_code=500, detail=error_msg)
+
+    async def send_message(self, message_data: MessageCreate, db: AsyncSession = Depends(get_db)) -> MessageResponse:
+        if message_data.attachment_id is not None:
+            await check_attachments([(message_data.sender_id, message_data.attachment_id)], db)
         try:
             # Prepare message data for storage
-            logger.info(
-                f"Attempting to send message from user {message_data.sender_id} to user {message_data.receiver_id}")
+            logger.debug("Attempting to send message from user %s to user %s", message_data.sender_id, message_data.receiver_id)
+            timestamp = datetime.now(timezone.utc)
+            expires_at, = await self.resolve_expiries([message_data], db, timestamp)
             new_message = MessageModel(
                 sender_id=message_data.sender_id,
                 receiver_id=message_data.receiver_id,
                 content=message_data.content,
-                timestamp=datetime.utcnow().isoformat(),
-                status="sent"  # Set default status to "sent"
+                timestamp=timestamp,
+                status="sent",  # Set default status to "sent"
+                expires_at=expires_at,
+                attachment_id=message_data.attachment_id
             )
 
-            # Add new message to the database
+            # Add new message to the database, with both sides' inbox summaries in the same transaction
             db.add(new_message)
-            db.commit()
-            db.refresh(new_message)
+            await db.flush()
+            await record_messages(db, [(new_message.id, new_message.sender_id, new_message.receiver_id,
+                                        timestamp, new_message.content)])
+            await db.commit()
+            await db.refresh(new_message)
+            get_expiry_scheduler().schedule(new_message.id, new_message.expires_at)
 
             # Construct and return a response object
-            logger.info(
-                f"Message sent successfully from user {message_data.sender_id} to user {message_data.receiver_id}")
+            logger.debug("Message sent successfully from user %s to user %s", message_data.sender_id, message_data.receiver_id)
             return self.construct_message_response(new_message)
 
         except Exception as e:
@@ -55,35 +213,257 @@ class MessagingService:
             logger.error(error_msg)
             raise HTTPException(status_code=500, detail=error_msg)
 
-    async def get_messages(self, sender_id: int, receiver_id: int, db: Session) -> List[MessageResponse]:
+    async def send_messages(
+            self, messages: List[MessageCreate], db: AsyncSession, raw: bool = False
+    ) -> List[Union[MessageResponse, dict]]:
+        """
+        Store many messages in one transaction with a single bulk INSERT ... RETURNING.
+        Responses are returned in the same order as `messages`, as plain dicts with `raw`.
+        """
+        if not messages:
+            return []
+        await check_attachments(
+            [(message.sender_id, message.attachment_id) for message in messages if message.attachment_id is not None], db
+        )
+        try:
+            logger.debug("Attempting to send a batch of %s messages", len(messages))
+            timestamp = datetime.now(timezone.utc)
+            expiries = await self.resolve_expiries(messages, db, timestamp)
+            result = await db.execute(
+                insert(MessageModel).returning(*MESSAGE_COLUMNS, sort_by_parameter_order=True),
+                [
+                    {
+                        "sender_id": message.sender_id,
+                        "receiver_id": message.receiver_id,
+                        "content": message.content,
+                        "timestamp": timestamp,
+                        "status": "sent",
+                        "expires_at": expires_at,
+                        "attachment_id": message.attachment_id,
+                    }
+                    for message, expires_at in zip(messages, expiries)
+                ],
+            )
+            created = result.all()
+            await record_messages(db, [
+                (message.id, message.sender_id, message.receiver_id, timestamp, message.content) for message in created
+            ])
+            await db.commit()
+            for message in created:
+                get_expiry_scheduler().schedule(message.id, message.expires_at)
+
+            logger.debug("Batch of %s messages sent successfully", len(created))
+            construct = self.construct_message_dict if raw else self.construct_message_response
+            return [construct(message) for message in created]
+
+        except Exception as e:
+            await db.rollback()
+            error_msg = f"Failed to send messages: {str(e)}"
+            logger.error(error_msg)
+            raise HTTPException(status_code=500, detail=error_msg)
+
+    async def get_messages(
+            self,
+            user_id: int,
+            peer_id: int,
+            db: AsyncSession,
+            before: Optional[Cursor] = None,
+            after: Optional[Cursor] = None,
+            limit: int = DEFAULT_PAGE_SIZE,
+            raw: bool = False,
+    ) -> Union[MessagePage, dict]:
         """
-        Retrieve messages between a sender and a receiver.
+        Retrieve one page of the conversation between two users, oldest first.
+
+        Without a cursor the newest page is returned; `before` walks back in history and `after`
+        walks forward. Each direction of the conversation is read as its own index range scan
+        capped at the page size, so page latency does not grow with conversation length. Pages
+        that reach past the archive horizon are merged with archived messages.
+
+        With `raw`, the page is returned as plain dicts in the MessagePage shape, ready for
+        RawJSONResponse, instead of validated models.
         """
         try:
-            logger.info(f"Attempting to retrieve messages between user {sender_id} and user {receiver_id}")
+            logger.debug("Attempting to retrieve messages between user %s and user %s", user_id, peer_id)
 
-            # Query messages involving the sender and receiver
-            messages = db.query(MessageModel).filter(
-                (MessageModel.sender_id == sender_id) | (MessageModel.receiver_id == receiver_id)
-            ).order_by(MessageModel.timestamp).all()
+            if after is not None:
+                keyset = or_(MessageModel.timestamp > after[0],
+                             and_(MessageModel.timestamp == after[0], MessageModel.id > after[1]))
+                order = (MessageModel.timestamp, MessageModel.id)
+            else:
+                keyset = None
+                if before is not None:
+                    keyset = or_(MessageModel.timestamp < before[0],
+                                 and_(MessageModel.timestamp == before[0], MessageModel.id < before[1]))
+                order = (MessageModel.timestamp.desc(), MessageModel.id.desc())
 
-            logger.info(f"Retrieved {len(messages)} messages between user {sender_id} and user {receiver_id}")
-            return [self.construct_message_response(message) for message in messages]
+            # One bounded range scan per direction of the conversation, merged on the primary key
+            now = datetime.now(timezone.utc)
+            legs = []
+            for sender, receiver in ((user_id, peer_id), (peer_id, user_id)):
+                leg = select(MessageModel.id).where(
+                    MessageModel.sender_id == sender, MessageModel.receiver_id == receiver, not_expired(now)
+                )
+                if keyset is not None:
+                    leg = leg.where(keyset)
+                legs.append(leg.order_by(*order).limit(limit + 1).subquery())
+            candidate_ids = union_all(*(select(leg.c.id) for leg in legs)).subquery()
+
+            result = await db.execute(
+                select(*MESSAGE_COLUMNS)
+                .where(MessageModel.id.in_(select(candidate_ids.c.id)))
+                .order_by(*order)
+                .limit(limit + 1)
+            )
+            messages = list(result.all())
+            # History past the archive horizon lives in segments; only pages that reach it read them
+            if reaches_archive(messages, after, limit, now):
+                archived = await load_archived(db, user_id, peer_id, before=before, after=after, limit=limit + 1)
+                messages = sorted(messages + archived, key=message_key, reverse=after is None)[:limit + 1]
+
+            has_more = len(messages) > limit
+            messages = messages[:limit]
+            if after is None:
+                messages.reverse()
+
+            # Status comes from the receiver's watermarks rather than a per-message column
+            watermarks = await load_watermarks([(user_id, peer_id), (peer_id, user_id)], db) if messages else {}
+
+            logger.debug("Retrieved %s messages between user %s and user %s", len(messages), user_id, peer_id)
+            construct = self.construct_message_dict if raw else self.construct_message_response
+            page = dict(
+                messages=[
+                    construct(
+                        message,
+                        message_status(message.id, *watermarks.get((message.receiver_id, message.sender_id), (0, 0))),
+                        text,
+                    )
+                    for message, text in zip(messages, message_texts(messages))
+                ],
+                before_cursor=encode_cursor(messages[0].timestamp, messages[0].id) if messages else None,
+                after_cursor=encode_cursor(messages[-1].timestamp, messages[-1].id) if messages else None,
+                has_more=has_more,
+            )
+            return page if raw else MessagePage(**page)
 
         except Exception as e:
             error_msg = f"Failed to retrieve messages: {str(e)}"
             logger.error(error_msg)
             raise HTTPException(status_code=500, detail=error_msg)
 
-    async def delete_message(self, message_id: int, user_id: int, db: Session):
+    async def conversation_etag(
+            self,
+            user_id: int,
+            peer_id: int,
+            db: AsyncSession,
+            before: Optional[Cursor] = None,
+            after: Optional[Cursor] = None,
+            limit: int = DEFAULT_PAGE_SIZE,
+    ) -> str:
+        """
+        A weak ETag for one `get_messages` page, from the conversation summary alone: its last
+        message id and version change with every new, deleted or purged message and every receipt
+        flush, so the tag changes whenever the page could. Messages past their expiry drop out of
+        pages a moment before the purge bumps the version.
+
+        Compute it before reading the page: a change in between pairs a newer page with an older
+        tag, which only costs the client one extra full response.
+        """
+        last_message_id, version = await load_version(db, user_id, peer_id)
+        key = "|".join((
+            str(user_id), str(peer_id), str(last_message_id), str(version),
+            encode_cursor(*before) if before else "", encode_cursor(*after) if after else "", str(limit),
+        ))
+        return f'W/"{blake2b(key.encode(), digest_size=12).hexdigest()}"'
+
+    async def get_inbox(
+            self, user_id: int, db: AsyncSession, before: Optional[Cursor] = None, limit: int = DEFAULT_PAGE_SIZE
+    ) -> InboxPage:
+        """
+        One page of the user's conversations, most recently active first, with a preview of each
+        last message and the unread count. Reads only the summary table, so the cost does not
+        depend on how many messages the conversations hold.
+        """
+        try:
+            entries = await load_inbox(db, user_id, before, limit)
+            has_more = len(entries) > limit
+            entries = entries[:limit]
+            previews = decrypt_messages([(summary.preview_nonce, summary.preview_ciphertext) for summary, _ in entries])
+
+            logger.debug("Retrieved %s conversations for user %s", len(entries), user_id)
+            last = entries[-1][0] if entries else None
+            return InboxPage(
+                conversations=[
+                    InboxEntry(
+                        peer_id=summary.peer_id,
+                        peer_username=username,
+                        last_message_id=summary.last_message_id,
+                        last_message_at=summary.last_message_at,
+                        last_sender_id=summary.last_sender_id,
+                        preview=preview,
+                        unread_count=summary.unread_count,
+                    )
+                    for (summary, username), preview in zip(entries, previews)
+                ],
+                next_cursor=encode_cursor(last.last_message_at, last.last_message_id) if has_more else None,
+            )
+
+        except Exception as e:
+            error_msg = f"Failed to retrieve inbox: {str(e)}"
+            logger.error(error_msg)
+            raise HTTPException(status_code=500, detail=error_msg)
+
+    async def export_messages(
+            self, user_id: int, peer_id: int, chunk_size: int = EXPORT_CHUNK_SIZE
+    ) -> AsyncIterator[bytes]:
+        """
+        Stream the whole conversation between two users as NDJSON, oldest first.
+
+        Rows are read through a server-side cursor `chunk_size` at a time and encoded one chunk
+        at a time, so memory stays constant regardless of history size. Archived messages are
+        merged in a segment at a time. The generator owns its sessions because it outlives the
+        request's dependencies while the response streams.
         """
-        Delete a specific message if the user is the sender.
+        query = (
+            select(*MESSAGE_COLUMNS)
+            .where(conversation_filter(user_id, peer_id), not_expired())
+            .order_by(MessageModel.timestamp, MessageModel.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        exported = 0
+        async with SessionLocal() as session, SessionLocal() as archive_session:
+            result = await session.stream(query)
+            async for rows in merge_sorted(iter_archived(archive_session, user_id, peer_id), result.partitions()):
+                lines = [
+                    json.dumps({
+                        "id": row.id,
+                        "sender_id": row.sender_id,
+                        "receiver_id": row.receiver_id,
+                        "content": text,
+                        "timestamp": row.timestamp.isoformat(),
+                        "expires_at": row.expires_at.isoformat() if row.expires_at else None,
+                        "attachment_id": row.attachment_id,
+                    })
+                    for row, text in zip(rows, message_texts(rows))
+                ]
+                exported += len(lines)
+                yield ("\n".join(lines) + "\n").encode()
+        logger.debug("Exported %s messages between user %s and user %s", exported, user_id, peer_id)
+
+    async def delete_message(self, message_id: int, user_id: int, db: AsyncSession):
+        """
+        Delete a specific message if the user is the sender, whether it is still in the messages
+        table or has been moved into an archive segment. Returns the deleted message.
         """
         try:
-            logger.info(f"User {user_id} attempting to delete message {message_id}")
+            logger.debug("User %s attempting to delete message %s", user_id, message_id)
 
             # Check if the user is the sender of the message
-            message = db.query(MessageModel).filter(MessageModel.id == message_id).first()
+            result = await db.execute(select(MessageModel).where(MessageModel.id == message_id))
+            message = result.scalars().first()
+            archived = None
+            if not message:
+                archived = message = await find_archived(db, message_id, user_id)
 
             if not message:
                 error_msg = "Message not found."
@@ -95,12 +475,24 @@ class MessagingService:
                 logger.warning(error_msg)
                 raise HTTPException(status_code=403, detail=error_msg)
 
-            # Delete the message
-            db.delete(message)
-            db.commit()
+            # Delete the message; the conversation's summaries may have shown it as the last or an unread message
+            if archived is not None:
+                await delete_archived(db, archived)
+            else:
+                await db.delete(message)
+            await db.flush()
+            await refresh_summaries(db, [(message.sender_id, message.receiver_id)])
+            # The attachment goes too unless another message still shares it
+            released = await release_attachments(db, [message.attachment_id])
+            await db.commit()
+            if released:
+                await get_attachment_store().remove(released)
 
-            logger.info(f"Message {message_id} deleted successfully by user {user_id}")
+            logger.info("Message %s deleted successfully by user %s", message_id, user_id)
+            return message
 
+        except HTTPException:
+            raise
         except Exception as e:
             error_msg = f"Failed to delete message: {str(e)}"
             logger.error(error_msg)
@@ -0,0 +1,224 @@
+import asyncio
+import logging
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import get_settings
+from app.db import SessionLocal
+from app.models.conversation import ReadReceipt
+
+logger = logging.getLogger(__name__)
+
+DELIVERED = "delivered"
+SEEN = "seen"
+RECEIPT_STATUSES = (DELIVERED, SEEN)
+
+# (reader id, peer id): the reader's watermarks over messages the peer sent them
+ReceiptKey = Tuple[int, int]
+
+# Called with (user ids, event) once per flushed watermark, e.g. ConnectionManager.send_to_users
+Notify = Callable[[Iterable[int], dict], Awaitable[None]]
+
+# Called with (session, stored watermark rows) inside each flush's transaction, e.g. inbox.apply_watermarks
+OnFlush = Callable[[AsyncSession, list], Awaitable[None]]
+
+# Called with (session, receipt keys) inside each flush's transaction; returns the newest message id of each
+# conversation, e.g. inbox.load_last_message_ids
+Bound = Callable[[AsyncSession, List[ReceiptKey]], Awaitable[Dict[ReceiptKey, int]]]
+
+
+def message_status(message_id: int, delivered_up_to: int, seen_up_to: int) -> str:
+    """
+    Per-message status derived from the receiver's watermarks.
+    """
+    if message_id <= seen_up_to:
+        return SEEN
+    if message_id <= delivered_up_to:
+        return DELIVERED
+    return "sent"
+
+
+def upsert_watermarks(dialect_name: str, rows: List[dict]):
+    """
+    One multi-row upsert that only ever moves watermarks forward (GREATEST on PostgreSQL,
+    two-argument MAX on SQLite), so late or out-of-order receipts cannot roll them back.
+    Returns the stored watermarks.
+    """
+    if dialect_name == "postgresql":
+        statement = postgresql.insert(ReadReceipt).values(rows)
+        greatest = func.greatest
+    elif dialect_name == "sqlite":
+        statement = sqlite.insert(ReadReceipt).values(rows)
+        greatest = func.max
+    else:
+        raise NotImplementedError(f"Read receipts are not supported on {dialect_name}")
+    excluded = statement.excluded
+    return statement.on_conflict_do_update(
+        index_elements=[ReadReceipt.user_id, ReadReceipt.peer_id],
+        set_={
+            "delivered_up_to": greatest(ReadReceipt.delivered_up_to, excluded.delivered_up_to),
+            "seen_up_to": greatest(ReadReceipt.seen_up_to, excluded.seen_up_to),
+        },
+    ).returning(ReadReceipt.user_id, ReadReceipt.peer_id, ReadReceipt.delivered_up_to, ReadReceipt.seen_up_to)
+
+
+def valid_message_id(message_id) -> bool:
+    # bool is an int subclass, and JSON/MessagePack clients can send either
+    return isinstance(message_id, int) and not isinstance(message_id, bool) and message_id > 0
+
+
+def clamp_watermarks(rows: List[dict], latest: Dict[ReceiptKey, int]) -> List[dict]:
+    """
+    Cap each watermark row at the newest message id of its conversation (from `latest`, keyed
+    by (reader, peer)); rows for conversations without messages are dropped.
+    """
+    clamped = []
+    for row in rows:
+        bound = latest.get((row["user_id"], row["peer_id"]), 0)
+        if bound > 0:
+            clamped.append({**row, "delivered_up_to": min(row["delivered_up_to"], bound),
+                            "seen_up_to": min(row["seen_up_to"], bound)})
+    return clamped
+
+
+class ReceiptCoalescer:
+    """
+    Collects delivered/seen receipts and persists them as per-conversation watermarks.
+
+    A receipt only raises an in-memory watermark for its (reader, peer) pair. The first receipt
+    after a flush arms a timer; when it fires (`window` seconds later) every pending pair is
+    written with a single upsert and each pair fans out one `receipt` event to both users. Opening
+    a chat with hundreds of unread messages therefore costs one row write and one frame per
+    socket, not one of each per message.
+
+    Message ids come from clients, so with a `bound` hook watermarks are capped at the newest
+    message of their conversation when flushed; an inflated id cannot mark future messages read.
+    """
+
+    def __init__(self, session_factory=SessionLocal, window: float = 0.05, notify: Optional[Notify] = None,
+                 on_flush: Optional[OnFlush] = None, bound: Optional[Bound] = None):
+        self.session_factory = session_factory
+        self.window = window
+        self.notify = notify
+        self.on_flush = on_flush
+        self.bound = bound
+        self.received = 0
+        self.flushed = 0
+        # key -> [delivered_up_to, seen_up_to]
+        self._pending: Dict[ReceiptKey, List[int]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes = set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def start(self, notify: Optional[Notify] = None):
+        if notify is not None:
+            self.notify = notify
+
+    async def close(self):
+        """
+        Persist whatever is still pending.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def record(self, user_id: int, peer_id: int, status: str, message_id: int):
+        """
+        `user_id` has received (or seen) every message from `peer_id` up to `message_id`.
+        Seen implies delivered.
+        """
+        if status not in RECEIPT_STATUSES:
+            raise ValueError(f"Unknown receipt status: {status}")
+        if not valid_message_id(message_id):
+            raise ValueError(f"Invalid message id: {message_id!r}")
+        self.received += 1
+        watermark = self._pending.setdefault((user_id, peer_id), [0, 0])
+        watermark[0] = max(watermark[0], message_id)
+        if status == SEEN:
+            watermark[1] = max(watermark[1], message_id)
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._schedule_flush)
+
+    def _schedule_flush(self):
+        self._timer = None
+        task = asyncio.create_task(self.flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        rows = [
+            {"user_id": user_id, "peer_id": peer_id, "delivered_up_to": delivered, "seen_up_to": seen}
+            for (user_id, peer_id), (delivered, seen) in pending.items()
+        ]
+        try:
+            async with self.session_factory() as session:
+                if self.bound is not None:
+                    rows = clamp_watermarks(rows, await self.bound(session, list(pending)))
+                stored = []
+                if rows:
+                    result = await session.execute(upsert_watermarks(session.get_bind().dialect.name, rows))
+                    stored = result.all()
+                    if self.on_flush is not None:
+                        await self.on_flush(session, stored)
+                    await session.commit()
+        except Exception as e:
+            logger.error("Failed to persist %s read receipts: %s", len(rows), e)
+            # Merge back so the next flush retries them
+            for (user_id, peer_id), (delivered, seen) in pending.items():
+                watermark = self._pending.setdefault((user_id, peer_id), [0, 0])
+                watermark[0] = max(watermark[0], delivered)
+                watermark[1] = max(watermark[1], seen)
+            if self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self.window, self._schedule_flush)
+            return
+        self.flushed += len(rows)
+
+        if self.notify is not None:
+            for row in stored:
+                await self.notify([row.user_id, row.peer_id], {
+                    'type': 'receipt',
+                    'reader_id': row.user_id,
+                    'sender_id': row.peer_id,
+                    'delivered_up_to': row.delivered_up_to,
+                    'seen_up_to': row.seen_up_to,
+                })
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), "received": self.received, "flushed": self.flushed}
+
+
+async def load_watermarks(keys: Iterable[ReceiptKey], db) -> Dict[ReceiptKey, Tuple[int, int]]:
+    """
+    Stored (delivered_up_to, seen_up_to) for each (reader, peer) pair; missing pairs are omitted.
+    """
+    keys = list(keys)
+    if not keys:
+        return {}
+    result = await db.execute(
+        select(ReadReceipt).where(
+            or_(*(and_(ReadReceipt.user_id == user_id, ReadReceipt.peer_id == peer_id) for user_id, peer_id in keys))
+        )
+    )
+    return {
+        (receipt.user_id, receipt.peer_id): (receipt.delivered_up_to, receipt.seen_up_to)
+        for receipt in result.scalars().all()
+    }
+
+
+@lru_cache(maxsize=None)
+def get_receipt_coalescer() -> ReceiptCoalescer:
+    # Imported here: the inbox module itself reads watermarks from this one
+    from app.services.inbox import apply_watermarks, load_last_message_ids
+    return ReceiptCoalescer(window=get_settings().receipt_flush_interval, on_flush=apply_watermarks,
+                            bound=load_last_message_ids)
@@ -0,0 +1,115 @@
+import asyncio
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+from app.core.cache import TTLCache
+from app.core.config import get_settings
+
+# Cached in place of an id for names that do not exist, so repeated misses skip the database
+NOT_FOUND = object()
+
+USERNAME = "username"
+EMAIL = "email"
+
+
+class UserResolver:
+    """
+    Resolves usernames and emails to user ids through a bounded LRU+TTL cache shared by the REST
+    and WebSocket paths. Each caller supplies the loader for its own backend; concurrent misses
+    for the same name share one lookup. Unknown names are cached for a shorter `negative_ttl`.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: float):
+        self.negative_ttl = negative_ttl
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._in_flight: Dict[tuple, asyncio.Future] = {}
+
+    async def resolve(
+            self, field: str, value: str, loader: Callable[[str], Awaitable[Optional[int]]]
+    ) -> Optional[int]:
+        key = (field, value)
+        cached = self.cache.get(key)
+        if cached is NOT_FOUND:
+            return None
+        if cached is not None:
+            return cached
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            # wait() leaves the shared lookup running if this caller is cancelled
+            await asyncio.wait({in_flight})
+            if in_flight.cancelled():
+                # The caller that started it was cancelled; look the name up afresh
+                return await self.resolve(field, value, loader)
+            return in_flight.result()
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            user_id = await loader(value)
+            self._store(key, user_id)
+            future.set_result(user_id)
+            return user_id
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited failure is not reported as "never retrieved"
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+            # Cancelled before the lookup settled: wake the waiters rather than leave them hanging
+            if not future.done():
+                future.cancel()
+
+    async def resolve_many(
+            self,
+            field: str,
+            values: Iterable[str],
+            loader: Callable[[set], Awaitable[Dict[str, int]]],
+    ) -> Dict[str, int]:
+        """
+        Resolve many names at once; only the cache misses are passed to `loader` in one call.
+        Returns name -> id for the names that exist.
+        """
+        resolved, missing = {}, set()
+        for value in set(values):
+            cached = self.cache.get((field, value))
+            if cached is NOT_FOUND:
+                continue
+            if cached is None:
+                missing.add(value)
+            else:
+                resolved[value] = cached
+        if missing:
+            loaded = await loader(missing)
+            for value in missing:
+                self._store((field, value), loaded.get(value))
+            resolved.update({value: user_id for value, user_id in loaded.items() if value in missing})
+        return resolved
+
+    def _store(self, key: tuple, user_id: Optional[int]):
+        if user_id is None:
+            self.cache.set(key, NOT_FOUND, ttl=self.negative_ttl)
+        else:
+            self.cache.set(key, user_id)
+
+    def invalidate(self, username: Optional[str] = None, email: Optional[str] = None):
+        """
+        Forget cached entries, e.g. the old and new names after a rename or a new signup.
+        """
+        if username is not None:
+            self.cache.pop((USERNAME, username))
+        if email is not None:
+            self.cache.pop((EMAIL, email))
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+
+@lru_cache(maxsize=None)
+def get_user_resolver() -> UserResolver:
+    settings = get_settings()
+    return UserResolver(
+        maxsize=settings.resolver_cache_size,
+        ttl=settings.resolver_cache_ttl,
+        negative_ttl=settings.resolver_negative_ttl,
+    )
@@ -0,0 +1,243 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Awaitable, Callable, List, Optional, Set
+from urllib.parse import urlparse
+import msgpack
+
+logger = logging.getLogger(__name__)
+
+# Called with (channel, message) for every event published on a subscribed channel
+MessageHandler = Callable[[str, dict], Awaitable[None]]
+
+
+def user_channel(user_id) -> str:
+    return f"user:{user_id}"
+
+
+class Broker(ABC):
+    """
+    Pub/sub transport used by ConnectionManager to fan events out across workers.
+
+    Each worker subscribes only to the channels of the users it holds sockets for, and every
+    delivery, status and delete event is published on the recipient's channel.
+    """
+
+    def __init__(self):
+        self.handler: Optional[MessageHandler] = None
+        self.channels: Set[str] = set()
+
+    async def start(self, handler: MessageHandler):
+        self.handler = handler
+
+    @abstractmethod
+    async def publish(self, channel: str, message: dict):
+        """
+        Deliver an event to every worker subscribed to `channel`, this one included.
+        """
+
+    @abstractmethod
+    async def subscribe(self, channel: str):
+        """
+        Start receiving this channel's events in the handler.
+        """
+
+    @abstractmethod
+    async def unsubscribe(self, channel: str):
+        """
+        Stop receiving this channel's events.
+        """
+
+    async def close(self):
+        self.channels.clear()
+
+
+class InMemoryBroker(Broker):
+    """
+    Single-process broker: publishing hands the event straight to this worker's handler.
+    """
+
+    async def publish(self, channel: str, message: dict):
+        if channel in self.channels and self.handler is not None:
+            await self.handler(channel, message)
+
+    async def subscribe(self, channel: str):
+        self.channels.add(channel)
+
+    async def unsubscribe(self, channel: str):
+        self.channels.discard(channel)
+
+
+def encode_command(*args) -> bytes:
+    """
+    Encode a command as a RESP array of bulk strings.
+    """
+    parts = [f"*{len(args)}\r\n".encode()]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+async def read_reply(reader: asyncio.StreamReader):
+    """
+    Read one RESP reply. Errors are returned as exceptions rather than raised so callers can
+    route them to the command that caused them.
+    """
+    line = await reader.readuntil(b"\r\n")
+    kind, body = line[:1], line[1:-2]
+    if kind == b"+":
+        return body.decode()
+    if kind == b"-":
+        return RuntimeError(body.decode())
+    if kind == b":":
+        return int(body)
+    if kind == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if kind == b"*":
+        length = int(body)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise ConnectionError(f"Unexpected RESP reply type: {kind!r}")
+
+
+class RedisBroker(Broker):
+    """
+    Broker speaking the Redis protocol (RESP) over two connections: one pipelined connection
+    for PUBLISH and one dedicated to SUBSCRIBE pushes. Any server implementing PUBLISH/SUBSCRIBE
+    works, including a local stand-in. Lost connections are re-established and resubscribed.
+    """
+
+    def __init__(self, url: str, reconnect_delay: float = 1.0, publish_timeout: float = 5.0):
+        super().__init__()
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.reconnect_delay = reconnect_delay
+        self.publish_timeout = publish_timeout
+        self._publisher: Optional[asyncio.StreamWriter] = None
+        self._publisher_ready = asyncio.Event()
+        # Futures for PUBLISH commands in flight, in the order their replies will arrive
+        self._pending: deque = deque()
+        self._subscriber: Optional[asyncio.StreamWriter] = None
+        self._tasks: List[asyncio.Task] = []
+        self._closing = False
+
+    async def _open(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            writer.write(encode_command("AUTH", self.password))
+            reply = await read_reply(reader)
+            if isinstance(reply, Exception):
+                writer.close()
+                raise reply
+        return reader, writer
+
+    async def start(self, handler: MessageHandler):
+        await super().start(handler)
+        self._closing = False
+        self._tasks = [
+            asyncio.create_task(self._run_publisher()),
+            asyncio.create_task(self._run_subscriber()),
+        ]
+
+    async def _run_publisher(self):
+        while not self._closing:
+            try:
+                reader, writer = await self._open()
+                self._publisher = writer
+                self._publisher_ready.set()
+                while True:
+                    reply = await read_reply(reader)
+                    if self._pending:
+                        future = self._pending.popleft()
+                        if not future.done():
+                            if isinstance(reply, Exception):
+                                future.set_exception(reply)
+                            else:
+                                future.set_result(reply)
+            except (ConnectionError, OSError, asyncio.IncompleteReadError) as e:
+                logger.warning("Redis publisher connection lost: %s", e)
+            self._publisher = None
+            self._publisher_ready.clear()
+            for future in self._pending:
+                if not future.done():
+                    future.set_exception(ConnectionError("Redis publisher connection lost"))
+            self._pending.clear()
+            if not self._closing:
+                await asyncio.sleep(self.reconnect_delay)
+
+    async def _run_subscriber(self):
+        while not self._closing:
+            try:
+                reader, writer = await self._open()
+                self._subscriber = writer
+                if self.channels:
+                    writer.write(encode_command("SUBSCRIBE", *self.channels))
+                while True:
+                    reply = await read_reply(reader)
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                        channel, payload = reply[1].decode(), reply[2]
+                        try:
+                            await self.handler(channel, msgpack.unpackb(payload, raw=False))
+                        except Exception as e:
+                            logger.error("Failed to dispatch event on %s: %s", channel, e)
+            except (ConnectionError, OSError, asyncio.IncompleteReadError) as e:
+                logger.warning("Redis subscriber connection lost: %s", e)
+            self._subscriber = None
+            if not self._closing:
+                await asyncio.sleep(self.reconnect_delay)
+
+    async def publish(self, channel: str, message: dict):
+        if self._publisher is None:
+            try:
+                await asyncio.wait_for(self._publisher_ready.wait(), self.publish_timeout)
+            except asyncio.TimeoutError:
+                raise ConnectionError("Redis broker is not connected")
+        future = asyncio.get_running_loop().create_future()
+        # Queue the future and write without awaiting in between, so replies match futures in order
+        self._pending.append(future)
+        # MessagePack keeps binary fields (nonce, ciphertext) as raw bytes on the wire
+        self._publisher.write(encode_command("PUBLISH", channel, msgpack.packb(message, use_bin_type=True)))
+        await asyncio.wait_for(future, self.publish_timeout)
+
+    async def subscribe(self, channel: str):
+        self.channels.add(channel)
+        if self._subscriber is not None:
+            self._subscriber.write(encode_command("SUBSCRIBE", channel))
+
+    async def unsubscribe(self, channel: str):
+        self.channels.discard(channel)
+        if self._subscriber is not None:
+            self._subscriber.write(encode_command("UNSUBSCRIBE", channel))
+
+    async def close(self):
+        self._closing = True
+        for writer in (self._publisher, self._subscriber):
+            if writer is not None:
+                writer.close()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await super().close()
+
+
+def create_broker(url: str) -> Broker:
+    """
+    Build a broker from a URL: memory:// for a single worker, redis://[:password@]host:port for many.
+    """
+    scheme = urlparse(url).scheme
+    if scheme in ("", "memory"):
+        return InMemoryBroker()
+    if scheme == "redis":
+        return RedisBroker(url)
+    raise ValueError(f"Unsupported broker URL scheme: {scheme}")
@@ -0,0 +1,75 @@
+import json
+from typing import Iterable, Optional, Union
+import msgpack
+
+JSON_SUBPROTOCOL = "ranaglyph.json.v1"
+MSGPACK_SUBPROTOCOL = "ranaglyph.msgpack.v1"
+
+
+class JsonCodec:
+    """
+    Text frames for existing clients. Binary fields (nonce, ciphertext) travel as hex strings.
+    """
+    subprotocol = JSON_SUBPROTOCOL
+    binary = False
+
+    @staticmethod
+    def _default(value):
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return bytes(value).hex()
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+    def encode(self, event: dict) -> str:
+        return json.dumps(event, separators=(",", ":"), default=self._default)
+
+    def decode(self, frame: Union[str, bytes]) -> dict:
+        return json.loads(frame)
+
+
+class MsgpackCodec:
+    """
+    Binary MessagePack frames; binary fields travel as raw bytes, at half the size of hex.
+    """
+    subprotocol = MSGPACK_SUBPROTOCOL
+    binary = True
+
+    def encode(self, event: dict) -> bytes:
+        return msgpack.packb(event, use_bin_type=True)
+
+    def decode(self, frame: Union[str, bytes]) -> dict:
+        if isinstance(frame, str):
+            return json.loads(frame)
+        return msgpack.unpackb(frame, raw=False)
+
+
+JSON = JsonCodec()
+MSGPACK = MsgpackCodec()
+CODECS = {codec.subprotocol: codec for codec in (JSON, MSGPACK)}
+
+
+def negotiate(requested: Iterable[str]) -> tuple:
+    """
+    Pick the first supported subprotocol the client offered.
+    Returns (codec, subprotocol to accept with); clients that offer none get JSON and no subprotocol.
+    """
+    for subprotocol in requested:
+        codec = CODECS.get(subprotocol)
+        if codec is not None:
+            return codec, subprotocol
+    return JSON, None
+
+
+def to_bytea(value: Optional[bytes]) -> Optional[str]:
+    """
+    PostgREST input format for a bytea column; the value is stored as raw bytes.
+    """
+    return None if value is None else "\\x" + value.hex()
+
+
+def from_bytea(value) -> Optional[bytes]:
+    """
+    Decode a bytea value as returned by PostgREST ("\\x..." hex) back to bytes.
+    """
+    if value is None or isinstance(value, bytes):
+        return value
+    return bytes.fromhex(value[2:] if value.startswith("\\x") else value)
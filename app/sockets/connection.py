@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Callable, Dict, Hashable, Optional, Union
+from fastapi import WebSocket
+from app.sockets.codecs import JSON
+from app.core.metrics import WS_FRAMES_DROPPED, WS_FRAMES_SENT
+
+logger = logging.getLogger(__name__)
+
+# What to do when a socket's outbound queue is full
+DROP = "drop"              # discard the new frame
+COALESCE = "coalesce"      # replace a pending frame with the same key, else discard the oldest frame
+DISCONNECT = "disconnect"  # close the slow consumer; it can reconnect and resync
+POLICIES = (DROP, COALESCE, DISCONNECT)
+
+# Close code sent to evicted slow consumers ("try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+def coalesce_key(message: dict) -> Optional[Hashable]:
+    """
+    Frames that supersede earlier frames with the same key, e.g. repeated receipts for one conversation.
+    """
+    if message.get('type') == 'delete_message' and message.get('message_id') is not None:
+        return message['type'], message['message_id']
+    if message.get('type') == 'receipt':
+        # Watermarks only move forward, so the latest receipt for a conversation supersedes the rest
+        return message['type'], message.get('reader_id'), message.get('sender_id')
+    return None
+
+
+class Connection:
+    """
+    One live socket with a bounded outbound queue drained by its own writer task.
+
+    Enqueueing never awaits, so fan-out to many sockets costs the same whether or not some of
+    them are on slow links; what happens when a queue is full is decided by `policy`.
+    """
+
+    def __init__(
+            self,
+            websocket: WebSocket,
+            user_id: str,
+            max_queue: int,
+            policy: str,
+            on_evict: Optional[Callable[["Connection"], None]] = None,
+            codec=JSON,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.websocket = websocket
+        self.user_id = user_id
+        self.max_queue = max_queue
+        self.policy = policy
+        self.on_evict = on_evict
+        # Wire encoding negotiated for this socket (JSON text or MessagePack binary frames)
+        self.codec = codec
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.send_latency_total = 0.0
+        self.send_latency_max = 0.0
+        self.closed = False
+        # Entries are [key, frame, enqueued_at] so a coalesced frame can be replaced in place
+        self._frames: deque = deque()
+        self._pending_keys: Dict[Hashable, list] = {}
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # Live events held back while missed events are replayed, as (message, frame); None when not syncing
+        self.held: Optional[list] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._frames)
+
+    def start(self):
+        self._task = asyncio.create_task(self._drain())
+
+    async def stop(self):
+        self.closed = True
+        self._frames.clear()
+        self._pending_keys.clear()
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def enqueue(self, message: dict, frame: Optional[Union[str, bytes]] = None, replayed: bool = False) -> bool:
+        """
+        Queue an event for this socket, optionally already encoded with this socket's codec
+        (fan-out encodes once per codec). Returns False if the frame was not queued.
+        While the socket is held, only `replayed` events are queued and live ones are buffered.
+        """
+        if self.closed:
+            return False
+        if self.held is not None and not replayed:
+            if len(self.held) >= self.max_queue:
+                # Too much arrived during the replay; the client reconnects and syncs from where it got to
+                self._evict()
+                return False
+            self.held.append((message, frame))
+            return True
+        if frame is None:
+            frame = self.codec.encode(message)
+        key = coalesce_key(message)
+        if len(self._frames) >= self.max_queue:
+            if self.policy == DROP:
+                self.dropped += 1
+                WS_FRAMES_DROPPED.labels(DROP).inc()
+                return False
+            if self.policy == DISCONNECT:
+                self._evict()
+                return False
+            pending = self._pending_keys.get(key) if key is not None else None
+            if pending is not None:
+                pending[1] = frame
+                self.coalesced += 1
+                return True
+            oldest = self._frames.popleft()
+            if oldest[0] is not None:
+                self._pending_keys.pop(oldest[0], None)
+            self.dropped += 1
+            WS_FRAMES_DROPPED.labels(COALESCE).inc()
+
+        entry = [key, frame, time.monotonic()]
+        self._frames.append(entry)
+        if key is not None:
+            self._pending_keys[key] = entry
+        self._ready.set()
+        return True
+
+    def hold(self):
+        """
+        Buffer live events instead of queueing them, until `release`.
+        """
+        if self.held is None:
+            self.held = []
+
+    def release(self, replayed_up_to: int = 0):
+        """
+        Queue the held live events after the replay, skipping any the replay already sent.
+        """
+        held, self.held = self.held or [], None
+        for message, frame in held:
+            event_id = message.get('event_id')
+            if event_id is None or event_id > replayed_up_to:
+                self.enqueue(message, frame)
+
+    def _evict(self):
+        logger.warning("Disconnecting slow consumer for user %s with %s queued frames", self.user_id, len(self._frames))
+        self.closed = True
+        self.dropped += len(self._frames) + 1
+        WS_FRAMES_DROPPED.labels(DISCONNECT).inc(len(self._frames) + 1)
+        self._frames.clear()
+        self._pending_keys.clear()
+        asyncio.create_task(self._close_socket())
+        if self.on_evict is not None:
+            self.on_evict(self)
+
+    async def _close_socket(self):
+        try:
+            await self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+        except Exception:
+            pass
+
+    async def _drain(self):
+        while not self.closed:
+            await self._ready.wait()
+            self._ready.clear()
+            while self._frames and not self.closed:
+                key, frame, enqueued_at = self._frames.popleft()
+                if key is not None:
+                    self._pending_keys.pop(key, None)
+                try:
+                    if self.codec.binary:
+                        await self.websocket.send_bytes(frame)
+                    else:
+                        await self.websocket.send_text(frame)
+                except Exception as e:
+                    logger.debug("Stopping writer for user %s: %s", self.user_id, e)
+                    self.closed = True
+                    return
+                latency = time.monotonic() - enqueued_at
+                self.sent += 1
+                WS_FRAMES_SENT.inc()
+                self.send_latency_total += latency
+                self.send_latency_max = max(self.send_latency_max, latency)
+
+    def stats(self) -> dict:
+        return {
+            "user_id": self.user_id,
+            "subprotocol": self.codec.subprotocol,
+            "queue_depth": len(self._frames),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "send_latency_avg": self.send_latency_total / self.sent if self.sent else 0.0,
+            "send_latency_max": self.send_latency_max,
+        }
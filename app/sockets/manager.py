@@ -1,16 +1,205 @@
-from typing import List
+import asyncio
+import logging
+from typing import Dict, List, Optional
 from fastapi import WebSocket
+from app.core.metrics import WS_RESUMES
+from app.sockets.broker import Broker, InMemoryBroker, user_channel
+from app.sockets.connection import Connection, DISCONNECT
+from app.sockets.codecs import negotiate
+from app.sockets.replay import ReplayBuffer
+
+logger = logging.getLogger(__name__)
+
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+    def __init__(self, broker: Optional[Broker] = None, max_queue: int = 256, slow_consumer_policy: str = DISCONNECT,
+                 journal=None, replay_size: int = 256, resume_grace: float = 120):
+        # user id -> {socket id -> connection}; a user may be connected from several devices
+        self.user_connections: Dict[str, Dict[int, Connection]] = {}
+        # socket id -> user id, so a disconnect never has to search the routing table
+        self.connection_users: Dict[int, str] = {}
+        # Events are published on the recipient's channel; this worker subscribes only for the users it holds
+        self.broker = broker or InMemoryBroker()
+        # Each socket gets a bounded outbound queue; the policy decides what a full queue does
+        self.max_queue = max_queue
+        self.slow_consumer_policy = slow_consumer_policy
+        # Optional EventLog: every event is logged per recipient and published with its `event_id`
+        self.journal = journal
+        # user id -> ring buffer of recent events; kept (and subscribed) for `resume_grace` seconds
+        # after the user's last socket closes, so a dropped client can resume from memory
+        self.sessions: Dict[str, ReplayBuffer] = {}
+        self.replay_size = replay_size
+        self.resume_grace = resume_grace
+        self._started = False
+
+    async def start(self):
+        if not self._started:
+            self._started = True
+            await self.broker.start(self._deliver_local)
+
+    async def close(self):
+        if self._started:
+            self._started = False
+            for session in self.sessions.values():
+                if session.expiry is not None:
+                    session.expiry.cancel()
+            self.sessions.clear()
+            await self.broker.close()
+
+    async def connect(self, websocket: WebSocket, user_id: str, hold: bool = False,
+                      resume_token: Optional[str] = None, resume_seq: Optional[int] = None) -> bool:
+        """
+        Accept and register a socket. The first event it gets is a `session` event with the
+        token and `seq` to resume from after a drop.
+
+        With `resume_token` and `resume_seq`, events after that `seq` are replayed from the
+        user's ring buffer, followed by a `sync` event, and True is returned. Otherwise (or if
+        the buffer no longer covers the gap) False is returned and, with `hold`, live events are
+        buffered until `Connection.release`, so missed events can be replayed from elsewhere first.
+        """
+        await self.start()
+        # Clients that ask for a binary subprotocol get MessagePack frames; everyone else keeps JSON
+        codec, subprotocol = negotiate(websocket.scope.get('subprotocols') or [])
+        await websocket.accept(subprotocol=subprotocol)
+        user_id = str(user_id)
+        connection = Connection(
+            websocket, user_id, self.max_queue, self.slow_consumer_policy, on_evict=self._on_evict, codec=codec
+        )
+        if hold:
+            connection.hold()
+        session = self.sessions.get(user_id)
+        if session is None:
+            session = self.sessions[user_id] = ReplayBuffer(self.replay_size)
+            await self.broker.subscribe(user_channel(user_id))
+        elif session.expiry is not None:
+            session.expiry.cancel()
+            session.expiry = None
+
+        # No awaits from here on: the replay is queued before any live event can reach the socket
+        missed = session.after(resume_seq) if resume_token == session.token and resume_seq is not None else None
+        self.user_connections.setdefault(user_id, {})[id(websocket)] = connection
+        self.connection_users[id(websocket)] = user_id
+        connection.start()
+        connection.enqueue({'type': 'session', 'resume_token': session.token, 'seq': session.seq}, replayed=True)
+        if missed is None:
+            if resume_token is not None:
+                WS_RESUMES.labels("miss").inc()
+            return False
+        for message in missed:
+            connection.enqueue(message, replayed=True)
+        connection.enqueue({'type': 'sync', 'status': 'complete', 'seq': session.seq, 'replayed': len(missed)},
+                           replayed=True)
+        connection.release()
+        WS_RESUMES.labels("memory").inc()
+        return True
+
+    async def disconnect(self, websocket: WebSocket):
+        user_id = self.connection_users.pop(id(websocket), None)
+        if user_id is None:
+            return
+        connections = self.user_connections.get(user_id)
+        if connections is not None:
+            connection = connections.pop(id(websocket), None)
+            if connection is not None:
+                await connection.stop()
+            if not connections:
+                del self.user_connections[user_id]
+                session = self.sessions.get(user_id)
+                if session is not None and self.resume_grace > 0 and self._started:
+                    # Keep buffering the user's events for a while in case the client comes back
+                    session.expiry = asyncio.get_running_loop().call_later(
+                        self.resume_grace, lambda: asyncio.create_task(self._end_session(user_id, session))
+                    )
+                else:
+                    await self._end_session(user_id, session)
+
+    async def _end_session(self, user_id: str, session: Optional[ReplayBuffer]):
+        if self.user_connections.get(user_id) or self.sessions.get(user_id) is not session:
+            # The user reconnected in the meantime
+            return
+        self.sessions.pop(user_id, None)
+        await self.broker.unsubscribe(user_channel(user_id))
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+    def get_user_id(self, websocket: WebSocket) -> str | None:
+        return self.connection_users.get(id(websocket))
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+    def is_online(self, user_id) -> bool:
+        return str(user_id) in self.user_connections
+
+    @property
+    def connection_count(self) -> int:
+        return len(self.connection_users)
+
+    @property
+    def queued_frames(self) -> int:
+        """
+        Frames waiting in the outbound queues of every socket on this worker.
+        """
+        return sum(connection.queue_depth for connections in self.user_connections.values()
+                   for connection in connections.values())
+
+    def get_connection(self, websocket: WebSocket) -> Optional[Connection]:
+        user_id = self.connection_users.get(id(websocket))
+        if user_id is None:
+            return None
+        return self.user_connections.get(user_id, {}).get(id(websocket))
+
+    def connection_stats(self) -> List[dict]:
+        """
+        Per-connection outbound queue depth, drops and send latency.
+        """
+        return [connection.stats() for connections in self.user_connections.values() for connection in connections.values()]
 
     async def send_personal_message(self, message: dict, websocket: WebSocket):
-        await websocket.send_json(message)
+        connection = self.get_connection(websocket)
+        if connection is not None:
+            connection.enqueue(message)
+
+    async def send_to_user(self, user_id, message: dict):
+        """
+        Publish a message for a single user; whichever workers hold that user's sockets deliver it.
+        """
+        await self.send_to_users([user_id], message)
+
+    async def send_to_users(self, user_ids, message: dict):
+        """
+        Deliver a message to each distinct user once, e.g. both sides of a conversation.
+        With a journal, the event is logged for every recipient first, so offline users get it on their next sync.
+        """
+        user_ids = list(dict.fromkeys(str(user_id) for user_id in user_ids))
+        event_ids = {}
+        if self.journal is not None:
+            try:
+                event_ids = await self.journal.append(user_ids, message)
+            except Exception as e:
+                # Still deliver live; only a later sync (offline recipients) misses it
+                logger.error("Failed to log %s event: %s", message.get('type'), e)
+        for user_id in user_ids:
+            event_id = event_ids.get(int(user_id))
+            await self.broker.publish(
+                user_channel(user_id), message if event_id is None else {**message, 'event_id': event_id}
+            )
+
+    async def _deliver_local(self, channel: str, message: dict):
+        """
+        Broker callback: number the event in the user's ring buffer, then write it to every
+        socket this worker holds for the channel's user.
+        """
+        user_id = channel.split(":", 1)[1]
+        session = self.sessions.get(user_id)
+        if session is None:
+            return
+        message = session.append(message)
+        connections = self.user_connections.get(user_id)
+        if not connections:
+            return
+        # Enqueueing never awaits, so a slow socket cannot hold up delivery to the others
+        frames = {}
+        for connection in list(connections.values()):
+            codec = connection.codec
+            if codec.subprotocol not in frames:
+                frames[codec.subprotocol] = codec.encode(message)
+            connection.enqueue(message, frames[codec.subprotocol])
+
+    def _on_evict(self, connection: Connection):
+        asyncio.create_task(self.disconnect(connection.websocket))
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+from app.core.metrics import SUPABASE_REQUEST_DURATION
+from typing import Any, Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+INSERT = "insert"
+
+# Called with the stored rows of each insert batch before its futures resolve, e.g. inbox.record_stored_messages.
+# Rows whose hook failed are passed again with the next batch, or after `retry_delay` when idle.
+OnInsert = Callable[[List[dict]], Awaitable[None]]
+
+
+class MessageWriter:
+    """
+    Write-behind queue that persists WebSocket messages to Supabase.
+
+    Callers enqueue a message and await its future; a single flusher task drains whatever is
+    queued (up to `batch_size`) and group-commits it as one bulk insert. Batches form naturally
+    while the previous flush is in flight, so an idle worker adds no latency. The queue is
+    bounded, so producers wait (backpressure) instead of growing memory when the database falls
+    behind. Deletes are not queued here: they go through MessagingService.delete_message.
+
+    The Supabase client calls are blocking, so each flush runs them on a thread. Any object with
+    the same `table(...).insert(...).execute()` interface can stand in for the client; without
+    one, the shared Supabase client is created on first use.
+    """
+
+    def __init__(self, client=None, batch_size: int = 500, max_queue: int = 10000, on_insert: Optional[OnInsert] = None,
+                 retry_delay: float = 1.0):
+        self._client = client
+        self.on_insert = on_insert
+        self.retry_delay = retry_delay
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self.flushed_batches = 0
+        self.flushed_operations = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Stored rows whose on_insert hook has not succeeded yet
+        self._unhooked: List[dict] = []
+
+    @property
+    def client(self):
+        if self._client is None:
+            from app.db.supabase_client import get_supabase_client
+            self._client = get_supabase_client()
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """
+        Flush everything already queued, then stop the flusher.
+        """
+        if self._task is None:
+            return
+        await self._queue.join()
+        if self._unhooked:
+            await self._run_hook([])
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _submit(self, kind: str, payload: Any):
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((kind, payload, future))
+        return await future
+
+    async def insert_message(self, row: dict) -> dict:
+        """
+        Queue a message insert; resolves to the stored row (with id and timestamp) once durable.
+        """
+        return await self._submit(INSERT, row)
+
+    async def _run(self):
+        while True:
+            if self._unhooked:
+                try:
+                    first = await asyncio.wait_for(self._queue.get(), self.retry_delay)
+                except asyncio.TimeoutError:
+                    await self._run_hook([])
+                    continue
+            else:
+                first = await self._queue.get()
+            batch = [first]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                logger.error("Failed to flush %s queued writes: %s", len(batch), e)
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, batch: list):
+        inserts = [(payload, future) for kind, payload, future in batch if kind == INSERT]
+        if inserts:
+            rows = await asyncio.to_thread(self._execute_insert, [row for row, _ in inserts])
+            await self._run_hook(rows)
+            for (_, future), stored in zip(inserts, rows):
+                if not future.done():
+                    future.set_result(stored)
+
+        self.flushed_batches += 1
+        self.flushed_operations += len(batch)
+
+    async def _run_hook(self, rows: List[dict]):
+        """
+        Run `on_insert` for newly stored rows together with any whose hook failed before.
+        """
+        rows, self._unhooked = self._unhooked + rows, []
+        if not rows or self.on_insert is None:
+            return
+        try:
+            await self.on_insert(rows)
+        except Exception as e:
+            # The messages are stored; only derived data such as inbox summaries (and the ETags
+            # built from them) fell behind, so the rows are kept and the hook is retried
+            logger.error("Insert hook failed for %s messages, will retry: %s", len(rows), e)
+            self._unhooked = rows
+
+    def _execute_insert(self, rows: List[dict]) -> List[dict]:
+        with SUPABASE_REQUEST_DURATION.labels('messages', 'insert').time():
+            response = self.client.table('messages').insert(rows).execute()
+        if response.get('error'):
+            raise RuntimeError(f"Failed to save messages: {response['error']}")
+        return response['data']
@@ -0,0 +1,42 @@
+import asyncio
+import secrets
+from collections import deque
+from itertools import islice
+from typing import List, Optional
+
+
+class ReplayBuffer:
+    """
+    The most recent events delivered to one user on this worker, numbered with a contiguous
+    per-session `seq`, so a socket that drops can resume from memory.
+
+    `token` names the session: a client that reconnects with it and the last `seq` it saw gets
+    every later event replayed, as long as none has been pushed out of the ring since. A token
+    this worker does not know (a restart, or another worker) or a gap in the ring means the
+    client has to sync some other way.
+    """
+
+    def __init__(self, size: int):
+        self.token = secrets.token_urlsafe(12)
+        self.seq = 0
+        self._events: deque = deque(maxlen=size)
+        # Pending cleanup while the user has no sockets on this worker
+        self.expiry: Optional[asyncio.TimerHandle] = None
+
+    def append(self, message: dict) -> dict:
+        """
+        Number an event and remember it; returns the event as delivered, with its `seq`.
+        """
+        self.seq += 1
+        message = {**message, 'seq': self.seq}
+        self._events.append(message)
+        return message
+
+    def after(self, seq: int) -> Optional[List[dict]]:
+        """
+        Every event after `seq`, oldest first, or None if some of them are no longer buffered.
+        """
+        oldest = self._events[0]['seq'] if self._events else self.seq + 1
+        if seq > self.seq or seq + 1 < oldest:
+            return None
+        return list(islice(self._events, seq + 1 - oldest, None))
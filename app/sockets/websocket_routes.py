@@ -1,23 +1,165 @@
+import asyncio
+import logging
+from functools import lru_cache
+from typing import Optional
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Depends
+from app.sockets.connection import Connection
 from app.sockets.manager import ConnectionManager
-from app.db.supabase_client import supabase
+from app.sockets.broker import create_broker
+from app.sockets.persistence import MessageWriter
+from app.sockets.codecs import to_bytea
+from app.db import SessionLocal
+from app.services.resolver import USERNAME, get_user_resolver
+from app.services.messaging import MessagingService
+from app.services.attachments import check_attachments
+from app.services.events import get_event_log
+from app.services.inbox import record_stored_messages
+from app.services.expiry import conversation_key, conversation_ttls, expiry_time, get_expiry_scheduler
+from app.services.receipts import RECEIPT_STATUSES, get_receipt_coalescer, valid_message_id
+from app.schemas.message import MAX_TTL_SECONDS
+from app.core.config import get_settings
+from app.core.metrics import SUPABASE_REQUEST_DURATION, WS_FRAMES_RECEIVED
 from app.core.encryption import decrypt_message, encrypt_message, authenticate_websocket
 from jose import jwt, JWTError
 
 router = APIRouter()
-manager = ConnectionManager()
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def get_manager() -> ConnectionManager:
+    settings = get_settings()
+    return ConnectionManager(
+        create_broker(settings.broker_url),
+        max_queue=settings.ws_outbound_queue_size,
+        slow_consumer_policy=settings.ws_slow_consumer_policy,
+        journal=get_event_log(),
+        replay_size=settings.ws_replay_buffer_size,
+        resume_grace=settings.ws_resume_grace_seconds,
+    )
+
+
+@lru_cache(maxsize=None)
+def get_writer() -> MessageWriter:
+    """
+    Persists messages off the receive loop; set `get_writer().client` to a fake Supabase client to benchmark.
+    """
+    settings = get_settings()
+    return MessageWriter(
+        batch_size=settings.ws_write_batch_size,
+        max_queue=settings.ws_write_queue_size,
+        on_insert=record_stored_messages,
+    )
+
+
+async def lookup_user_id(username: str):
+    """
+    Resolver loader for the WebSocket path: fetch a user id from Supabase, off the event loop.
+    """
+    def query():
+        with SUPABASE_REQUEST_DURATION.labels('users', 'select').time():
+            return get_writer().client.table('users').select('user_id').filter('username', 'eq', username).execute()
+    response = await asyncio.to_thread(query)
+    rows = response.get('data')
+    return rows[0]['user_id'] if rows else None
+
+
+async def lookup_message_sender(message_id: int, receiver_id: int):
+    """
+    Sender of a message addressed to `receiver_id`, for receipts from clients that omit `peer_username`.
+    """
+    def query():
+        with SUPABASE_REQUEST_DURATION.labels('messages', 'select').time():
+            return (get_writer().client.table('messages').select('sender_id')
+                    .filter('id', 'eq', message_id).filter('receiver_id', 'eq', receiver_id).execute())
+    rows = (await asyncio.to_thread(query)).get('data')
+    return rows[0]['sender_id'] if rows else None
+
+
+async def lookup_conversation_ttls(keys: set) -> dict:
+    """
+    Loader for `conversation_ttls` on the WebSocket path: fetch default TTLs from Supabase.
+    """
+    def query(user_a, user_b):
+        with SUPABASE_REQUEST_DURATION.labels('conversation_settings', 'select').time():
+            return (get_writer().client.table('conversation_settings').select('message_ttl_seconds')
+                    .filter('user_a_id', 'eq', user_a).filter('user_b_id', 'eq', user_b).execute())
+    ttls = {}
+    for key in keys:
+        rows = (await asyncio.to_thread(query, *key)).get('data')
+        if rows:
+            ttls[key] = rows[0]['message_ttl_seconds']
+    return ttls
+
+
+async def sync_missed_events(connection: Connection, user_id, since: int):
+    """
+    Delta sync for a reconnecting client: replay its logged events after `since` (the last
+    `event_id` it saw) across all conversations, then release the live events held meanwhile.
+
+    Ends with a `sync` event carrying the position to sync from next time. Its status is
+    `resync_required` when the client is too far behind, or its position was pruned. The client
+    then reloads over REST and continues from that position.
+    """
+    settings = get_settings()
+    event_log = get_event_log()
+    position, replayed, status = since, 0, 'complete'
+    try:
+        # Read from the database: another worker may have pruned past this position
+        if since < await event_log.load_horizon() or await event_log.exceeds(user_id, since, settings.sync_max_events):
+            status = 'resync_required'
+            position = await event_log.latest(user_id)
+        else:
+            while True:
+                events = await event_log.replay(user_id, position, settings.sync_page_size)
+                for event in events:
+                    connection.enqueue(event, replayed=True)
+                if events:
+                    position = events[-1]['event_id']
+                    replayed += len(events)
+                if len(events) < settings.sync_page_size:
+                    break
+    except Exception as e:
+        logger.error("Sync for user %s failed: %s", user_id, e)
+        status = 'resync_required'
+    connection.enqueue({'type': 'sync', 'status': status, 'event_id': position, 'replayed': replayed}, replayed=True)
+    connection.release(position)
+
+
+async def receive_event(websocket: WebSocket, codec) -> dict:
+    """
+    Read one frame and decode it with the socket's negotiated codec (text or binary frames).
+    """
+    message = await websocket.receive()
+    if message['type'] == 'websocket.disconnect':
+        raise WebSocketDisconnect(message.get('code', 1000))
+    WS_FRAMES_RECEIVED.inc()
+    frame = message.get('bytes')
+    return codec.decode(frame if frame is not None else message.get('text'))
 
 
 @router.websocket("/ws/message/{username}")
-async def websocket_message_endpoint(websocket: WebSocket, username: str, token: str):
+async def websocket_message_endpoint(websocket: WebSocket, username: str, token: str, since: Optional[int] = None,
+                                     resume: Optional[str] = None, seq: Optional[int] = None):
+    manager, writer = get_manager(), get_writer()
     # Authenticate the user
     authenticated_username = await authenticate_websocket(token)
-    await manager.connect(websocket)
+    # Reconnecting clients pass the resume token and last seq they saw, replayed from memory when
+    # still buffered, and/or the last event_id, replayed from the event log while live events wait
+    resumed = await manager.connect(websocket, authenticated_username, hold=since is not None,
+                                    resume_token=resume, resume_seq=seq)
+    connection = manager.get_connection(websocket)
+    codec = connection.codec
+    if not resumed and since is not None:
+        await sync_missed_events(connection, authenticated_username, since)
+    elif not resumed and resume is not None:
+        connection.enqueue({'type': 'sync', 'status': 'resync_required', 'replayed': 0}, replayed=True)
 
     try:
         while True:
             # Receive data from client
-            data = await websocket.receive_json()
+            data = await receive_event(websocket, codec)
 
             if data['type'] == 'message':
                 # Encrypt the message before saving
@@ -27,77 +169,106 @@ async def websocket_message_endpoint(websocket: WebSocket, username: str, token:
                 sender_username = data['sender_username']
                 receiver_username = data['receiver_username']
 
-                # Fetch sender and receiver user IDs from Supabase
-                sender = supabase.table('users').select('user_id').filter('username', 'eq', sender_username).execute()
-                receiver = supabase.table('users').select('user_id').filter('username', 'eq',
-                                                                            receiver_username).execute()
+                # Resolve sender and receiver user IDs through the shared cache, falling back to Supabase
+                sender_id, receiver_id = await asyncio.gather(
+                    get_user_resolver().resolve(USERNAME, sender_username, lookup_user_id),
+                    get_user_resolver().resolve(USERNAME, receiver_username, lookup_user_id),
+                )
 
-                if not sender.get('data') or not receiver.get('data'):
+                if sender_id is None or receiver_id is None:
                     raise HTTPException(status_code=404, detail="Sender or receiver not found")
 
-                sender_id = sender['data'][0]['user_id']
-                receiver_id = receiver['data'][0]['user_id']
+                # Self-destruct timer: the message's own TTL, else the conversation's default
+                ttl_seconds = data.get('ttl_seconds')
+                if ttl_seconds is not None and not (isinstance(ttl_seconds, int) and 0 < ttl_seconds <= MAX_TTL_SECONDS):
+                    raise HTTPException(status_code=400, detail="Invalid ttl_seconds")
+                if ttl_seconds is None:
+                    ttls = await conversation_ttls([(sender_id, receiver_id)], lookup_conversation_ttls)
+                    ttl_seconds = ttls.get(conversation_key(sender_id, receiver_id))
+                expires_at = expiry_time(ttl_seconds)
+
+                # A file shared with the message must be a finished upload of the user sending it
+                attachment_id = data.get('attachment_id')
+                if attachment_id is not None:
+                    if not valid_message_id(attachment_id):
+                        raise HTTPException(status_code=400, detail="Invalid attachment_id")
+                    async with SessionLocal() as session:
+                        await check_attachments([(int(authenticated_username), attachment_id)], session)
 
                 # Save encrypted message to Supabase
                 message_data = {
                     'sender_id': sender_id,
                     'receiver_id': receiver_id,
-                    'nonce': nonce.hex(),
-                    'content': ciphertext.hex(),
+                    'nonce': to_bytea(nonce),
+                    'ciphertext': to_bytea(ciphertext),
                     'timestamp': 'now()',
-                    'status': 'sent'
+                    'status': 'sent',
+                    'expires_at': expires_at.isoformat() if expires_at else None,
+                    'attachment_id': attachment_id,
                 }
-                response = supabase.table('messages').insert(message_data).execute()
-                message_id = response['data'][0]['id']
-
-                # Broadcast the message to the relevant client only
-                for connection in manager.active_connections:
-                    if connection == websocket or connection.client_state == receiver_id:
-                        await connection.send_json({
-                            'type': 'message',
-                            'status': 'sent',
-                            'message_id': message_id,
-                            'sender_username': sender_username,
-                            'receiver_username': receiver_username,
-                            'nonce': nonce.hex(),
-                            'content': ciphertext.hex(),
-                            'timestamp': response['data'][0]['timestamp']
-                        })
+                # Group-committed with other sockets' writes; resolves once the batch is durable
+                stored = await writer.insert_message(message_data)
+                get_expiry_scheduler().schedule(stored['id'], expires_at)
 
-            elif data['type'] == 'status_update':
-                # Handle message status updates (e.g., delivered, seen)
-                message_id = data['message_id']
-                new_status = data['status']
+                # Deliver the message to the sender's and receiver's sockets only; this doubles as the send ack
+                await manager.send_to_users([authenticated_username, sender_id, receiver_id], {
+                    'type': 'message',
+                    'status': 'sent',
+                    'message_id': stored['id'],
+                    'client_message_id': data.get('client_message_id'),
+                    'sender_username': sender_username,
+                    'receiver_username': receiver_username,
+                    # Raw bytes: hex-encoded in JSON frames, native binary in MessagePack frames
+                    'nonce': nonce,
+                    'content': ciphertext,
+                    'timestamp': stored['timestamp'],
+                    'expires_at': message_data['expires_at'],
+                    'attachment_id': attachment_id,
+                })
 
-                # Update the message status in Supabase
-                response = supabase.table('messages').update({'status': new_status}).eq('id', message_id).execute()
+            elif data['type'] == 'status_update':
+                # Receipts (delivered, seen) mean "every message from this peer up to message_id"
+                message_id = data.get('message_id')
+                new_status = data.get('status')
+                # A malformed receipt is dropped; it is no reason to close the socket
+                if new_status not in RECEIPT_STATUSES or not valid_message_id(message_id):
+                    logger.warning("Ignoring invalid receipt from user %s: %r", authenticated_username, data)
+                    continue
 
-                if response.get('error'):
-                    raise HTTPException(status_code=400, detail="Failed to update message status")
+                reader_id = int(authenticated_username)
+                if data.get('peer_username'):
+                    peer_id = await get_user_resolver().resolve(USERNAME, data['peer_username'], lookup_user_id)
+                else:
+                    # Older clients only send the message id; its sender is the peer
+                    peer_id = await lookup_message_sender(message_id, reader_id)
+                if peer_id is None:
+                    logger.warning("Ignoring receipt from user %s for an unknown message or peer", reader_id)
+                    continue
 
-                # Notify relevant clients about the status update
-                for connection in manager.active_connections:
-                    await connection.send_json({
-                        'type': 'status_update',
-                        'message_id': message_id,
-                        'new_status': new_status
-                    })
+                # Raises the reader's watermark in memory; receipts from the same short window are
+                # persisted in one statement, capped at the conversation's newest message, and
+                # announced with one `receipt` event per conversation
+                get_receipt_coalescer().record(reader_id, peer_id, new_status, message_id)
 
             elif data['type'] == 'delete_message':
                 # Handle deleting a message (unsend/self-destruct)
-                message_id = data['message_id']
+                message_id = data.get('message_id')
+                if not valid_message_id(message_id):
+                    raise HTTPException(status_code=400, detail="Invalid message_id")
 
-                # Update the message to mark it as deleted
-                response = supabase.table('messages').update({"deleted_at": "now()"}).eq('id', message_id).execute()
-                if response.get('error'):
-                    raise HTTPException(status_code=400, detail="Failed to delete message")
+                # Same path as DELETE /messaging/delete: only the sender may delete, and both
+                # participants' summaries and the message's attachment are updated with it
+                async with SessionLocal() as session:
+                    deleted = await MessagingService().delete_message(message_id, int(authenticated_username), session)
 
-                # Notify relevant clients to delete the message
-                for connection in manager.active_connections:
-                    await connection.send_json({
-                        'type': 'delete_message',
-                        'message_id': message_id
-                    })
+                # Notify both participants of the message to delete it
+                await manager.send_to_users([deleted.sender_id, deleted.receiver_id], {
+                    'type': 'delete_message',
+                    'message_id': message_id
+                })
 
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        pass
+    finally:
+        # Always drop the socket from the routing table, even if the loop failed
+        await manager.disconnect(websocket)
@@ -0,0 +1,81 @@
+"""
+Messages per second for message encryption and decryption.
+
+Compares the previous one-call-per-message AES-EAX functions with the AES-GCM batch API, and
+the batch API spread over a process pool.
+
+    python benchmarks/aes_batch.py --messages 50000 --processes 4
+"""
+import argparse
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from common import prepare_environment
+
+
+def legacy_encrypt(key, plain_text):
+    from Crypto.Cipher import AES
+    cipher = AES.new(key, AES.MODE_EAX)
+    ciphertext, _ = cipher.encrypt_and_digest(plain_text.encode())
+    return cipher.nonce, ciphertext
+
+
+def legacy_decrypt(key, nonce, ciphertext):
+    from Crypto.Cipher import AES
+    return AES.new(key, AES.MODE_EAX, nonce=nonce).decrypt(ciphertext).decode()
+
+
+def rate(count, started):
+    return f"{count / (time.perf_counter() - started):>10,.0f} msg/s"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--size", type=int, default=200, help="plaintext characters per message")
+    parser.add_argument("--processes", type=int, default=4)
+    args = parser.parse_args()
+
+    prepare_environment()
+    from app.core.config import get_settings
+    from app.core.encryption import (
+        decrypt_message, decrypt_messages, decrypt_messages_parallel, encrypt_message, encrypt_messages,
+    )
+
+    key = get_settings().encryption_key
+    texts = [("x" * args.size)[:-len(str(i))] + str(i) for i in range(args.messages)]
+
+    started = time.perf_counter()
+    legacy = [legacy_encrypt(key, text) for text in texts]
+    print(f"EAX per call encrypt   {rate(len(texts), started)}")
+    started = time.perf_counter()
+    for nonce, ciphertext in legacy:
+        legacy_decrypt(key, nonce, ciphertext)
+    print(f"EAX per call decrypt   {rate(len(texts), started)}")
+
+    started = time.perf_counter()
+    for text in texts:
+        encrypt_message(text)
+    print(f"GCM per call encrypt   {rate(len(texts), started)}")
+    started = time.perf_counter()
+    encrypted = encrypt_messages(texts)
+    print(f"GCM batch encrypt      {rate(len(texts), started)}")
+    started = time.perf_counter()
+    for nonce, ciphertext in encrypted:
+        decrypt_message(nonce, ciphertext)
+    print(f"GCM per call decrypt   {rate(len(texts), started)}")
+    started = time.perf_counter()
+    decrypt_messages(encrypted)
+    print(f"GCM batch decrypt      {rate(len(texts), started)}")
+
+    with ProcessPoolExecutor(args.processes) as executor:
+        # Warm the workers up so process start-up is not counted
+        executor.submit(decrypt_messages, encrypted[:1], key).result()
+        started = time.perf_counter()
+        asyncio.run(decrypt_messages_parallel(encrypted, executor))
+        print(f"GCM pool decrypt x{args.processes}    {rate(len(texts), started)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Throughput of /messaging/send/batch against looping over /messaging/send.
+
+Signs up two users against a throwaway SQLite database and sends --messages messages both
+ways, reporting messages per second for each.
+
+    python benchmarks/batch_send.py --messages 2000 --batch-size 500
+"""
+import argparse
+import asyncio
+import time
+
+from common import create_tables, prepare_environment
+
+
+async def run(messages: int, batch_size: int):
+    import httpx
+    from app.main import create_app
+
+    await create_tables()
+    transport = httpx.ASGITransport(app=create_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name in ("sender", "receiver"):
+            await client.post("/auth/signup", json={"username": name, "email": f"{name}@example.com", "password": "pw"})
+        login = await client.post("/auth/login", json={"email": "sender@example.com", "password": "pw"})
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        payload = [{"receiver_username": "receiver", "content": f"message {i}"} for i in range(messages)]
+
+        started = time.perf_counter()
+        for item in payload:
+            response = await client.post("/messaging/send", json=item, headers=headers)
+            response.raise_for_status()
+        loop_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for offset in range(0, messages, batch_size):
+            response = await client.post(
+                "/messaging/send/batch", json={"messages": payload[offset:offset + batch_size]}, headers=headers
+            )
+            response.raise_for_status()
+        batch_elapsed = time.perf_counter() - started
+
+    print(f"/send loop:  {messages / loop_elapsed:,.0f} msg/s ({loop_elapsed:.2f}s)")
+    print(f"/send/batch: {messages / batch_elapsed:,.0f} msg/s ({batch_elapsed:.2f}s, batch size {batch_size})")
+    print(f"speedup: {loop_elapsed / batch_elapsed:.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    prepare_environment()
+    asyncio.run(run(args.messages, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Cross-worker fan-out throughput through RedisBroker.
+
+Starts --workers processes, each holding --users-per-worker user channels. Every worker
+sends --events events to users held by the *other* workers through a ConnectionManager, from
+--senders concurrent tasks, and the script reports how many events per second were delivered in
+aggregate. Without --url a local stand-in server (resp_server.py) is started; point --url at a
+real Redis to measure scaling beyond it.
+
+With --journal every event is first logged per recipient in the shared event log, as the app
+does, so the number also covers the group-committed INSERTs and the per-recipient commit
+ordering across workers. It uses DATABASE_URL, or a throwaway SQLite database; SQLite has a
+single writer, so point DATABASE_URL at PostgreSQL to see whether workers log in parallel.
+
+    python benchmarks/broker_fanout.py --workers 4 --events 20000
+    DATABASE_URL=postgresql://... python benchmarks/broker_fanout.py --workers 4 --journal
+"""
+import argparse
+import asyncio
+import multiprocessing
+import time
+
+from common import add_repo_to_path, create_tables, prepare_environment
+
+add_repo_to_path()
+
+
+def run_server(ports):
+    """
+    Serve the local stand-in on an ephemeral port and report the port back. A module-level
+    target, so it also works where processes are spawned rather than forked (macOS, Windows).
+    """
+    from resp_server import PubSubServer
+
+    async def serve():
+        server = PubSubServer()
+        ports.put(await server.start())
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+def worker(index, workers, users_per_worker, events, senders, journal, url, ready, go, results):
+    from app.services.events import EventLog
+    from app.sockets.broker import RedisBroker, user_channel
+    from app.sockets.manager import ConnectionManager
+
+    async def run():
+        received = 0
+        done = asyncio.Event()
+        expected = events  # each worker receives as many events as it sends, by symmetry
+
+        async def on_event(channel, message):
+            nonlocal received
+            received += 1
+            if received >= expected:
+                done.set()
+
+        # The manager publishes (after logging, with --journal); a second broker stands in for the
+        # sockets this worker holds and counts what reaches them
+        event_log = EventLog() if journal else None
+        if event_log is not None:
+            await event_log.start()
+        manager = ConnectionManager(RedisBroker(url), journal=event_log)
+        await manager.start()
+        broker = RedisBroker(url)
+        await broker.start(on_event)
+        for user in range(users_per_worker):
+            await broker.subscribe(user_channel(index * users_per_worker + user))
+        await asyncio.sleep(0.5)
+        ready.release()
+        while not go.is_set():
+            await asyncio.sleep(0.01)
+
+        async def sender(first):
+            for event in range(first, events, senders):
+                # Round-robin over the other workers so every event crosses a process boundary
+                target = (index + 1 + event % (workers - 1)) % workers
+                user = target * users_per_worker + event % users_per_worker
+                await manager.send_to_users([user], {"type": "message", "n": event})
+
+        started = time.perf_counter()
+        await asyncio.gather(*(sender(first) for first in range(senders)))
+        await asyncio.wait_for(done.wait(), timeout=120)
+        results.put((received, time.perf_counter() - started))
+        await broker.close()
+        await manager.close()
+        if event_log is not None:
+            await event_log.close()
+
+    asyncio.run(run())
+
+
+async def create_event_log():
+    from app.db import dispose_engine
+
+    await create_tables()
+    # Forked workers must not inherit this loop's connections
+    await dispose_engine()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--users-per-worker", type=int, default=100)
+    parser.add_argument("--events", type=int, default=20000, help="events published per worker")
+    parser.add_argument("--senders", type=int, default=50, help="concurrent sending tasks per worker")
+    parser.add_argument("--journal", action="store_true", help="log every event in the event log before publishing")
+    parser.add_argument("--url", help="redis:// URL; defaults to a local stand-in server")
+    args = parser.parse_args()
+    if args.workers < 2:
+        parser.error("--workers must be at least 2")
+    if args.journal:
+        prepare_environment()
+        asyncio.run(create_event_log())
+
+    server_process = None
+    url = args.url
+    if url is None:
+        ports = multiprocessing.Queue()
+        server_process = multiprocessing.Process(target=run_server, args=(ports,), daemon=True)
+        server_process.start()
+        url = f"redis://127.0.0.1:{ports.get(timeout=30)}"
+
+    ready, go, results = multiprocessing.Semaphore(0), multiprocessing.Event(), multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=worker,
+            args=(index, args.workers, args.users_per_worker, args.events, args.senders, args.journal, url,
+                  ready, go, results),
+        )
+        for index in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        ready.acquire()
+    go.set()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    if server_process is not None:
+        server_process.terminate()
+
+    delivered = sum(received for received, _ in outcomes)
+    elapsed = max(seconds for _, seconds in outcomes)
+    print(f"workers={args.workers} delivered={delivered} elapsed={elapsed:.2f}s throughput={delivered / elapsed:,.0f} events/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Shared bootstrap for the benchmark scripts: a throwaway working directory, a SQLite database
+and dummy Supabase settings, so every benchmark runs offline against the real app code.
+"""
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def add_repo_to_path():
+    """
+    Make this checkout's `app` package importable from a script run inside benchmarks/.
+    """
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+add_repo_to_path()
+
+
+def prepare_environment(prefix: str = "ranaglyph-bench-") -> str:
+    """
+    Point the app at a fresh temporary directory and SQLite database. Must run before `app` is imported.
+    """
+    workdir = tempfile.mkdtemp(prefix=prefix)
+    os.chdir(workdir)
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{workdir}/bench.db")
+    os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:54321")
+    os.environ.setdefault("SUPABASE_KEY", "bench-key")
+    return workdir
+
+
+async def create_tables():
+    from app.db import Base, get_engine
+    from app.models import archive, attachment, conversation, event, message, user  # noqa: F401  register tables on Base
+
+    async with get_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def start_server(fake):
+    """
+    Serve the real app under uvicorn on a free local port, with WebSocket writes going to `fake`.
+    Returns (server, serving task, port); set `server.should_exit` and await the task to stop it.
+    """
+    import uvicorn
+    from app.main import create_app
+    from app.sockets import websocket_routes
+
+    websocket_routes.get_writer().client = fake
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(create_app(), host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server, task, port
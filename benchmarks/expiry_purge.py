@@ -0,0 +1,78 @@
+"""
+Rebuild and purge rate of the self-destruct scheduler.
+
+Inserts --messages already-expired messages plus --future messages that expire beyond the
+horizon, then starts the scheduler as a restart would: it rebuilds from the expires_at index
+and purges the backlog in batches. Reports the rebuild time, purge throughput, the number of
+delete events sent and how many future expiries were (correctly) left out of memory.
+
+    python benchmarks/expiry_purge.py --messages 200000 --batch-size 1000
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+from common import create_tables, prepare_environment
+
+
+async def run(messages: int, future: int, batch_size: int, users: int):
+    from sqlalchemy import insert
+    from app.db import SessionLocal
+    from app.models.message import Message
+    from app.services.expiry import ExpiryScheduler
+
+    await create_tables()
+    now = datetime.now(timezone.utc)
+    rows = [
+        {"sender_id": i % users + 1, "receiver_id": (i + 1) % users + 1, "content": f"m{i}",
+         "timestamp": now, "status": "sent", "expires_at": now - timedelta(seconds=1)}
+        for i in range(messages)
+    ] + [
+        {"sender_id": 1, "receiver_id": 2, "content": f"f{i}", "timestamp": now, "status": "sent",
+         "expires_at": now + timedelta(days=1)}
+        for i in range(future)
+    ]
+    async with SessionLocal() as session:
+        for offset in range(0, len(rows), 10000):
+            await session.execute(insert(Message), rows[offset:offset + 10000])
+        await session.commit()
+
+    events = 0
+
+    async def notify(user_id, event):
+        nonlocal events
+        events += 1
+
+    scheduler = ExpiryScheduler(horizon=600, batch_size=batch_size)
+    started = time.perf_counter()
+    await scheduler.start(notify=notify)
+    while scheduler.stats()["loaded_until"] is None:
+        await asyncio.sleep(0.001)
+    rebuilt = time.perf_counter() - started
+    while scheduler.purged < messages:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    stats = scheduler.stats()
+    await scheduler.close()
+
+    print(f"rebuild:  {rebuilt:.2f}s for {messages:,} due expiries")
+    print(f"purge:    {messages / elapsed:,.0f} msg/s ({elapsed:.2f}s, {stats['purge_batches']} batches of <= {batch_size})")
+    print(f"events:   {events} delete events for {users} users")
+    print(f"in heap:  {stats['pending']} (expiries beyond the horizon stay in the database: {future:,})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--future", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=100)
+    args = parser.parse_args()
+
+    prepare_environment()
+    asyncio.run(run(args.messages, args.future, args.batch_size, args.users))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Memory use of exporting one long conversation.
+
+Fills a throwaway SQLite database with a single conversation of --rows messages, then drains
+MessagingService.export_messages and reports rows/s and the tracemalloc peak. With --compare it
+also loads the same conversation into a list the way a full-history read would, for reference.
+
+    python benchmarks/export_memory.py --rows 1000000 --compare
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+from common import create_tables, prepare_environment
+
+
+async def seed(rows: int, batch: int = 50000):
+    from sqlalchemy import insert
+    from app.db import SessionLocal
+    from app.models.message import Message
+    from app.models.user import User
+
+    start = datetime.now(timezone.utc) - timedelta(seconds=rows)
+    async with SessionLocal() as session:
+        session.add_all([
+            User(id=1, username="alice", email="alice@example.com", hashed_password="x"),
+            User(id=2, username="bob", email="bob@example.com", hashed_password="x"),
+        ])
+        await session.commit()
+        for offset in range(0, rows, batch):
+            await session.execute(insert(Message), [
+                {
+                    "sender_id": 1 if i % 2 else 2,
+                    "receiver_id": 2 if i % 2 else 1,
+                    "content": f"message number {i} with a bit of padding text",
+                    "timestamp": start + timedelta(seconds=i),
+                    "status": "sent",
+                }
+                for i in range(offset, min(rows, offset + batch))
+            ])
+            await session.commit()
+
+
+async def measure_export():
+    from app.services.messaging import MessagingService
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    exported_bytes = 0
+    async for chunk in MessagingService().export_messages(1, 2):
+        exported_bytes += len(chunk)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, exported_bytes
+
+
+async def measure_full_load():
+    from sqlalchemy import select
+    from app.db import SessionLocal
+    from app.models.message import Message
+    from app.services.messaging import conversation_filter
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    async with SessionLocal() as session:
+        result = await session.execute(select(Message).where(conversation_filter(1, 2)))
+        messages = result.scalars().all()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, len(messages)
+
+
+async def run(rows: int, compare: bool):
+    await create_tables()
+    await seed(rows)
+
+    elapsed, peak, exported_bytes = await measure_export()
+    print(f"export: rows={rows} bytes={exported_bytes} {rows / elapsed:,.0f} rows/s peak={peak / 2**20:.1f} MiB")
+    if compare:
+        elapsed, peak, loaded = await measure_full_load()
+        print(f"full load: rows={loaded} {loaded / elapsed:,.0f} rows/s peak={peak / 2**20:.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--compare", action="store_true", help="also measure loading the whole conversation")
+    args = parser.parse_args()
+
+    prepare_environment()
+    asyncio.run(run(args.rows, args.compare))
+
+
+if __name__ == "__main__":
+    main()
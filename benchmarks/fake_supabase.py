@@ -0,0 +1,116 @@
+"""
+In-process fake of the Supabase client, covering the subset of the query builder the app uses
+(select/filter/eq/in_/insert/update/upsert/delete + execute). Responses are plain dicts with
+`data` and `error` keys, like the ones the WebSocket routes read. An optional per-call latency
+simulates the network round-trip to PostgREST.
+"""
+import itertools
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class FakeSupabase:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+        self.tables = defaultdict(list)
+        self._ids = defaultdict(lambda: itertools.count(1))
+        self._lock = threading.Lock()
+
+    def table(self, name: str) -> "FakeQuery":
+        return FakeQuery(self, name)
+
+
+class FakeQuery:
+    def __init__(self, client: FakeSupabase, table: str):
+        self.client = client
+        self.table = table
+        self.operation = "select"
+        self.columns = None
+        self.values = None
+        self.conflict_columns = None
+        self.filters = []
+
+    def select(self, *columns):
+        self.operation = "select"
+        self.columns = [column for spec in columns for column in spec.split(",") if column != "*"] or None
+        return self
+
+    def filter(self, column, operator, value):
+        if operator != "eq":
+            raise NotImplementedError(operator)
+        return self.eq(column, value)
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def in_(self, column, values):
+        values = set(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def insert(self, rows):
+        self.operation, self.values = "insert", rows
+        return self
+
+    def upsert(self, rows, on_conflict: str = "id"):
+        self.operation, self.values = "upsert", rows
+        self.conflict_columns = on_conflict.split(",")
+        return self
+
+    def update(self, values):
+        self.operation, self.values = "update", values
+        return self
+
+    def delete(self):
+        self.operation = "delete"
+        return self
+
+    def _matches(self, row) -> bool:
+        return all(check(row) for check in self.filters)
+
+    def _stamp(self, row: dict) -> dict:
+        return {key: _now() if value == "now()" else value for key, value in row.items()}
+
+    def execute(self) -> dict:
+        if self.client.latency:
+            time.sleep(self.client.latency)
+        with self.client._lock:
+            self.client.calls += 1
+            rows = self.client.tables[self.table]
+            if self.operation == "select":
+                data = [row for row in rows if self._matches(row)]
+                if self.columns:
+                    data = [{column: row.get(column) for column in self.columns} for row in data]
+            elif self.operation in ("insert", "upsert"):
+                data = []
+                for row in self.values if isinstance(self.values, list) else [self.values]:
+                    row = self._stamp(row)
+                    if self.operation == "upsert":
+                        existing = next((r for r in rows if all(r.get(c) == row.get(c) for c in self.conflict_columns)), None)
+                        if existing is not None:
+                            existing.update(row)
+                            data.append(dict(existing))
+                            continue
+                    row.setdefault("id", next(self.client._ids[self.table]))
+                    row.setdefault("timestamp", _now())
+                    rows.append(row)
+                    data.append(dict(row))
+            elif self.operation == "update":
+                data = []
+                values = self._stamp(self.values)
+                for row in rows:
+                    if self._matches(row):
+                        row.update(values)
+                        data.append(dict(row))
+            else:
+                data = [row for row in rows if self._matches(row)]
+                self.client.tables[self.table] = [row for row in rows if not self._matches(row)]
+        return {"data": data, "error": None}
@@ -0,0 +1,60 @@
+"""
+Bytes and microseconds per message for the JSON and MessagePack WebSocket encodings.
+
+Builds a realistic delivery event (16-byte nonce, --size bytes of ciphertext) and times
+encode + decode with each codec.
+
+    python benchmarks/frame_encoding.py --size 256 --iterations 100000
+"""
+import argparse
+import os
+import time
+
+from common import add_repo_to_path
+
+add_repo_to_path()
+from app.sockets.codecs import JSON, MSGPACK
+
+
+def sample_event(size: int) -> dict:
+    return {
+        'type': 'message',
+        'status': 'sent',
+        'message_id': 123456,
+        'client_message_id': 'c-42',
+        'sender_username': 'alice',
+        'receiver_username': 'bob',
+        'nonce': os.urandom(16),
+        'content': os.urandom(size),
+        'timestamp': '2026-01-01T12:00:00.000000+00:00',
+    }
+
+
+def measure(codec, event: dict, iterations: int):
+    frame = codec.encode(event)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        codec.encode(event)
+    encode_us = (time.perf_counter() - started) / iterations * 1e6
+    started = time.perf_counter()
+    for _ in range(iterations):
+        codec.decode(frame)
+    decode_us = (time.perf_counter() - started) / iterations * 1e6
+    size = len(frame.encode() if isinstance(frame, str) else frame)
+    return size, encode_us, decode_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=256, help="ciphertext bytes per message")
+    parser.add_argument("--iterations", type=int, default=100000)
+    args = parser.parse_args()
+
+    event = sample_event(args.size)
+    for codec in (JSON, MSGPACK):
+        size, encode_us, decode_us = measure(codec, event, args.iterations)
+        print(f"{codec.subprotocol:22} {size:6d} bytes  encode {encode_us:6.2f} us  decode {decode_us:6.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+End-to-end load test of the REST and WebSocket paths, with JSON output for diffing commits.
+
+Boots the real app under uvicorn on a local port, backed by a throwaway SQLite database and the
+in-process FakeSupabase client, then runs these scenarios in order:
+
+    signup     POST /auth/signup for --users users
+    login      POST /auth/login for each user
+    send       POST /messaging/send, --messages messages between random pairs
+    paginate   GET /messaging/get/{user_id}, walking every page of --pairs conversations
+    websocket  --ws-clients concurrent /ws/message/{username} clients, each sending
+               --ws-messages messages; latency is send -> the sender's own delivery event
+
+Each scenario reports count, errors, seconds, throughput and p50/p95/p99 latency in
+milliseconds. Results go to stdout (or --output) as JSON; --compare prints the change
+against an earlier run's JSON.
+
+    python benchmarks/load_test.py --users 50 --messages 2000 --output before.json
+    python benchmarks/load_test.py --users 50 --messages 2000 --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+from common import ROOT, create_tables, percentile, prepare_environment, start_server
+from fake_supabase import FakeSupabase
+
+SCENARIOS = ("signup", "login", "send", "paginate", "websocket")
+
+
+def summarize(latencies, errors: int, elapsed: float) -> dict:
+    count = len(latencies)
+    return {
+        "count": count,
+        "errors": errors,
+        "seconds": round(elapsed, 4),
+        "throughput": round(count / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+    }
+
+
+async def run_requests(jobs, concurrency: int) -> dict:
+    """
+    Run `jobs` (coroutine factories) with at most `concurrency` in flight; each is timed.
+    """
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed(job):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await job()
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(timed(job) for job in jobs))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+async def websocket_scenario(port: int, users, tokens, clients: int, messages: int) -> dict:
+    from websockets.asyncio.client import connect
+
+    latencies, errors = [], 0
+    names = users[:clients]
+
+    async def client(name):
+        nonlocal errors
+        url = f"ws://127.0.0.1:{port}/ws/message/{name}?token={tokens[name]}"
+        async with connect(url, max_size=None) as websocket:
+            pending = {}
+            done = asyncio.Event()
+
+            async def reader():
+                async for frame in websocket:
+                    event = json.loads(frame)
+                    sent_at = pending.pop(event.get("client_message_id"), None)
+                    if sent_at is not None:
+                        latencies.append(time.perf_counter() - sent_at)
+                        if not pending and sent_count == messages:
+                            done.set()
+
+            reading = asyncio.create_task(reader())
+            sent_count = 0
+            for n in range(messages):
+                peer = random.choice([user for user in users if user != name])
+                client_message_id = f"{name}-{n}"
+                pending[client_message_id] = time.perf_counter()
+                sent_count += 1
+                await websocket.send(json.dumps({
+                    "type": "message", "content": f"hello {n}", "sender_username": name,
+                    "receiver_username": peer, "client_message_id": client_message_id,
+                }))
+            try:
+                await asyncio.wait_for(done.wait(), timeout=60)
+            except asyncio.TimeoutError:
+                errors += len(pending)
+            reading.cancel()
+            await asyncio.gather(reading, return_exceptions=True)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(client(name) for name in names), return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    errors += sum(messages for result in results if isinstance(result, Exception))
+    return summarize(latencies, errors, elapsed)
+
+
+async def run(args) -> dict:
+    import httpx
+
+    await create_tables()
+    fake = FakeSupabase(latency=args.supabase_latency)
+    server, server_task, port = await start_server(fake)
+    random.seed(args.seed)
+    results = {}
+    users = [f"user{index}" for index in range(args.users)]
+    tokens, ids = {}, {}
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+        async def signup(name):
+            response = await client.post(
+                "/auth/signup", json={"username": name, "email": f"{name}@example.com", "password": "pw"}
+            )
+            response.raise_for_status()
+        results["signup"] = await run_requests([lambda name=name: signup(name) for name in users], args.concurrency)
+
+        async def login(name):
+            response = await client.post("/auth/login", json={"email": f"{name}@example.com", "password": "pw"})
+            response.raise_for_status()
+            tokens[name] = response.json()["access_token"]
+        results["login"] = await run_requests([lambda name=name: login(name) for name in users], args.concurrency)
+
+        # The WebSocket path resolves users through Supabase; mirror the SQLite users into the fake
+        from sqlalchemy import select
+        from app.db import SessionLocal
+        from app.models.user import User
+        async with SessionLocal() as session:
+            for user_id, username in (await session.execute(select(User.id, User.username))).all():
+                ids[username] = user_id
+        fake.table("users").insert([{"user_id": user_id, "username": name} for name, user_id in ids.items()]).execute()
+
+        pairs = [tuple(random.sample(users, 2)) for _ in range(args.pairs)]
+
+        async def send(sender, receiver):
+            response = await client.post(
+                "/messaging/send", json={"receiver_username": receiver, "content": "x" * args.content_size},
+                headers={"Authorization": f"Bearer {tokens[sender]}"},
+            )
+            response.raise_for_status()
+        # Half the traffic goes to the conversations that are paginated next, so they have history
+        jobs = []
+        for n in range(args.messages):
+            sender, receiver = random.choice(pairs) if n % 2 else random.sample(users, 2)
+            if n % 4 == 1:
+                sender, receiver = receiver, sender
+            jobs.append(lambda sender=sender, receiver=receiver: send(sender, receiver))
+        results["send"] = await run_requests(jobs, args.concurrency)
+
+        page_latencies, page_errors = [], 0
+        started = time.perf_counter()
+
+        async def walk(user, peer):
+            nonlocal page_errors
+            headers = {"Authorization": f"Bearer {tokens[user]}"}
+            cursor = None
+            while True:
+                params = {"limit": args.page_size}
+                if cursor:
+                    params["before"] = cursor
+                page_started = time.perf_counter()
+                response = await client.get(f"/messaging/get/{ids[peer]}", params=params, headers=headers)
+                if response.status_code != 200:
+                    page_errors += 1
+                    return
+                page_latencies.append(time.perf_counter() - page_started)
+                page = response.json()
+                if not page["has_more"]:
+                    return
+                cursor = page["before_cursor"]
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def bounded_walk(pair):
+            async with semaphore:
+                await walk(*pair)
+        await asyncio.gather(*(bounded_walk(pair) for pair in pairs))
+        results["paginate"] = summarize(page_latencies, page_errors, time.perf_counter() - started)
+
+    results["websocket"] = await websocket_scenario(
+        port, users, tokens, min(args.ws_clients, len(users)), args.ws_messages
+    )
+
+    server.should_exit = True
+    await server_task
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(baseline: dict, current: dict):
+    print(f"{'scenario':<10} {'metric':<11} {'baseline':>12} {'current':>12} {'change':>9}")
+    for scenario in SCENARIOS:
+        before, after = baseline["results"].get(scenario), current["results"].get(scenario)
+        if not before or not after:
+            continue
+        for metric in ("throughput", "p50_ms", "p95_ms", "p99_ms"):
+            old, new = before.get(metric), after.get(metric)
+            if old is None or new is None:
+                continue
+            change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+            print(f"{scenario:<10} {metric:<11} {old:>12.3f} {new:>12.3f} {change:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--pairs", type=int, default=10, help="conversations to paginate")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--content-size", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--ws-clients", type=int, default=50)
+    parser.add_argument("--ws-messages", type=int, default=20, help="messages sent by each WebSocket client")
+    parser.add_argument("--supabase-latency", type=float, default=0.0, help="simulated seconds per Supabase call")
+    parser.add_argument("--bcrypt-rounds", type=int, help="override BCRYPT_ROUNDS (lower it to focus on messaging)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", help="earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    if args.bcrypt_rounds:
+        os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    prepare_environment()
+    results = asyncio.run(run(args))
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        },
+        "results": results,
+    }
+
+    encoded = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(os.path.join(ROOT, args.output) if not os.path.isabs(args.output) else args.output, "w") as file:
+            file.write(encoded + "\n")
+    else:
+        print(encoded)
+    if args.compare:
+        path = args.compare if os.path.isabs(args.compare) else os.path.join(ROOT, args.compare)
+        with open(path) as file:
+            compare(json.load(file), report)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+Login latency next to live WebSocket traffic.
+
+Boots the real app under uvicorn (throwaway SQLite database, in-process FakeSupabase) and
+connects --ws-clients WebSocket clients that keep sending messages to each other, each
+timing send -> its own delivery event. After a warm-up with WebSocket traffic only, it fires
+--logins concurrent POST /auth/login requests through the same server while that traffic
+keeps flowing, so bcrypt work competes with frame delivery on the same worker.
+
+Prints login p50/p99, and WebSocket delivery p50/p99 without and with logins in flight.
+
+    python benchmarks/login_latency.py --logins 200 --concurrency 50 --ws-clients 20
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from common import create_tables, percentile, prepare_environment, start_server
+from fake_supabase import FakeSupabase
+
+
+async def ws_client(port: int, name: str, token: str, peers, samples: dict, phase: list, stop: asyncio.Event,
+                    interval: float):
+    """
+    Send a message every `interval` seconds until `stop`, recording each delivery latency
+    under the phase that was current when it was sent.
+    """
+    from websockets.asyncio.client import connect
+
+    async with connect(f"ws://127.0.0.1:{port}/ws/message/{name}?token={token}", max_size=None) as websocket:
+        pending = {}
+
+        async def reader():
+            async for frame in websocket:
+                sent = pending.pop(json.loads(frame).get("client_message_id"), None)
+                if sent is not None:
+                    sent_phase, sent_at = sent
+                    samples[sent_phase].append(time.perf_counter() - sent_at)
+
+        reading = asyncio.create_task(reader())
+        n = 0
+        while not stop.is_set():
+            client_message_id = f"{name}-{n}"
+            pending[client_message_id] = (phase[0], time.perf_counter())
+            await websocket.send(json.dumps({
+                "type": "message", "content": f"hello {n}", "sender_username": name,
+                "receiver_username": random.choice(peers), "client_message_id": client_message_id,
+            }))
+            n += 1
+            await asyncio.sleep(interval)
+        # Let the last deliveries arrive before closing; what never does is reported as lost
+        deadline = time.perf_counter() + 10
+        while pending and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        samples["lost"] += len(pending)
+        reading.cancel()
+        await asyncio.gather(reading, return_exceptions=True)
+
+
+async def run(args):
+    import httpx
+    from sqlalchemy import select
+    from app.core.password_pool import get_password_pool
+    from app.db import SessionLocal
+    from app.models.user import User
+
+    await create_tables()
+    fake = FakeSupabase()
+    server, server_task, port = await start_server(fake)
+    names = [f"ws{index}" for index in range(args.ws_clients)]
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=120) as client:
+        tokens = {}
+        for name in names + ["bench"]:
+            await client.post("/auth/signup", json={"username": name, "email": f"{name}@example.com", "password": "pw"})
+            response = await client.post("/auth/login", json={"email": f"{name}@example.com", "password": "pw"})
+            tokens[name] = response.json()["access_token"]
+        # The WebSocket path resolves users through Supabase; mirror the SQLite users into the fake
+        async with SessionLocal() as session:
+            rows = (await session.execute(select(User.id, User.username))).all()
+        fake.table("users").insert([{"user_id": user_id, "username": name} for user_id, name in rows]).execute()
+
+        samples = {"ws_only": [], "with_logins": [], "lost": 0}
+        phase, stop = ["ws_only"], asyncio.Event()
+        clients = [
+            asyncio.create_task(ws_client(port, name, tokens[name], [peer for peer in names if peer != name] or [name],
+                                          samples, phase, stop, args.ws_interval))
+            for name in names
+        ]
+        await asyncio.sleep(args.warmup)
+
+        phase[0] = "with_logins"
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies, statuses = [], {}
+
+        async def one_login():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/auth/login", json={"email": "bench@example.com", "password": "pw"})
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        await asyncio.gather(*(one_login() for _ in range(args.logins)))
+        stop.set()
+        results = await asyncio.gather(*clients, return_exceptions=True)
+
+    server.should_exit = True
+    await server_task
+
+    failed = sum(isinstance(result, Exception) for result in results)
+    print(f"logins={args.logins} concurrency={args.concurrency} workers={get_password_pool().max_workers} "
+          f"statuses={statuses}")
+    print(f"login p50={percentile(latencies, 50) * 1000:.1f}ms p99={percentile(latencies, 99) * 1000:.1f}ms")
+    for name in ("ws_only", "with_logins"):
+        values = samples[name]
+        if values:
+            print(f"ws delivery {name}: n={len(values)} p50={percentile(values, 50) * 1000:.2f}ms "
+                  f"p99={percentile(values, 99) * 1000:.2f}ms")
+    print(f"ws clients={len(names)} failed={failed} undelivered={samples['lost']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--ws-clients", type=int, default=20)
+    parser.add_argument("--ws-interval", type=float, default=0.1, help="seconds between messages per client")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds of WebSocket-only traffic first")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    prepare_environment()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+A minimal in-process stand-in for a Redis pub/sub server (PUBLISH, SUBSCRIBE, UNSUBSCRIBE,
+PING, AUTH), so RedisBroker can be exercised without a real Redis.
+
+    python benchmarks/resp_server.py --port 6390
+"""
+import argparse
+import asyncio
+from typing import Dict, Set
+
+from common import add_repo_to_path
+
+add_repo_to_path()
+from app.sockets.broker import encode_command, read_reply
+
+
+class PubSubServer:
+    def __init__(self):
+        self.subscribers: Dict[bytes, Set[asyncio.StreamWriter]] = {}
+        self.server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        channels: Set[bytes] = set()
+        try:
+            while True:
+                command = await read_reply(reader)
+                name, args = command[0].upper(), command[1:]
+                if name == b"PUBLISH":
+                    receivers = self.subscribers.get(args[0], ())
+                    push = encode_command("message", args[0], args[1])
+                    for subscriber in receivers:
+                        subscriber.write(push)
+                    writer.write(b":%d\r\n" % len(receivers))
+                elif name == b"SUBSCRIBE":
+                    for channel in args:
+                        channels.add(channel)
+                        self.subscribers.setdefault(channel, set()).add(writer)
+                        writer.write(encode_command("subscribe", channel, str(len(channels))))
+                elif name == b"UNSUBSCRIBE":
+                    for channel in args:
+                        channels.discard(channel)
+                        self.subscribers.get(channel, set()).discard(writer)
+                elif name in (b"PING", b"AUTH"):
+                    writer.write(b"+OK\r\n")
+                else:
+                    writer.write(b"-ERR unknown command\r\n")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for channel in channels:
+                self.subscribers.get(channel, set()).discard(writer)
+            writer.close()
+
+
+async def serve(port: int):
+    server = PubSubServer()
+    print(f"listening on 127.0.0.1:{await server.start(port=port)}", flush=True)
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=6390)
+    asyncio.run(serve(parser.parse_args().port))
@@ -0,0 +1,79 @@
+"""
+Microseconds per message to turn a page of message rows into a JSON response body.
+
+    validated   MessageResponse per row, a MessagePage, then the response-model validation and
+                JSON dump FastAPI applies to a route's return value (the previous path)
+    raw         plain dicts straight from the rows, encoded by RawJSONResponse with orjson
+    raw-core    the same, with the pydantic-core encoder used when orjson is missing
+
+    python benchmarks/serialization.py --page-size 200 --iterations 2000
+"""
+import argparse
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from common import add_repo_to_path
+
+add_repo_to_path()
+from pydantic import TypeAdapter
+from app.core import serialization
+from app.schemas.message import MessagePage
+from app.services.messaging import MessagingService
+
+Row = namedtuple("Row", "id sender_id receiver_id content timestamp expires_at attachment_id")
+
+
+def sample_rows(count: int, size: int):
+    started = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    return [
+        Row(index, 1 + index % 2, 2 - index % 2, "x" * size, started + timedelta(seconds=index),
+            started + timedelta(days=1) if index % 5 == 0 else None, index if index % 7 == 0 else None)
+        for index in range(count)
+    ]
+
+
+def validated(service, adapter, rows) -> bytes:
+    page = MessagePage(messages=[service.construct_message_response(row, "sent") for row in rows],
+                       before_cursor="b", after_cursor="a", has_more=True)
+    return adapter.dump_json(adapter.validate_python(page))
+
+
+def raw(service, adapter, rows) -> bytes:
+    page = {"messages": [service.construct_message_dict(row, "sent") for row in rows],
+            "before_cursor": "b", "after_cursor": "a", "has_more": True}
+    return serialization.RawJSONResponse(page).body
+
+
+def measure(path, service, adapter, rows, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        path(service, adapter, rows)
+    return (time.perf_counter() - started) / iterations / len(rows) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--page-size", type=int, default=200)
+    parser.add_argument("--content-size", type=int, default=64)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    service, adapter = MessagingService(), TypeAdapter(MessagePage)
+    rows = sample_rows(args.page_size, args.content_size)
+    assert validated(service, adapter, rows) == raw(service, adapter, rows), "the paths must produce the same body"
+
+    results = [("validated", measure(validated, service, adapter, rows, args.iterations))]
+    if serialization.orjson is not None:
+        results.append(("raw", measure(raw, service, adapter, rows, args.iterations)))
+    orjson, serialization.orjson = serialization.orjson, None
+    results.append(("raw-core", measure(raw, service, adapter, rows, args.iterations)))
+    serialization.orjson = orjson
+
+    baseline = results[0][1]
+    for name, us in results:
+        print(f"{name:11} {us:7.2f} us/message  {baseline / us:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
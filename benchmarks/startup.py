@@ -0,0 +1,69 @@
+"""
+Cold-start cost of a new worker: import time, app construction and time-to-first-request.
+
+Each run starts a fresh interpreter (as a new pod or forked worker would), imports app.main,
+builds the app with create_app(), runs the lifespan startup and serves one request. Reports
+the median of each phase over --runs runs, and whether importing alone touched the working
+directory (it should not: settings, .env keys and clients are created in the lifespan).
+
+    python benchmarks/startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from common import ROOT, prepare_environment
+
+CHILD = r"""
+import json, os, sys, time
+files_before = set(os.listdir("."))
+started = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+files_after_import = sorted(set(os.listdir(".")) - files_before)
+asgi_app = app.main.create_app()
+created = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(asgi_app) as client:
+    ready = time.perf_counter()
+    status = client.get("/openapi.json").status_code
+    first = time.perf_counter()
+print(json.dumps({
+    "import": imported - started,
+    "create_app": created - imported,
+    "lifespan": ready - created,
+    "first_request": first - ready,
+    "total": first - started,
+    "status": status,
+    "files_after_import": files_after_import,
+}))
+"""
+
+
+def run_once(workdir: str) -> dict:
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=workdir, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = prepare_environment()
+    results = [run_once(workdir) for _ in range(args.runs)]
+
+    for phase in ("import", "create_app", "lifespan", "first_request", "total"):
+        print(f"{phase:>14}: {statistics.median(result[phase] for result in results) * 1000:8.1f} ms")
+    touched = sorted({name for result in results for name in result["files_after_import"]})
+    print(f"files created by import: {touched or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Messages per second persisted by one worker, with and without the write-behind queue.
+
+Simulates --sockets concurrent WebSocket senders each persisting --messages messages against a
+fake Supabase client with --latency seconds of round-trip per call. The "inline" mode performs one
+blocking insert per message on the event loop, as the receive loop used to; "write-behind" goes
+through MessageWriter's group commits.
+
+    python benchmarks/ws_persistence.py --sockets 200 --messages 20 --latency 0.002
+"""
+import argparse
+import asyncio
+import time
+
+from common import add_repo_to_path
+
+add_repo_to_path()
+from fake_supabase import FakeSupabase
+
+
+def message_row(sender: int, n: int) -> dict:
+    return {'sender_id': sender, 'receiver_id': sender + 1, 'nonce': '00', 'content': f'{n:x}',
+            'timestamp': 'now()', 'status': 'sent'}
+
+
+async def inline(client, sockets: int, messages: int):
+    async def sender(index):
+        for n in range(messages):
+            client.table('messages').insert(message_row(index, n)).execute()
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*(sender(index) for index in range(sockets)))
+
+
+async def write_behind(client, sockets: int, messages: int, batch_size: int):
+    from app.sockets.persistence import MessageWriter
+
+    writer = MessageWriter(client, batch_size=batch_size)
+
+    async def sender(index):
+        for n in range(messages):
+            await writer.insert_message(message_row(index, n))
+
+    await asyncio.gather(*(sender(index) for index in range(sockets)))
+    await writer.close()
+    return writer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sockets", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.002)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    total = args.sockets * args.messages
+
+    client = FakeSupabase(latency=args.latency)
+    started = time.perf_counter()
+    asyncio.run(inline(client, args.sockets, args.messages))
+    elapsed = time.perf_counter() - started
+    print(f"inline:       {total / elapsed:,.0f} msg/s ({client.calls} Supabase calls)")
+
+    client = FakeSupabase(latency=args.latency)
+    started = time.perf_counter()
+    writer = asyncio.run(write_behind(client, args.sockets, args.messages, args.batch_size))
+    elapsed = time.perf_counter() - started
+    print(f"write-behind: {total / elapsed:,.0f} msg/s ({client.calls} Supabase calls, {writer.flushed_batches} batches)")
+
+
+if __name__ == "__main__":
+    main()
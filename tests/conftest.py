@@ -0,0 +1,153 @@
+"""
+Shared fixtures: every test runs against a fresh SQLite database (through aiosqlite) in a
+temporary directory, with new service singletons and the in-process FakeSupabase from
+benchmarks/ standing in for Supabase on the WebSocket path.
+"""
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+# Settings are read on first use, so the environment must be in place before `app` is imported
+WORKDIR = tempfile.mkdtemp(prefix="ranaglyph-tests-")
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{WORKDIR}/test.db",
+    SUPABASE_URL="http://127.0.0.1:54321",
+    SUPABASE_KEY="test-key",
+    ATTACHMENT_DIR=os.path.join(WORKDIR, "attachments"),
+    ATTACHMENT_CHUNK_SIZE="10",
+    BCRYPT_ROUNDS="4",
+)
+
+from fastapi.testclient import TestClient  # noqa: E402
+from fake_supabase import FakeSupabase  # noqa: E402
+from app.core import password_pool  # noqa: E402
+from app.db import Base, dispose_engine, get_engine  # noqa: E402
+from app.models import archive, attachment, conversation, event, message, user  # noqa: E402,F401  register tables
+from app.services import attachments, auth, events, expiry, receipts, resolver  # noqa: E402
+from app.services import archive as archive_service  # noqa: E402
+from app.sockets import websocket_routes  # noqa: E402
+
+# Getters whose instances hold per-test state: caches, queues, background tasks
+STATEFUL_GETTERS = (
+    auth.get_principal_cache,
+    password_pool.get_password_pool,
+    resolver.get_user_resolver,
+    expiry.get_conversation_ttl_cache,
+    expiry.get_expiry_scheduler,
+    receipts.get_receipt_coalescer,
+    events.get_event_log,
+    archive_service.get_archiver,
+    attachments.get_attachment_store,
+    attachments.get_attachment_reaper,
+    websocket_routes.get_manager,
+    websocket_routes.get_writer,
+)
+
+
+async def _recreate_tables():
+    async with get_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    # The pool belongs to this event loop; the test opens its own
+    await dispose_engine()
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session", autouse=True)
+def workdir():
+    # Loading settings writes generated keys to ./.env; keep that out of the checkout
+    previous = os.getcwd()
+    os.chdir(WORKDIR)
+    yield WORKDIR
+    os.chdir(previous)
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(workdir):
+    asyncio.run(_recreate_tables())
+    for getter in STATEFUL_GETTERS:
+        getter.cache_clear()
+    auth.tokens_by_user.clear()
+    yield
+
+
+@pytest.fixture
+async def db():
+    """
+    For async tests: the session factory, with the engine disposed on the test's own loop afterwards.
+    """
+    from app.db import SessionLocal
+
+    yield SessionLocal
+    await dispose_engine()
+
+
+@pytest.fixture
+async def users(db):
+    """
+    For async tests: alice, bob and carol, as user ids 1, 2 and 3.
+    """
+    from app.models.user import User
+
+    async with db() as session:
+        session.add_all([User(id=user_id, username=name, email=f"{name}@example.com", hashed_password="x")
+                         for user_id, name in enumerate(("alice", "bob", "carol"), start=1)])
+        await session.commit()
+    return {"alice": 1, "bob": 2, "carol": 3}
+
+
+@pytest.fixture
+def send(db):
+    """
+    For async tests: store messages through MessagingService; returns the new message ids.
+    """
+    from app.schemas.message import MessageCreate
+    from app.services.messaging import MessagingService
+
+    async def send_messages(sender_id: int, receiver_id: int, contents, ttl_seconds=None):
+        async with db() as session:
+            created = await MessagingService().send_messages([
+                MessageCreate(sender_id=sender_id, receiver_id=receiver_id, content=content, ttl_seconds=ttl_seconds)
+                for content in contents
+            ], session, raw=True)
+        return [row["id"] for row in created]
+
+    return send_messages
+
+
+@pytest.fixture
+def fake_supabase():
+    fake = FakeSupabase()
+    websocket_routes.get_writer().client = fake
+    return fake
+
+
+@pytest.fixture
+def client(fake_supabase):
+    from app.main import create_app
+
+    with TestClient(create_app()) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def signup(client, fake_supabase):
+    """
+    Register and log in a user; returns (user id, auth headers). The user is mirrored into the
+    fake Supabase so the WebSocket routes can resolve it too.
+    """
+    def register(username: str):
+        email = f"{username}@example.com"
+        client.post("/auth/signup", json={"username": username, "email": email, "password": "pw"})
+        body = client.post("/auth/login", json={"email": email, "password": "pw"}).json()
+        user_id = body["user"]["id"]
+        fake_supabase.table("users").insert([{"user_id": user_id, "username": username}]).execute()
+        return user_id, {"Authorization": f"Bearer {body['access_token']}"}
+
+    return register
@@ -0,0 +1,157 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import func, select, update
+
+from app.core.config import get_settings
+from app.models.archive import ArchiveSegment
+from app.models.message import Message
+from app.services.archive import MessageArchiver, decode_segment, encode_segment
+from app.services.messaging import MessagingService, decode_cursor, encode_cursor
+
+pytestmark = pytest.mark.anyio
+
+service = MessagingService()
+
+
+async def seed_history(db, send, users):
+    """
+    Forty messages between alice and bob and two from alice to carol, five days apart going back
+    about 200 days, so the oldest fall past the default 180-day archive age. Returns alice and
+    bob's message ids, oldest first.
+    """
+    alice, bob, carol = users["alice"], users["bob"], users["carol"]
+    sent = []
+    for start in range(0, 40, 4):
+        sent += await send(alice, bob, [f"a{start + n}" for n in range(3)])
+        sent += await send(bob, alice, [f"b{start}"])
+    others = await send(alice, carol, ["c0", "c1"])
+    now = datetime.now(timezone.utc)
+    async with db() as session:
+        for age, message_id in enumerate(sorted(sent + others, reverse=True)):
+            await session.execute(update(Message).where(Message.id == message_id)
+                                  .values(timestamp=now - timedelta(days=age * 5, minutes=1)))
+        await session.commit()
+    return sent
+
+
+def summarise(messages):
+    # SQLite hands back naive timestamps for hot rows, while archived ones come back in UTC
+    return [(message["id"], message["content"], message["timestamp"].replace(tzinfo=None)) for message in messages]
+
+
+async def walk(db, user_id, peer_id, limit):
+    """
+    Every page walking back from the newest, then every page walking forward from the oldest.
+    """
+    backward, forward = [], []
+    async with db() as session:
+        page = await service.get_messages(user_id, peer_id, session, limit=limit, raw=True)
+        backward.append(summarise(page["messages"]))
+        while page["has_more"]:
+            page = await service.get_messages(user_id, peer_id, session, before=decode_cursor(page["before_cursor"]),
+                                              limit=limit, raw=True)
+            backward.append(summarise(page["messages"]))
+        start = (datetime(2000, 1, 1, tzinfo=timezone.utc), 0)
+        page = await service.get_messages(user_id, peer_id, session, after=start, limit=limit, raw=True)
+        forward.append(summarise(page["messages"]))
+        while page["has_more"]:
+            page = await service.get_messages(user_id, peer_id, session, after=decode_cursor(page["after_cursor"]),
+                                              limit=limit, raw=True)
+            forward.append(summarise(page["messages"]))
+    return backward, forward
+
+
+async def export(user_id, peer_id):
+    return b"".join([chunk async for chunk in service.export_messages(user_id, peer_id)])
+
+
+async def test_pages_are_the_same_before_and_after_archiving(db, users, send):
+    alice, bob = users["alice"], users["bob"]
+    await seed_history(db, send, users)
+    before = await walk(db, alice, bob, 7)
+    exported = await export(alice, bob)
+    async with db() as session:
+        inbox = await service.get_inbox(alice, session)
+
+    archiver = MessageArchiver(session_factory=db, age=get_settings().archive_after_seconds, batch_size=5, segment_size=4)
+    moved = await archiver.archive()
+
+    async with db() as session:
+        hot = await session.scalar(select(func.count()).select_from(Message))
+        segments = await session.scalar(select(func.count()).select_from(ArchiveSegment))
+    assert moved > 0 and segments > 0
+    assert hot == 42 - moved
+    assert await walk(db, alice, bob, 7) == before
+    assert await walk(db, alice, bob, 50) == ([sum(reversed(before[0]), [])], [sum(before[1], [])])
+    # Hot rows come back from SQLite without a UTC offset, archived ones with it
+    assert (await export(alice, bob)).replace(b"+00:00", b"") == exported
+    async with db() as session:
+        assert await service.get_inbox(alice, session) == inbox
+
+
+def archive_everything(monkeypatch, db, segment_size: int):
+    # Reads only look past the configured age, so lower it along with the archiver's
+    monkeypatch.setattr(get_settings(), "archive_after_seconds", 0)
+    return MessageArchiver(session_factory=db, age=0, segment_size=segment_size).archive()
+
+
+async def test_everything_archived_still_pages_and_summarises(monkeypatch, db, users, send):
+    alice, bob = users["alice"], users["bob"]
+    sent = await seed_history(db, send, users)
+    before = await walk(db, alice, bob, 6)
+
+    await archive_everything(monkeypatch, db, segment_size=500)
+
+    async with db() as session:
+        assert await session.scalar(select(func.count()).select_from(Message)) == 0
+    assert await walk(db, alice, bob, 6) == before
+    async with db() as session:
+        inbox = await service.get_inbox(bob, session)
+    assert [entry.last_message_id for entry in inbox.conversations] == [max(sent)]
+
+
+async def test_deleting_an_archived_message_rewrites_its_segment(monkeypatch, db, users, send):
+    alice, bob = users["alice"], users["bob"]
+    sent = await seed_history(db, send, users)
+    await archive_everything(monkeypatch, db, segment_size=4)
+    oldest = sent[0]
+
+    async with db() as session:
+        with pytest.raises(HTTPException) as error:
+            await service.delete_message(oldest, bob, session)
+    assert error.value.status_code == 403
+
+    async with db() as session:
+        await service.delete_message(oldest, alice, session)
+    backward, forward = await walk(db, alice, bob, 100)
+    assert [message[0] for message in forward[0]] == sent[1:]
+
+    async with db() as session:
+        with pytest.raises(HTTPException) as error:
+            await service.delete_message(oldest, alice, session)
+    assert error.value.status_code == 404
+
+    # Emptying a segment drops it
+    async with db() as session:
+        segment = await session.scalar(select(ArchiveSegment).order_by(ArchiveSegment.first_at).limit(1))
+        segment_id, rows = segment.id, decode_segment(segment.payload)
+    for row in rows:
+        async with db() as session:
+            await service.delete_message(row.id, row.sender_id, session)
+    async with db() as session:
+        assert await session.get(ArchiveSegment, segment_id) is None
+    backward, forward = await walk(db, alice, bob, 100)
+    assert [message[0] for message in forward[0]] == [message_id for message_id in sent[1:]
+                                                          if message_id not in {row.id for row in rows}]
+
+
+def test_segments_round_trip():
+    timestamp = datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+    row = Message(id=5, sender_id=1, receiver_id=2, content="hi", nonce=b"\x00" * 12, ciphertext=b"\x01\x02",
+                  timestamp=timestamp, status="sent", expires_at=None, attachment_id=None)
+    [decoded] = decode_segment(encode_segment([row]))
+    assert decoded.timestamp == timestamp
+    assert (decoded.id, decoded.content, decoded.nonce, decoded.ciphertext) == (5, "hi", b"\x00" * 12, b"\x01\x02")
+    assert encode_cursor(decoded.timestamp, decoded.id) == encode_cursor(timestamp, 5)
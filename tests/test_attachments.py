@@ -0,0 +1,179 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.config import get_settings
+from app.services.attachments import get_attachment_reaper, get_attachment_store, parse_byte_range
+
+DATA = bytes(range(25))
+
+
+def start_upload(client, headers, size: int = len(DATA)) -> int:
+    response = client.post("/attachments", headers=headers, json={"filename": "notes.bin", "size": size})
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["chunk_size"], body["chunk_count"], body["received_chunks"]) == (10, -(-size // 10), 0)
+    return body["id"]
+
+
+def put_chunk(client, headers, attachment_id: int, index: int, content: bytes):
+    return client.put(f"/attachments/{attachment_id}/chunks/{index}", headers=headers, content=content)
+
+
+def upload(client, headers, data: bytes = DATA) -> int:
+    attachment_id = start_upload(client, headers, len(data))
+    for index in range(0, len(data), 10):
+        assert put_chunk(client, headers, attachment_id, index // 10, data[index:index + 10]).status_code == 200
+    return attachment_id
+
+
+def share(client, headers, receiver: str, attachment_id: int) -> int:
+    response = client.post("/messaging/send", headers=headers,
+                           json={"receiver_username": receiver, "content": "", "attachment_id": attachment_id})
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("bytes=0-9", (0, 9)),
+    ("bytes=5-14", (5, 14)),
+    ("bytes=20-", (20, 24)),
+    ("bytes=24-100", (24, 24)),
+    ("bytes=-3", (22, 24)),
+    ("bytes=-100", (0, 24)),
+    ("bytes=0-0,5-6", None),
+    ("items=0-5", None),
+    ("bytes=a-b", None),
+])
+def test_parse_byte_range(header, expected):
+    assert parse_byte_range(header, 25) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=25-", "bytes=30-40", "bytes=9-3", "bytes=-0"])
+def test_unsatisfiable_ranges_are_rejected(header):
+    with pytest.raises(HTTPException) as error:
+        parse_byte_range(header, 25)
+    assert error.value.status_code == 416
+    assert error.value.headers["Content-Range"] == "bytes */25"
+
+
+def test_chunks_go_in_order_and_retries_are_acknowledged(client, signup):
+    _, alice = signup("alice")
+    attachment_id = start_upload(client, alice)
+
+    assert put_chunk(client, alice, attachment_id, 1, DATA[10:20]).status_code == 409
+    assert put_chunk(client, alice, attachment_id, 0, DATA[:9]).status_code == 400
+    assert put_chunk(client, alice, attachment_id, 0, DATA[:10]).json()["received_chunks"] == 1
+    # A resent chunk is acknowledged without being rewritten
+    assert put_chunk(client, alice, attachment_id, 0, DATA[:10]).json()["received_chunks"] == 1
+    assert client.get(f"/attachments/{attachment_id}/content", headers=alice).status_code == 409
+    put_chunk(client, alice, attachment_id, 1, DATA[10:20])
+    body = put_chunk(client, alice, attachment_id, 2, DATA[20:]).json()
+    assert (body["received_chunks"], body["complete"]) == (3, True)
+    assert put_chunk(client, alice, attachment_id, 3, b"x").status_code == 409
+
+    # Stored encrypted, one file per chunk
+    store = get_attachment_store()
+    assert sorted(os.listdir(store.path(attachment_id))) == ["0", "1", "2"]
+    with open(store.path(attachment_id, 0), "rb") as file:
+        assert DATA[:10] not in file.read()
+
+
+def test_downloads_honour_ranges(client, signup):
+    _, alice = signup("alice")
+    attachment_id = upload(client, alice)
+    url = f"/attachments/{attachment_id}/content"
+
+    full = client.get(url, headers=alice)
+    assert (full.status_code, full.content) == (200, DATA)
+    assert full.headers["Accept-Ranges"] == "bytes"
+    assert full.headers["Content-Length"] == "25"
+
+    for header, start, end in (("bytes=5-14", 5, 14), ("bytes=-3", 22, 24), ("bytes=9-9", 9, 9), ("bytes=20-", 20, 24)):
+        partial = client.get(url, headers={**alice, "Range": header})
+        assert partial.status_code == 206
+        assert partial.content == DATA[start:end + 1]
+        assert partial.headers["Content-Range"] == f"bytes {start}-{end}/25"
+
+    assert client.get(url, headers={**alice, "Range": "bytes=0-0,5-6"}).content == DATA
+    unsatisfiable = client.get(url, headers={**alice, "Range": "bytes=25-"})
+    assert unsatisfiable.status_code == 416
+    assert unsatisfiable.headers["Content-Range"] == "bytes */25"
+
+
+def test_tampered_chunks_are_not_served(client, signup):
+    _, alice = signup("alice")
+    attachment_id = upload(client, alice)
+    store = get_attachment_store()
+    # Swapping two chunks on disk breaks their authentication
+    first, second = store.path(attachment_id, 0), store.path(attachment_id, 1)
+    os.rename(first, first + ".tmp")
+    os.rename(second, first)
+    os.rename(first + ".tmp", second)
+
+    with pytest.raises(ValueError):
+        store.read_chunk(attachment_id, 0)
+
+
+def test_only_participants_can_read_a_shared_attachment(client, signup):
+    _, alice = signup("alice")
+    _, bob = signup("bob")
+    _, eve = signup("eve")
+    attachment_id = upload(client, alice)
+    url = f"/attachments/{attachment_id}/content"
+
+    assert client.get(url, headers=bob).status_code == 404
+    share(client, alice, "bob", attachment_id)
+    assert client.get(url, headers=bob).content == DATA
+    assert client.get(url, headers=eve).status_code == 404
+    # Only the owner uploads
+    assert put_chunk(client, bob, attachment_id, 0, DATA[:10]).status_code == 403
+
+
+def test_unfinished_uploads_cannot_be_sent(client, signup):
+    _, alice = signup("alice")
+    signup("bob")
+    attachment_id = start_upload(client, alice)
+    put_chunk(client, alice, attachment_id, 0, DATA[:10])
+
+    response = client.post("/messaging/send", headers=alice,
+                           json={"receiver_username": "bob", "content": "", "attachment_id": attachment_id})
+    assert response.status_code == 400
+
+
+def test_attachment_goes_with_its_last_message(client, signup):
+    _, alice = signup("alice")
+    signup("bob")
+    attachment_id = upload(client, alice)
+    first, second = share(client, alice, "bob", attachment_id), share(client, alice, "bob", attachment_id)
+
+    assert client.delete(f"/messaging/delete/{first}", headers=alice).status_code == 200
+    assert client.get(f"/attachments/{attachment_id}", headers=alice).status_code == 200
+    assert client.delete(f"/messaging/delete/{second}", headers=alice).status_code == 200
+    assert client.get(f"/attachments/{attachment_id}", headers=alice).status_code == 404
+    assert not os.path.exists(get_attachment_store().path(attachment_id))
+
+
+def test_abandoned_uploads_are_reaped_after_the_ttl(client, signup):
+    _, alice = signup("alice")
+    signup("bob")
+    unfinished = start_upload(client, alice)
+    put_chunk(client, alice, unfinished, 0, DATA[:10])
+    unsent = upload(client, alice)
+    sent = upload(client, alice)
+    share(client, alice, "bob", sent)
+    reaper = get_attachment_reaper()
+
+    assert client.portal.call(reaper.reap) == 0
+    later = datetime.now(timezone.utc) + timedelta(seconds=get_settings().attachment_upload_ttl_seconds + 60)
+    assert client.portal.call(reaper.reap, later) == 2
+
+    assert client.get(f"/attachments/{unfinished}", headers=alice).status_code == 404
+    assert client.get(f"/attachments/{unsent}", headers=alice).status_code == 404
+    assert client.get(f"/attachments/{sent}", headers=alice).status_code == 200
+    store = get_attachment_store()
+    assert not os.path.exists(store.path(unfinished)) and not os.path.exists(store.path(unsent))
+    assert os.path.exists(store.path(sent))
@@ -0,0 +1,48 @@
+import time
+
+from app.schemas.user import User
+from app.services.auth import cache_principal, get_principal_cache, tokens_by_user
+
+
+def token_of(headers) -> str:
+    return headers["Authorization"].split(" ", 1)[1]
+
+
+def test_hot_tokens_are_served_from_the_cache(client, signup):
+    user_id, alice = signup("alice")
+    cache = get_principal_cache()
+
+    assert client.get("/messaging/inbox", headers=alice).status_code == 200
+    assert cache.get(token_of(alice)).id == user_id
+    hits = cache.hits
+    assert client.get("/messaging/inbox", headers=alice).status_code == 200
+    assert cache.hits == hits + 1
+    assert tokens_by_user[user_id] == {token_of(alice)}
+
+
+def test_deactivation_drops_cached_principals(client, signup):
+    user_id, alice = signup("alice")
+    assert client.get("/messaging/inbox", headers=alice).status_code == 200
+
+    assert client.delete("/auth/user", headers=alice).status_code == 200
+    assert token_of(alice) not in get_principal_cache()
+    assert user_id not in tokens_by_user
+    assert client.get("/messaging/inbox", headers=alice).status_code == 401
+
+
+def test_profile_updates_drop_cached_principals(client, signup):
+    _, alice = signup("alice")
+    assert client.get("/messaging/inbox", headers=alice).status_code == 200
+
+    response = client.put("/auth/user/update", headers=alice, json={"username": "alicia"})
+    assert response.status_code == 200
+    assert token_of(alice) not in get_principal_cache()
+    assert client.get("/messaging/inbox", headers=alice).status_code == 200
+    assert get_principal_cache().get(token_of(alice)).username == "alicia"
+
+
+def test_principals_are_not_cached_past_the_token_expiry():
+    user = User(id=9, username="zed", email="zed@example.com", is_active=True)
+    cache_principal("expired", user, time.time() - 1)
+    assert "expired" not in get_principal_cache()
+    assert 9 not in tokens_by_user
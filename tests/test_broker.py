@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+from resp_server import PubSubServer
+
+from app.sockets.broker import InMemoryBroker, RedisBroker, create_broker, user_channel
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def server():
+    server = PubSubServer()
+    port = await server.start()
+    yield server, f"redis://127.0.0.1:{port}"
+    server.server.close()
+
+
+async def start_worker(url: str):
+    """
+    A broker as one worker would run it; returns it with the list its events are collected in.
+    """
+    received = []
+
+    async def on_event(channel, message):
+        received.append((channel, message))
+
+    broker = RedisBroker(url, reconnect_delay=0.01, publish_timeout=2)
+    await broker.start(on_event)
+    return broker, received
+
+
+async def wait_for(condition, timeout: float = 2):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not met in time")
+
+
+def subscribed(server, channel: str) -> bool:
+    return bool(server.subscribers.get(channel.encode()))
+
+
+async def test_events_reach_only_the_worker_holding_the_user(server):
+    server, url = server
+    first, first_received = await start_worker(url)
+    second, second_received = await start_worker(url)
+    try:
+        await second.subscribe(user_channel(7))
+        await wait_for(lambda: subscribed(server, user_channel(7)))
+
+        event = {"type": "message", "message_id": 1, "nonce": b"\x00\xff" * 6, "content": b"\x01\x02"}
+        await first.publish(user_channel(7), event)
+        await first.publish(user_channel(8), {"type": "message", "message_id": 2})
+        await wait_for(lambda: second_received)
+        await asyncio.sleep(0.05)
+    finally:
+        await first.close()
+        await second.close()
+
+    # Binary fields arrive as raw bytes, and nobody holds user 8
+    assert second_received == [(user_channel(7), event)]
+    assert first_received == []
+
+
+async def test_unsubscribed_channels_stop_delivering(server):
+    server, url = server
+    broker, received = await start_worker(url)
+    try:
+        await broker.subscribe(user_channel(1))
+        await wait_for(lambda: subscribed(server, user_channel(1)))
+        await broker.publish(user_channel(1), {"n": 1})
+        await wait_for(lambda: received)
+
+        await broker.unsubscribe(user_channel(1))
+        await wait_for(lambda: not subscribed(server, user_channel(1)))
+        await broker.publish(user_channel(1), {"n": 2})
+        await asyncio.sleep(0.05)
+    finally:
+        await broker.close()
+
+    assert [message for _, message in received] == [{"n": 1}]
+
+
+async def test_lost_subscriber_connection_resubscribes(server):
+    server, url = server
+    broker, received = await start_worker(url)
+    try:
+        await broker.subscribe(user_channel(1))
+        await broker.subscribe(user_channel(2))
+        await wait_for(lambda: subscribed(server, user_channel(1)) and subscribed(server, user_channel(2)))
+
+        broker._subscriber.close()
+        await wait_for(lambda: not subscribed(server, user_channel(1)))
+        await wait_for(lambda: subscribed(server, user_channel(1)) and subscribed(server, user_channel(2)))
+        await broker.publish(user_channel(2), {"n": 1})
+        await wait_for(lambda: received)
+    finally:
+        await broker.close()
+
+    assert received == [(user_channel(2), {"n": 1})]
+
+
+async def test_publish_fails_fast_without_a_server():
+    broker, _ = await start_worker("redis://127.0.0.1:1")
+    broker.publish_timeout = 0.05
+    try:
+        with pytest.raises(ConnectionError):
+            await broker.publish(user_channel(1), {"n": 1})
+    finally:
+        await broker.close()
+
+
+def test_broker_urls():
+    assert isinstance(create_broker("memory://"), InMemoryBroker)
+    broker = create_broker("redis://:secret@cache:6380")
+    assert isinstance(broker, RedisBroker)
+    assert (broker.host, broker.port, broker.password) == ("cache", 6380, "secret")
+    with pytest.raises(ValueError):
+        create_broker("kafka://cache")
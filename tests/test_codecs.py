@@ -0,0 +1,68 @@
+import json
+
+import msgpack
+import pytest
+
+from app.sockets.codecs import (
+    JSON,
+    JSON_SUBPROTOCOL,
+    MSGPACK,
+    MSGPACK_SUBPROTOCOL,
+    from_bytea,
+    negotiate,
+    to_bytea,
+)
+
+EVENT = {"type": "message", "message_id": 5, "nonce": b"\x00\x01" * 6, "content": b"\xff" * 20, "expires_at": None}
+
+
+@pytest.mark.parametrize("requested, expected", [
+    ([], (JSON, None)),
+    (["chat.v2"], (JSON, None)),
+    ([MSGPACK_SUBPROTOCOL], (MSGPACK, MSGPACK_SUBPROTOCOL)),
+    ([JSON_SUBPROTOCOL, MSGPACK_SUBPROTOCOL], (JSON, JSON_SUBPROTOCOL)),
+    (["chat.v2", MSGPACK_SUBPROTOCOL], (MSGPACK, MSGPACK_SUBPROTOCOL)),
+])
+def test_first_supported_subprotocol_wins(requested, expected):
+    assert negotiate(requested) == expected
+
+
+def test_msgpack_round_trips_binary_fields_as_bytes():
+    frame = MSGPACK.encode(EVENT)
+    assert isinstance(frame, bytes)
+    assert MSGPACK.decode(frame) == EVENT
+    assert len(frame) < len(JSON.encode(EVENT))
+
+
+def test_json_sends_binary_fields_as_hex():
+    decoded = JSON.decode(JSON.encode(EVENT))
+    assert decoded["nonce"] == EVENT["nonce"].hex()
+    assert bytes.fromhex(decoded["content"]) == EVENT["content"]
+    # A MessagePack socket still accepts text frames from the client
+    assert MSGPACK.decode(json.dumps({"type": "ping"})) == {"type": "ping"}
+
+
+def test_bytea_round_trip():
+    assert to_bytea(b"\x00\xab") == "\\x00ab"
+    assert from_bytea(to_bytea(b"\x00\xab")) == b"\x00\xab"
+    assert from_bytea(b"\x01") == b"\x01"
+    assert to_bytea(None) is None and from_bytea(None) is None
+
+
+def test_sockets_speak_the_negotiated_codec(client, signup):
+    _, alice = signup("alice")
+    signup("bob")
+    token = alice["Authorization"].split(" ", 1)[1]
+
+    with client.websocket_connect(f"/ws/message/alice?token={token}", subprotocols=[MSGPACK_SUBPROTOCOL]) as socket:
+        assert socket.accepted_subprotocol == MSGPACK_SUBPROTOCOL
+        assert msgpack.unpackb(socket.receive_bytes(), raw=False)["type"] == "session"
+        socket.send_bytes(msgpack.packb({"type": "message", "content": "hi", "sender_username": "alice",
+                                         "receiver_username": "bob"}))
+        echo = msgpack.unpackb(socket.receive_bytes(), raw=False)
+    assert echo["type"] == "message" and echo["sender_username"] == "alice"
+    assert isinstance(echo["nonce"], bytes) and isinstance(echo["content"], bytes)
+
+    with client.websocket_connect(f"/ws/message/alice?token={token}") as socket:
+        assert socket.accepted_subprotocol is None
+        assert socket.receive_json()["type"] == "session"
@@ -0,0 +1,113 @@
+import asyncio
+import json
+
+import pytest
+
+from app.sockets.connection import COALESCE, DISCONNECT, DROP, SLOW_CONSUMER_CLOSE_CODE, Connection
+
+pytestmark = pytest.mark.anyio
+
+
+class StalledSocket:
+    """
+    A WebSocket whose sends block until `unblock`, like a client on a slow link.
+    """
+
+    def __init__(self):
+        self.sent = []
+        self.closed_with = None
+        self.unblocked = asyncio.Event()
+
+    async def send_text(self, frame):
+        await self.unblocked.wait()
+        self.sent.append(json.loads(frame))
+
+    async def close(self, code: int = 1000):
+        self.closed_with = code
+
+    def unblock(self):
+        self.unblocked.set()
+
+
+async def flush(connection, socket, count: int):
+    socket.unblock()
+    for _ in range(100):
+        if len(socket.sent) >= count:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"only {len(socket.sent)} of {count} frames were sent")
+
+
+async def stalled_connection(policy: str, on_evict=None):
+    """
+    A started connection with a queue of two, whose writer is stuck sending a first frame.
+    """
+    socket = StalledSocket()
+    connection = Connection(socket, "1", max_queue=2, policy=policy, on_evict=on_evict)
+    connection.start()
+    connection.enqueue({"type": "message", "n": 0})
+    await asyncio.sleep(0.01)
+    return connection, socket
+
+
+async def test_drop_discards_new_frames_when_full():
+    connection, socket = await stalled_connection(DROP)
+    assert [connection.enqueue({"type": "message", "n": n}) for n in (1, 2, 3)] == [True, True, False]
+
+    await flush(connection, socket, 3)
+    await connection.stop()
+    assert [frame["n"] for frame in socket.sent] == [0, 1, 2]
+    assert connection.dropped == 1
+
+
+async def test_coalesce_replaces_superseded_frames_then_drops_the_oldest():
+    connection, socket = await stalled_connection(COALESCE)
+
+    def receipt(seen_up_to):
+        return {"type": "receipt", "reader_id": 2, "sender_id": 1, "seen_up_to": seen_up_to}
+
+    connection.enqueue(receipt(5))
+    connection.enqueue({"type": "message", "n": 1})
+    # Full: a newer receipt for the same conversation replaces the pending one in place
+    assert connection.enqueue(receipt(9))
+    assert connection.coalesced == 1
+    # Nothing to replace: the oldest pending frame makes room
+    assert connection.enqueue({"type": "message", "n": 2})
+
+    await flush(connection, socket, 3)
+    await connection.stop()
+    assert socket.sent == [{"type": "message", "n": 0}, {"type": "message", "n": 1}, {"type": "message", "n": 2}]
+    assert connection.dropped == 1
+
+
+async def test_coalesced_frame_keeps_its_place_in_the_queue():
+    connection, socket = await stalled_connection(COALESCE)
+    connection.enqueue({"type": "delete_message", "message_id": 4, "attempt": 1})
+    connection.enqueue({"type": "message", "n": 1})
+    connection.enqueue({"type": "delete_message", "message_id": 4, "attempt": 2})
+
+    await flush(connection, socket, 3)
+    await connection.stop()
+    assert [frame.get("attempt", frame.get("n")) for frame in socket.sent] == [0, 2, 1]
+
+
+async def test_disconnect_evicts_the_slow_consumer():
+    evicted = []
+    connection, socket = await stalled_connection(DISCONNECT, on_evict=evicted.append)
+    connection.enqueue({"type": "message", "n": 1})
+    connection.enqueue({"type": "message", "n": 2})
+
+    assert not connection.enqueue({"type": "message", "n": 3})
+    await asyncio.sleep(0.01)
+    assert evicted == [connection]
+    assert connection.closed
+    assert socket.closed_with == SLOW_CONSUMER_CLOSE_CODE
+    # Everything still queued is dropped with it; later frames are refused
+    assert connection.dropped == 3
+    assert not connection.enqueue({"type": "message", "n": 4})
+    await connection.stop()
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        Connection(StalledSocket(), "1", max_queue=1, policy="block")
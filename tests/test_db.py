@@ -0,0 +1,31 @@
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import get_async_database_url, get_db
+from app.models.user import User
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("postgresql://u:p@db:5432/app", "postgresql+asyncpg://u:p@db:5432/app"),
+    ("postgres://u:p@db/app", "postgresql+asyncpg://u:p@db/app"),
+    ("sqlite:///./app.db", "sqlite+aiosqlite:///./app.db"),
+    # A driver that is already named is kept
+    ("postgresql+psycopg://u:p@db/app", "postgresql+psycopg://u:p@db/app"),
+])
+def test_plain_urls_get_an_async_driver(url, expected):
+    assert get_async_database_url(url) == expected
+
+
+async def test_get_db_yields_an_async_session(db):
+    dependency = get_db()
+    session = await dependency.__anext__()
+    try:
+        assert isinstance(session, AsyncSession)
+        session.add(User(username="alice", email="alice@example.com", hashed_password="x"))
+        await session.commit()
+        assert await session.scalar(select(User.username)) == "alice"
+    finally:
+        await dependency.aclose()
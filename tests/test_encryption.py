@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from Crypto.Cipher import AES
+
+from app.core.config import get_settings
+from app.core.encryption import (
+    GCM_NONCE_SIZE,
+    GCM_TAG_SIZE,
+    decrypt_message,
+    decrypt_messages,
+    decrypt_messages_parallel,
+    encrypt_message,
+    encrypt_messages,
+    encrypt_messages_parallel,
+)
+
+pytestmark = pytest.mark.anyio
+
+TEXTS = ["hello", "", "naïve café ☕", "x" * 5000]
+
+
+def test_batch_round_trip_with_fresh_nonces():
+    encrypted = encrypt_messages(TEXTS)
+    assert decrypt_messages(encrypted) == TEXTS
+    assert all(len(nonce) == GCM_NONCE_SIZE for nonce, _ in encrypted)
+    assert all(len(ciphertext) == len(text.encode()) + GCM_TAG_SIZE for (_, ciphertext), text in zip(encrypted, TEXTS))
+    assert len({nonce for nonce, _ in encrypted + encrypt_messages(TEXTS)}) == 2 * len(TEXTS)
+
+
+def test_single_message_helpers_match_the_batch_api():
+    nonce, ciphertext = encrypt_message("hi")
+    assert decrypt_message(nonce, ciphertext) == "hi"
+    assert decrypt_messages([(nonce, ciphertext)]) == ["hi"]
+
+
+@pytest.mark.parametrize("tamper", [
+    lambda nonce, ciphertext: (nonce, bytes([ciphertext[0] ^ 1]) + ciphertext[1:]),
+    lambda nonce, ciphertext: (nonce, ciphertext[:-1] + bytes([ciphertext[-1] ^ 1])),
+    lambda nonce, ciphertext: (bytes([nonce[0] ^ 1]) + nonce[1:], ciphertext),
+    lambda nonce, ciphertext: (nonce, ciphertext[:-GCM_TAG_SIZE]),
+])
+def test_tampering_is_rejected(tamper):
+    encrypted = encrypt_messages(["first", "second"])
+    encrypted[1] = tamper(*encrypted[1])
+    with pytest.raises(ValueError):
+        decrypt_messages(encrypted)
+
+
+def test_wrong_key_is_rejected():
+    encrypted = encrypt_messages(["secret"], key=b"k" * 32)
+    assert decrypt_messages(encrypted, key=b"k" * 32) == ["secret"]
+    with pytest.raises(ValueError):
+        decrypt_messages(encrypted, key=b"j" * 32)
+
+
+def test_legacy_eax_messages_still_decrypt():
+    cipher = AES.new(get_settings().encryption_key, AES.MODE_EAX)
+    assert decrypt_messages([(cipher.nonce, cipher.encrypt(b"from before GCM"))]) == ["from before GCM"]
+
+
+async def test_parallel_batches_keep_their_order():
+    texts = [f"message {n}" for n in range(25)]
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        encrypted = await encrypt_messages_parallel(texts, executor, chunk_size=4)
+        assert await decrypt_messages_parallel(encrypted, executor, chunk_size=7) == texts
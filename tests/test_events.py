@@ -0,0 +1,50 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.events import EVENT_LOG_LOCK_CLASS, EventLog
+
+pytestmark = pytest.mark.anyio
+
+
+class PostgresSession:
+    """
+    Records what a flush executes, standing in for a PostgreSQL session.
+    """
+
+    def __init__(self, executed):
+        self.executed = executed
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def get_bind(self):
+        return SimpleNamespace(dialect=SimpleNamespace(name="postgresql"))
+
+    async def execute(self, statement, parameters=None):
+        self.executed.append((str(statement), parameters))
+        ids = list(range(1, len(parameters or ()) + 1))
+        return SimpleNamespace(scalars=lambda: SimpleNamespace(all=lambda: ids))
+
+    async def commit(self):
+        pass
+
+
+async def test_commits_lock_each_recipient_in_id_order():
+    executed = []
+    event_log = EventLog(session_factory=lambda: PostgresSession(executed))
+    loop = asyncio.get_running_loop()
+    first, second = loop.create_future(), loop.create_future()
+
+    await event_log._flush([([3, 1], {"type": "message"}, first), ([2, 1], {"type": "receipt"}, second)])
+
+    # One lock statement for every distinct recipient, in id order so batches cannot deadlock, then one INSERT
+    [(lock, parameters), (insert, rows)] = executed
+    assert "pg_advisory_xact_lock" in lock
+    assert parameters == {"lock_class": EVENT_LOG_LOCK_CLASS, "user_ids": [1, 2, 3]}
+    assert insert.startswith("INSERT INTO user_events") and len(rows) == 4
+    assert (first.result(), second.result()) == ({3: 1, 1: 2}, {2: 3, 1: 4})
@@ -0,0 +1,183 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import event, select, update
+
+from app.db import get_engine
+from app.models.conversation import ConversationSummary
+from app.models.message import Message
+from app.services.expiry import ExpiryScheduler
+from app.services.inbox import refresh_purged, refresh_summaries
+
+pytestmark = pytest.mark.anyio
+
+
+def make_scheduler(db, events, **options) -> ExpiryScheduler:
+    async def notify(user_id, event):
+        events.append((user_id, event))
+
+    return ExpiryScheduler(session_factory=db, notify=notify, on_purge=refresh_purged, **options)
+
+
+async def expire(db, message_ids, seconds_ago: float = 1):
+    async with db() as session:
+        await session.execute(update(Message).where(Message.id.in_(message_ids))
+                              .values(expires_at=datetime.now(timezone.utc) - timedelta(seconds=seconds_ago)))
+        await session.commit()
+
+
+async def remaining(db):
+    async with db() as session:
+        return (await session.execute(select(Message.id).order_by(Message.id))).scalars().all()
+
+
+async def wait_for(condition, timeout: float = 2):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not met in time")
+
+
+async def test_due_messages_are_purged_and_reported_once_per_user(db, users, send):
+    alice, bob = users["alice"], users["bob"]
+    kept = await send(alice, bob, ["stays"])
+    doomed = await send(alice, bob, ["one", "two"], ttl_seconds=3600) + await send(bob, alice, ["three"], ttl_seconds=3600)
+    later = await send(alice, bob, ["later"], ttl_seconds=3600)
+    await expire(db, doomed)
+    events = []
+    scheduler = make_scheduler(db, events)
+
+    await scheduler.start()
+    try:
+        await wait_for(lambda: scheduler.purged == 3)
+    finally:
+        await scheduler.close()
+
+    assert await remaining(db) == kept + later
+    reported = {user_id: sorted(event["message_ids"]) for user_id, event in events}
+    assert reported == {alice: sorted(doomed), bob: sorted(doomed)}
+    assert all(event["type"] == "delete_message" and event["reason"] == "expired" for _, event in events)
+    # The summaries moved on to the newest message that is left
+    async with db() as session:
+        last = await session.scalar(select(ConversationSummary.last_message_id).where(
+            ConversationSummary.user_id == bob, ConversationSummary.peer_id == alice))
+    assert last == later[0]
+
+
+async def summaries(db):
+    async with db() as session:
+        result = await session.execute(select(ConversationSummary.user_id, ConversationSummary.peer_id,
+                                              ConversationSummary.last_message_id, ConversationSummary.unread_count))
+    return {(user_id, peer_id): (last, unread) for user_id, peer_id, last, unread in result.all()}
+
+
+async def test_one_purge_refreshes_every_conversation_it_touched(db, users, send):
+    alice, bob, carol = users["alice"], users["bob"], users["carol"]
+    [kept_ab] = await send(alice, bob, ["ab kept"])
+    [kept_ca] = await send(carol, alice, ["ca kept"])
+    doomed = (await send(alice, bob, ["ab gone"], ttl_seconds=3600) + await send(alice, carol, ["ac gone"], ttl_seconds=3600)
+              + await send(bob, carol, ["bc gone"], ttl_seconds=3600))
+    await expire(db, doomed)
+    scheduler = make_scheduler(db, [])
+
+    await scheduler.start()
+    try:
+        await wait_for(lambda: scheduler.purged == 3)
+    finally:
+        await scheduler.close()
+
+    # Bob and carol have nothing left to show
+    assert await summaries(db) == {
+        (alice, bob): (kept_ab, 0), (bob, alice): (kept_ab, 1),
+        (alice, carol): (kept_ca, 1), (carol, alice): (kept_ca, 0),
+    }
+
+
+async def test_refresh_cost_does_not_grow_with_the_conversations(db, users, send):
+    alice, bob, carol = users["alice"], users["bob"], users["carol"]
+    await send(alice, bob, ["ab"])
+    await send(alice, carol, ["ac"])
+    await send(bob, carol, ["bc"])
+
+    async def statements(pairs) -> int:
+        executed = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            executed.append(statement)
+
+        event.listen(get_engine().sync_engine, "before_cursor_execute", count)
+        try:
+            async with db() as session:
+                await refresh_summaries(session, pairs)
+                await session.commit()
+        finally:
+            event.remove(get_engine().sync_engine, "before_cursor_execute", count)
+        return len(executed)
+
+    before = await summaries(db)
+    assert await statements([(alice, bob)]) == await statements([(alice, bob), (carol, alice), (bob, carol)])
+    assert await summaries(db) == before
+
+
+async def test_failed_summary_refresh_is_retried(db, users, send):
+    alice, bob = users["alice"], users["bob"]
+    [kept] = await send(alice, bob, ["stays"])
+    doomed = await send(alice, bob, ["gone"], ttl_seconds=3600)
+    await expire(db, doomed)
+    attempts = []
+
+    async def flaky_refresh(session, rows):
+        if not attempts:
+            attempts.append("failed")
+            raise ConnectionError("database unavailable")
+        await refresh_purged(session, rows)
+        await session.commit()
+        attempts.append(len(rows))
+
+    scheduler = ExpiryScheduler(session_factory=db, on_purge=flaky_refresh, retry_delay=0.01)
+    await scheduler.start()
+    try:
+        await wait_for(lambda: len(attempts) == 2)
+    finally:
+        await scheduler.close()
+
+    assert attempts == ["failed", 1]
+    assert await summaries(db) == {(alice, bob): (kept, 0), (bob, alice): (kept, 1)}
+
+
+async def test_scheduled_message_wakes_the_scheduler(db, users, send):
+    alice, bob = users["alice"], users["bob"]
+    events = []
+    scheduler = make_scheduler(db, events)
+    await scheduler.start()
+    try:
+        await wait_for(lambda: scheduler.stats()["loaded_until"] is not None)
+        [message_id] = await send(alice, bob, ["soon"], ttl_seconds=3600)
+        await expire(db, [message_id], seconds_ago=0)
+        scheduler.schedule(message_id, datetime.now(timezone.utc))
+        await wait_for(lambda: scheduler.purged == 1)
+    finally:
+        await scheduler.close()
+
+    assert await remaining(db) == []
+    # The conversation has no messages left, so it drops out of both inboxes
+    async with db() as session:
+        assert (await session.execute(select(ConversationSummary))).all() == []
+
+
+async def test_sweep_purges_overdue_rows_nobody_scheduled(db, users, send):
+    alice, bob = users["alice"], users["bob"]
+    scheduler = make_scheduler(db, [], sweep_interval=0.2)
+    await scheduler.start()
+    try:
+        await wait_for(lambda: scheduler.stats()["loaded_until"] is not None)
+        # Stored after the window was loaded, and never scheduled: e.g. by a worker that died
+        [message_id] = await send(alice, bob, ["orphan"], ttl_seconds=3600)
+        await expire(db, [message_id], seconds_ago=5)
+        await wait_for(lambda: scheduler.purged == 1)
+    finally:
+        await scheduler.close()
+
+    assert await remaining(db) == []
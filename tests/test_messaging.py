@@ -0,0 +1,111 @@
+def send_batch(client, headers, receiver: str, contents):
+    response = client.post("/messaging/send/batch", headers=headers,
+                           json={"messages": [{"receiver_username": receiver, "content": content} for content in contents]})
+    assert response.status_code == 200
+    return [result["message"]["id"] for result in response.json()["results"]]
+
+
+def page(client, headers, peer_id: int, **params):
+    response = client.get(f"/messaging/get/{peer_id}", headers=headers, params=params)
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_keyset_paging_walks_back_and_forward(client, signup):
+    alice_id, alice = signup("alice")
+    bob_id, bob = signup("bob")
+    sent = send_batch(client, alice, "bob", [f"a{n}" for n in range(7)]) + send_batch(client, bob, "alice", ["b0", "b1"])
+
+    newest = page(client, alice, bob_id, limit=4)
+    assert [message["id"] for message in newest["messages"]] == sent[-4:]
+    assert newest["has_more"]
+
+    # Back in history from the oldest message on the page
+    older = page(client, alice, bob_id, limit=4, before=newest["before_cursor"])
+    assert [message["id"] for message in older["messages"]] == sent[1:5]
+    oldest = page(client, alice, bob_id, limit=4, before=older["before_cursor"])
+    assert [message["id"] for message in oldest["messages"]] == sent[:1]
+    assert not oldest["has_more"]
+
+    # And forward again from there, oldest first
+    forward = page(client, alice, bob_id, limit=5, after=oldest["after_cursor"])
+    assert [message["id"] for message in forward["messages"]] == sent[1:6]
+    assert forward["has_more"]
+    rest = page(client, bob, alice_id, limit=5, after=forward["after_cursor"])
+    assert [message["id"] for message in rest["messages"]] == sent[6:]
+    assert not rest["has_more"]
+
+
+def test_paging_rejects_both_cursors(client, signup):
+    _, alice = signup("alice")
+    bob_id, _ = signup("bob")
+    send_batch(client, alice, "bob", ["hi"])
+    cursor = page(client, alice, bob_id)["after_cursor"]
+
+    response = client.get(f"/messaging/get/{bob_id}", headers=alice, params={"before": cursor, "after": cursor})
+    assert response.status_code == 400
+
+
+def test_etag_answers_304_until_the_conversation_changes(client, signup):
+    alice_id, alice = signup("alice")
+    bob_id, bob = signup("bob")
+    send_batch(client, alice, "bob", ["hi"])
+
+    first = client.get(f"/messaging/get/{bob_id}", headers=alice)
+    etag = first.headers["ETag"]
+    assert etag.startswith('W/"')
+
+    unchanged = client.get(f"/messaging/get/{bob_id}", headers={**alice, "If-None-Match": etag})
+    assert unchanged.status_code == 304
+    assert unchanged.content == b""
+    assert unchanged.headers["ETag"] == etag
+
+    # A different page of the same conversation has its own tag
+    assert client.get(f"/messaging/get/{bob_id}", headers=alice, params={"limit": 1}).headers["ETag"] != etag
+
+    # A new message changes the tag, for both participants
+    bob_etag = client.get(f"/messaging/get/{alice_id}", headers=bob).headers["ETag"]
+    send_batch(client, bob, "alice", ["hello"])
+    changed = client.get(f"/messaging/get/{bob_id}", headers={**alice, "If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert client.get(f"/messaging/get/{alice_id}", headers={**bob, "If-None-Match": bob_etag}).status_code == 200
+
+    # So does deleting one
+    etag = changed.headers["ETag"]
+    message_id = changed.json()["messages"][-1]["id"]
+    assert client.delete(f"/messaging/delete/{message_id}", headers=bob).status_code == 200
+    after_delete = client.get(f"/messaging/get/{bob_id}", headers={**alice, "If-None-Match": etag})
+    assert after_delete.status_code == 200
+    assert [message["content"] for message in after_delete.json()["messages"]] == ["hi"]
+
+
+def test_delete_reports_missing_and_foreign_messages(client, signup):
+    _, alice = signup("alice")
+    _, bob = signup("bob")
+    [message_id] = send_batch(client, alice, "bob", ["hi"])
+
+    assert client.delete(f"/messaging/delete/{message_id}", headers=bob).status_code == 403
+    assert client.delete("/messaging/delete/9999", headers=alice).status_code == 404
+    assert client.delete(f"/messaging/delete/{message_id}", headers=alice).status_code == 200
+    assert client.delete(f"/messaging/delete/{message_id}", headers=alice).status_code == 404
+
+
+def test_batch_send_reports_errors_per_item(client, signup):
+    _, alice = signup("alice")
+    bob_id, _ = signup("bob")
+    response = client.post("/messaging/send/batch", headers=alice, json={"messages": [
+        {"receiver_username": "bob", "content": "one"},
+        {"receiver_username": "nobody", "content": "lost"},
+        {"receiver_email": "bob@example.com", "content": "two"},
+        {"receiver_email": "nobody@example.com", "content": "lost too"},
+    ]})
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["sent"], body["failed"]) == (2, 2)
+    assert [result["index"] for result in body["results"]] == [0, 1, 2, 3]
+    assert [result["error"] for result in body["results"]] == [None, "Receiver not found.", None, "Receiver not found."]
+    sent = [result["message"] for result in body["results"] if result["message"]]
+    assert [(message["content"], message["receiver_id"]) for message in sent] == [("one", bob_id), ("two", bob_id)]
+    assert sent[0]["id"] < sent[1]["id"]
+    assert [message["content"] for message in page(client, alice, bob_id)["messages"]] == ["one", "two"]
@@ -0,0 +1,53 @@
+from app.core.metrics import CONTENT_TYPE, Counter, Gauge, Histogram, Registry
+
+
+def test_counters_and_gauges_render_with_escaped_labels():
+    registry = Registry()
+    counter = Counter("frames_total", "Frames sent.", ("policy",), registry=registry)
+    counter.labels('say "hi"\n').inc()
+    counter.labels("drop").inc(2.5)
+    gauge = Gauge("queue_depth", "Queued frames.", registry=registry)
+    gauge.set_function(lambda: 7)
+
+    assert registry.render() == (
+        "# HELP frames_total Frames sent.\n"
+        "# TYPE frames_total counter\n"
+        'frames_total{policy="say \\"hi\\"\\n"} 1\n'
+        'frames_total{policy="drop"} 2.5\n'
+        "# HELP queue_depth Queued frames.\n"
+        "# TYPE queue_depth gauge\n"
+        "queue_depth 7\n"
+    )
+
+
+def test_failing_gauge_functions_render_no_sample():
+    registry = Registry()
+    Gauge("broken", "Raises at scrape time.", registry=registry).set_function(lambda: 1 / 0)
+    assert registry.render() == "# HELP broken Raises at scrape time.\n# TYPE broken gauge\n"
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = Histogram("latency_seconds", "Latency.", ("route",), buckets=(0.5, 0.1), registry=registry)
+    for value in (0.05, 0.1, 0.3, 2):
+        histogram.labels("/x").observe(value)
+
+    assert registry.render().splitlines()[2:] == [
+        'latency_seconds_bucket{route="/x",le="0.1"} 2',
+        'latency_seconds_bucket{route="/x",le="0.5"} 3',
+        'latency_seconds_bucket{route="/x",le="+Inf"} 4',
+        'latency_seconds_sum{route="/x"} 2.45',
+        'latency_seconds_count{route="/x"} 4',
+    ]
+
+
+def test_metrics_endpoint_labels_requests_by_route_template(client, signup):
+    _, alice = signup("alice")
+    client.get("/messaging/get/2", headers=alice)
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == CONTENT_TYPE
+    assert "# TYPE http_request_duration_seconds histogram" in response.text
+    assert 'route="/messaging/get/{user_id}"' in response.text
+    assert 'route="/messaging/get/2"' not in response.text
@@ -0,0 +1,71 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.password_pool import PasswordPool, get_password_pool
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_jobs_beyond_the_queue_are_rejected():
+    pool = PasswordPool(max_workers=1, max_queue=1, rounds=4)
+    release = threading.Event()
+    try:
+        running = asyncio.ensure_future(pool._run(release.wait))
+        queued = asyncio.ensure_future(pool._run(release.wait))
+        await asyncio.sleep(0.01)
+        assert (pool.in_flight, pool.queue_depth) == (2, 1)
+
+        with pytest.raises(HTTPException) as rejected:
+            await pool.hash_password("pw")
+        assert rejected.value.status_code == 503
+        assert rejected.value.headers == {"Retry-After": "1"}
+        assert pool.rejected == 1
+
+        release.set()
+        assert await running and await queued
+        assert pool.in_flight == 0
+        assert await pool.verify_password("pw", await pool.hash_password("pw"))
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def test_saturated_pool_answers_503_with_retry_after(client, signup):
+    signup("alice")
+    pool = get_password_pool()
+    pool.in_flight = pool.max_workers + pool.max_queue
+    try:
+        response = client.post("/auth/login", json={"email": "alice@example.com", "password": "pw"})
+    finally:
+        pool.in_flight = 0
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+async def test_cancelled_requests_hold_their_slot_until_the_job_finishes():
+    pool = PasswordPool(max_workers=1, max_queue=1, rounds=4)
+    release = threading.Event()
+    try:
+        running = asyncio.ensure_future(pool._run(release.wait))
+        queued = asyncio.ensure_future(pool._run(release.wait))
+        await asyncio.sleep(0.01)
+        running.cancel()
+        queued.cancel()
+        await asyncio.sleep(0.01)
+        # The queued job never starts; the running one still occupies its thread
+        assert pool.in_flight == 1
+        with pytest.raises(HTTPException):
+            await asyncio.gather(*(pool._run(release.wait) for _ in range(2)))
+
+        release.set()
+        for _ in range(100):
+            if pool.in_flight == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert pool.in_flight == 0
+    finally:
+        release.set()
+        pool.shutdown()
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+from fake_supabase import FakeSupabase
+
+from app.sockets.persistence import MessageWriter
+
+pytestmark = pytest.mark.anyio
+
+
+class FlakyHook:
+    """
+    An on_insert hook that fails its first `failures` calls, like a database briefly unreachable.
+    """
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = []
+
+    async def __call__(self, rows):
+        self.calls.append([row["id"] for row in rows])
+        if len(self.calls) <= self.failures:
+            raise ConnectionError("database unavailable")
+
+
+async def test_failed_hooks_are_retried_with_the_next_batch():
+    hook = FlakyHook(failures=1)
+    writer = MessageWriter(client=FakeSupabase(), on_insert=hook, retry_delay=60)
+    await writer.start()
+    try:
+        # The message is stored even though the hook failed
+        first = await writer.insert_message({"sender_id": 1, "receiver_id": 2})
+        second = await writer.insert_message({"sender_id": 1, "receiver_id": 2})
+    finally:
+        await writer.close()
+    assert hook.calls == [[first["id"]], [first["id"], second["id"]]]
+
+
+async def test_failed_hooks_are_retried_when_idle():
+    hook = FlakyHook(failures=2)
+    writer = MessageWriter(client=FakeSupabase(), on_insert=hook, retry_delay=0.01)
+    await writer.start()
+    try:
+        stored = await writer.insert_message({"sender_id": 1, "receiver_id": 2})
+        for _ in range(100):
+            if len(hook.calls) == 3:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await writer.close()
+    assert hook.calls == [[stored["id"]]] * 3
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+from app.models.conversation import ConversationSummary, ReadReceipt
+from app.services.inbox import apply_watermarks, load_last_message_ids
+from app.services.receipts import ReceiptCoalescer, load_watermarks, message_status
+
+pytestmark = pytest.mark.anyio
+
+
+def make_coalescer(db, events, window: float = 60) -> ReceiptCoalescer:
+    async def notify(user_ids, event):
+        events.append((sorted(user_ids), event))
+
+    return ReceiptCoalescer(session_factory=db, window=window, notify=notify, on_flush=apply_watermarks,
+                            bound=load_last_message_ids)
+
+
+async def test_flush_writes_one_watermark_per_conversation(db, users, send):
+    alice, bob = users["alice"], users["bob"]
+    sent = await send(alice, bob, ["one", "two", "three"])
+    events = []
+    coalescer = make_coalescer(db, events)
+
+    coalescer.record(bob, alice, "delivered", sent[1])
+    coalescer.record(bob, alice, "seen", sent[0])
+    coalescer.record(bob, alice, "delivered", sent[2])
+    assert coalescer.pending == 1
+    await coalescer.flush()
+
+    async with db() as session:
+        assert await load_watermarks([(bob, alice)], session) == {(bob, alice): (sent[2], sent[0])}
+    assert events == [([alice, bob], {"type": "receipt", "reader_id": bob, "sender_id": alice,
+                                      "delivered_up_to": sent[2], "seen_up_to": sent[0]})]
+    assert message_status(sent[0], sent[2], sent[0]) == "seen"
+    assert message_status(sent[1], sent[2], sent[0]) == "delivered"
+
+
+async def test_watermarks_never_move_back(db, users, send):
+    alice, bob = users["alice"], users["bob"]
+    sent = await send(alice, bob, ["one", "two"])
+    coalescer = make_coalescer(db, [])
+
+    coalescer.record(bob, alice, "seen", sent[1])
+    await coalescer.flush()
+    coalescer.record(bob, alice, "seen", sent[0])
+    await coalescer.flush()
+
+    async with db() as session:
+        assert await load_watermarks([(bob, alice)], session) == {(bob, alice): (sent[1], sent[1])}
+
+
+async def test_watermarks_are_capped_at_the_newest_message(db, users, send):
+    alice, bob, carol = users["alice"], users["bob"], users["carol"]
+    sent = await send(alice, bob, ["one", "two"])
+    coalescer = make_coalescer(db, [])
+
+    coalescer.record(bob, alice, "seen", 10 ** 12)
+    # No conversation between carol and alice: nothing to mark read
+    coalescer.record(carol, alice, "seen", 5)
+    await coalescer.flush()
+
+    async with db() as session:
+        assert await load_watermarks([(bob, alice), (carol, alice)], session) == {(bob, alice): (sent[1], sent[1])}
+        assert [receipt.user_id for receipt in (await session.execute(select(ReadReceipt))).scalars()] == [bob]
+
+
+async def test_seen_watermark_clears_unread_count(db, users, send):
+    alice, bob = users["alice"], users["bob"]
+    sent = await send(alice, bob, ["one", "two", "three"])
+    coalescer = make_coalescer(db, [])
+
+    async def unread():
+        async with db() as session:
+            return await session.scalar(select(ConversationSummary.unread_count).where(
+                ConversationSummary.user_id == bob, ConversationSummary.peer_id == alice))
+
+    assert await unread() == 3
+    coalescer.record(bob, alice, "seen", sent[0])
+    await coalescer.flush()
+    assert await unread() == 2
+    coalescer.record(bob, alice, "seen", sent[2])
+    await coalescer.flush()
+    assert await unread() == 0
+
+
+async def test_timer_flushes_after_the_window(db, users, send):
+    alice, bob = users["alice"], users["bob"]
+    [message_id] = await send(alice, bob, ["one"])
+    events = []
+    coalescer = make_coalescer(db, events, window=0.01)
+
+    coalescer.record(bob, alice, "delivered", message_id)
+    for _ in range(100):
+        if events:
+            break
+        await asyncio.sleep(0.01)
+    await coalescer.close()
+
+    assert coalescer.pending == 0
+    assert [event["delivered_up_to"] for _, event in events] == [message_id]
+
+
+async def test_invalid_receipts_are_rejected(db):
+    coalescer = make_coalescer(db, [])
+    for status, message_id in (("read", 1), ("seen", 0), ("seen", "7"), ("seen", True)):
+        with pytest.raises(ValueError):
+            coalescer.record(2, 1, status, message_id)
+    assert coalescer.pending == 0
@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from app.services.resolver import USERNAME, UserResolver
+
+pytestmark = pytest.mark.anyio
+
+
+def make_resolver() -> UserResolver:
+    return UserResolver(maxsize=100, ttl=60, negative_ttl=60)
+
+
+async def test_concurrent_misses_share_one_lookup():
+    resolver, calls = make_resolver(), []
+    release = asyncio.Event()
+
+    async def load(value):
+        calls.append(value)
+        await release.wait()
+        return 7
+
+    lookups = [asyncio.create_task(resolver.resolve(USERNAME, "alice", load)) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.gather(*lookups) == [7] * 5
+    assert calls == ["alice"]
+    # Now cached: no further loads
+    assert await resolver.resolve(USERNAME, "alice", load) == 7
+    assert calls == ["alice"]
+
+
+async def test_unknown_names_are_cached_as_missing():
+    resolver, calls = make_resolver(), []
+
+    async def load(value):
+        calls.append(value)
+        return None
+
+    assert await resolver.resolve(USERNAME, "ghost", load) is None
+    assert await resolver.resolve(USERNAME, "ghost", load) is None
+    assert calls == ["ghost"]
+
+
+async def test_failure_reaches_every_waiter_and_is_not_cached():
+    resolver, calls = make_resolver(), []
+    release = asyncio.Event()
+
+    async def load(value):
+        calls.append(value)
+        await release.wait()
+        raise RuntimeError("database down")
+
+    lookups = [asyncio.create_task(resolver.resolve(USERNAME, "alice", load)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*lookups, return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len(calls) == 1
+
+    async def load_ok(value):
+        return 3
+
+    assert await resolver.resolve(USERNAME, "alice", load_ok) == 3
+
+
+async def test_cancelled_leader_does_not_strand_waiters():
+    resolver, calls = make_resolver(), []
+    release = asyncio.Event()
+
+    async def load(value):
+        calls.append(value)
+        await release.wait()
+        return 7
+
+    leader = asyncio.create_task(resolver.resolve(USERNAME, "alice", load))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(resolver.resolve(USERNAME, "alice", load))
+    await asyncio.sleep(0)
+    leader.cancel()
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.wait_for(waiter, 1) == 7
+    assert len(calls) == 2
+
+
+async def test_resolve_many_loads_only_misses_in_one_call():
+    resolver, calls = make_resolver(), []
+
+    async def load_one(value):
+        return 1
+
+    async def load_many(values):
+        calls.append(set(values))
+        return {"bob": 2}
+
+    await resolver.resolve(USERNAME, "alice", load_one)
+    resolved = await resolver.resolve_many(USERNAME, ["alice", "bob", "ghost", "bob"], load_many)
+
+    assert resolved == {"alice": 1, "bob": 2}
+    assert calls == [{"bob", "ghost"}]
+    assert await resolver.resolve_many(USERNAME, ["bob", "ghost"], load_many) == {"bob": 2}
+    assert len(calls) == 1
@@ -0,0 +1,247 @@
+import json
+from datetime import datetime
+
+import pytest
+from sqlalchemy import delete, func, select
+
+from app.db import SessionLocal
+from app.models.event import UserEvent
+from app.models.message import Message
+from app.services.events import upsert_horizon
+from app.sockets.codecs import from_bytea
+from test_attachments import DATA, upload
+
+
+@pytest.fixture
+def chat(client, signup):
+    """
+    Sign up alice and bob; returns a function that opens a WebSocket for either, with extra query parameters.
+    """
+    tokens = {}
+    for name in ("alice", "bob"):
+        _, headers = signup(name)
+        tokens[name] = headers["Authorization"].split(" ", 1)[1]
+
+    def connect(name: str, **params):
+        query = "&".join(f"{key}={value}" for key, value in {"token": tokens[name], **params}.items())
+        return client.websocket_connect(f"/ws/message/{name}?{query}")
+
+    return connect
+
+
+def message(n: int) -> dict:
+    return {"type": "message", "content": f"hi {n}", "sender_username": "alice", "receiver_username": "bob",
+            "client_message_id": f"c{n}"}
+
+
+def send_from_alice(chat, *numbers):
+    """
+    Send messages over alice's socket and wait for each echo; returns the echoed events. An echo
+    carries its `event_id`, so by then the events are in the log.
+    """
+    echoes = []
+    with chat("alice") as alice:
+        assert alice.receive_json()["type"] == "session"
+        for n in numbers:
+            alice.send_json(message(n))
+            echoes.append(alice.receive_json())
+    assert all(echo.get("event_id") for echo in echoes)
+    return echoes
+
+
+def test_every_connection_starts_with_a_session(chat):
+    with chat("bob") as bob:
+        session = bob.receive_json()
+    assert session["type"] == "session"
+    assert session["resume_token"]
+    assert session["seq"] == 0
+
+
+def test_since_replays_only_missed_events(chat):
+    echoes = send_from_alice(chat, 1, 2)
+    assert [echo["client_message_id"] for echo in echoes] == ["c1", "c2"]
+
+    with chat("bob", since=0) as bob:
+        assert bob.receive_json()["type"] == "session"
+        replayed = [bob.receive_json(), bob.receive_json()]
+        sync = bob.receive_json()
+    assert [event["client_message_id"] for event in replayed] == ["c1", "c2"]
+    assert sync["type"] == "sync" and sync["status"] == "complete" and sync["replayed"] == 2
+    last = sync["event_id"]
+    assert last == replayed[-1]["event_id"]
+
+    send_from_alice(chat, 3)
+    with chat("bob", since=last) as bob:
+        bob.receive_json()
+        [missed, sync] = [bob.receive_json(), bob.receive_json()]
+    assert missed["client_message_id"] == "c3"
+    assert (sync["type"], sync["replayed"], sync["event_id"]) == ("sync", 1, missed["event_id"])
+
+    # Nothing missed since then
+    with chat("bob", since=sync["event_id"]) as bob:
+        bob.receive_json()
+        sync = bob.receive_json()
+    assert (sync["type"], sync["status"], sync["replayed"]) == ("sync", "complete", 0)
+
+
+def replicate(client, rows):
+    """
+    Copy rows the writer stored in the fake Supabase into the database the REST routes read,
+    which in production is the same one.
+    """
+    async def insert():
+        async with SessionLocal() as session:
+            session.add_all([Message(
+                id=row["id"], sender_id=row["sender_id"], receiver_id=row["receiver_id"],
+                nonce=from_bytea(row["nonce"]), ciphertext=from_bytea(row["ciphertext"]),
+                timestamp=datetime.fromisoformat(row["timestamp"]), status=row["status"],
+                attachment_id=row.get("attachment_id"),
+            ) for row in rows])
+            await session.commit()
+
+    client.portal.call(insert)
+
+
+def login(client, name: str) -> dict:
+    body = client.post("/auth/login", json={"email": f"{name}@example.com", "password": "pw"}).json()
+    return {"Authorization": f"Bearer {body['access_token']}"}
+
+
+def test_socket_messages_read_back_decrypted_over_rest(chat, client, fake_supabase):
+    [echo] = send_from_alice(chat, 1)
+    [stored] = fake_supabase.tables["messages"]
+    assert stored.get("content") is None
+    replicate(client, [stored])
+    alice = login(client, "alice")
+
+    [page_message] = client.get(f"/messaging/get/{stored['receiver_id']}", headers=alice).json()["messages"]
+    assert (page_message["id"], page_message["content"]) == (echo["message_id"], "hi 1")
+    exported = client.get(f"/messaging/export/{stored['receiver_id']}", headers=alice).text.splitlines()
+    assert [json.loads(line)["content"] for line in exported] == ["hi 1"]
+
+
+def test_socket_deletes_are_checked_and_update_the_inbox(chat, client, fake_supabase):
+    [first, second] = send_from_alice(chat, 1, 2)
+    replicate(client, fake_supabase.tables["messages"])
+    bob_id = fake_supabase.tables["messages"][0]["receiver_id"]
+    alice, bob = login(client, "alice"), login(client, "bob")
+
+    # Only the sender may unsend; anyone else's request ends their socket
+    with chat("bob") as socket:
+        socket.receive_json()
+        socket.send_json({"type": "delete_message", "message_id": first["message_id"]})
+        assert socket.receive()["status"] == 403
+
+    with chat("bob") as listener, chat("alice") as socket:
+        listener.receive_json()
+        socket.receive_json()
+        socket.send_json({"type": "delete_message", "message_id": second["message_id"]})
+        deleted = listener.receive_json()
+    assert (deleted["type"], deleted["message_id"]) == ("delete_message", second["message_id"])
+
+    page = client.get(f"/messaging/get/{bob_id}", headers=alice).json()["messages"]
+    assert [message["content"] for message in page] == ["hi 1"]
+    [conversation] = client.get("/messaging/inbox", headers=bob).json()["conversations"]
+    assert (conversation["last_message_id"], conversation["preview"]) == (first["message_id"], "hi 1")
+
+
+def test_socket_deletes_change_the_conversation_etag(chat, client, fake_supabase):
+    [first, second] = send_from_alice(chat, 1, 2)
+    replicate(client, fake_supabase.tables["messages"])
+    bob_id = fake_supabase.tables["messages"][0]["receiver_id"]
+    alice = login(client, "alice")
+    etag = client.get(f"/messaging/get/{bob_id}", headers=alice).headers["ETag"]
+
+    for message_id in (first["message_id"], second["message_id"]):
+        with chat("alice") as socket:
+            socket.receive_json()
+            socket.send_json({"type": "delete_message", "message_id": message_id})
+            assert socket.receive_json()["type"] == "delete_message"
+        response = client.get(f"/messaging/get/{bob_id}", headers={**alice, "If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+        etag = response.headers["ETag"]
+    assert response.json()["messages"] == []
+
+
+def test_socket_messages_share_and_release_attachments(chat, client, fake_supabase):
+    alice, bob = login(client, "alice"), login(client, "bob")
+    attachment_id = upload(client, alice)
+    bobs_upload = upload(client, bob)
+
+    with chat("alice") as socket:
+        socket.receive_json()
+        socket.send_json({**message(1), "attachment_id": attachment_id})
+        echo = socket.receive_json()
+    assert echo["attachment_id"] == attachment_id
+    [stored] = fake_supabase.tables["messages"]
+    assert stored["attachment_id"] == attachment_id
+
+    # Someone else's upload cannot be attached
+    with chat("alice") as socket:
+        socket.receive_json()
+        socket.send_json({**message(2), "attachment_id": bobs_upload})
+        assert socket.receive()["status"] == 400
+    assert len(fake_supabase.tables["messages"]) == 1
+
+    replicate(client, [stored])
+    assert client.get(f"/attachments/{attachment_id}/content", headers=bob).content == DATA
+    with chat("alice") as socket:
+        socket.receive_json()
+        socket.send_json({"type": "delete_message", "message_id": echo["message_id"]})
+        assert socket.receive_json()["type"] == "delete_message"
+    # The attachment went with the only message that shared it
+    assert client.get(f"/attachments/{attachment_id}/content", headers=alice).status_code == 404
+
+
+def test_since_behind_the_pruned_horizon_asks_for_a_resync(chat, client):
+    send_from_alice(chat, 1)
+
+    async def prune_elsewhere():
+        # What another worker's prune leaves behind: the events gone and the shared horizon moved
+        async with SessionLocal() as session:
+            cutoff = await session.scalar(select(func.max(UserEvent.id)))
+            await session.execute(delete(UserEvent).where(UserEvent.id <= cutoff))
+            await session.execute(upsert_horizon(session.get_bind().dialect.name, cutoff))
+            await session.commit()
+
+    client.portal.call(prune_elsewhere)
+
+    with chat("bob", since=0) as bob:
+        bob.receive_json()
+        sync = bob.receive_json()
+    assert (sync["type"], sync["status"]) == ("sync", "resync_required")
+
+
+def test_resume_replays_missed_events_from_memory(chat):
+    with chat("bob") as bob:
+        session = bob.receive_json()
+        send_from_alice(chat, 1)
+        live = bob.receive_json()
+    assert live["client_message_id"] == "c1"
+    assert live["seq"] == session["seq"] + 1
+
+    send_from_alice(chat, 2, 3)
+    with chat("bob", resume=session["resume_token"], seq=live["seq"]) as bob:
+        resumed = bob.receive_json()
+        missed = [bob.receive_json(), bob.receive_json()]
+        sync = bob.receive_json()
+    assert resumed["type"] == "session" and resumed["resume_token"] == session["resume_token"]
+    assert [(event["client_message_id"], event["seq"]) for event in missed] == [("c2", live["seq"] + 1),
+                                                                                 ("c3", live["seq"] + 2)]
+    assert (sync["type"], sync["status"], sync["replayed"]) == ("sync", "complete", 2)
+
+
+def test_unknown_resume_token_falls_back_to_since(chat):
+    send_from_alice(chat, 1)
+
+    with chat("bob", resume="bogus", seq=1) as bob:
+        bob.receive_json()
+        sync = bob.receive_json()
+    assert (sync["type"], sync["status"]) == ("sync", "resync_required")
+
+    with chat("bob", resume="bogus", seq=1, since=0) as bob:
+        bob.receive_json()
+        [missed, sync] = [bob.receive_json(), bob.receive_json()]
+    assert missed["client_message_id"] == "c1"
+    assert (sync["type"], sync["status"], sync["replayed"]) == ("sync", "complete", 1)